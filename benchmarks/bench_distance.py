@@ -0,0 +1,42 @@
+"""Micro-benchmark: calculate_distance (escalar) vs haversine_distances (NumPy)
+
+Uso: python benchmarks/bench_distance.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from biogas_geo import calculate_distance, haversine_distances  # noqa: E402
+
+SIZES = [1_000, 100_000, 1_000_000]
+BASE_LAT, BASE_LON = -23.634578, -46.42598
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'n':>10} {'escalar (ns/linha)':>20} {'numpy (ns/linha)':>18} {'speedup':>8} {'erro máx (m)':>13}")
+
+    for n in SIZES:
+        lats = BASE_LAT + rng.uniform(-0.05, 0.05, n)
+        lons = BASE_LON + rng.uniform(-0.05, 0.05, n)
+        lat_list, lon_list = lats.tolist(), lons.tolist()
+
+        start = time.perf_counter()
+        scalar = [calculate_distance(BASE_LAT, BASE_LON, la, lo) for la, lo in zip(lat_list, lon_list)]
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector = haversine_distances(BASE_LAT, BASE_LON, lats, lons)
+        vector_time = time.perf_counter() - start
+
+        error = np.max(np.abs(np.asarray(scalar) - vector))
+        print(f"{n:>10} {scalar_time / n * 1e9:>20.1f} {vector_time / n * 1e9:>18.1f} "
+              f"{scalar_time / vector_time:>7.1f}x {error:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Tempo das interações reais (clique → fim da execução) num servidor Streamlit
+
+Sobe a interface de avaliação numa cópia temporária, com avaliações e
+tecnologias importadas pela linha de comando, e conversa com ela pelo
+websocket como o navegador: cada clique envia os estados dos widgets e o
+fragmento onde o botão está, e o tempo conta até o servidor terminar a
+execução (inclusive o st.rerun disparado pelo clique). Assim se compara o
+custo de uma interação dentro de um fragmento com uma execução completa.
+
+Uso: python benchmarks/bench_interaction.py
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from biogas_data import PLANT_CSV, load_plants, plant_ids  # noqa: E402
+
+APP = 'enhanced_biogas_assessment.py'
+N_ASSESSED = 20
+TECHS_PER_PLANT = 3
+REPEATS = 3
+FINISHED = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY)
+
+
+def seed_backup(directory):
+    """Backup JSON com avaliações pendentes e tecnologias para as primeiras plantas"""
+    df = load_plants(os.path.join(directory, PLANT_CSV))
+    ids = plant_ids(df)
+    assessments, coordinates = {}, {}
+    for i in range(N_ASSESSED):
+        lat, lon = float(df['Latitude'].iat[i]), float(df['Longitude'].iat[i])
+        assessments[ids[i]] = {
+            'plant_index': i, 'municipio': df['Municipio'].iat[i], 'latitude': lat, 'longitude': lon,
+            'has_plant': True, 'tech_level': ('ALTA', 'MEDIA', 'BAIXA')[i % 3], 'confidence': 80,
+            'observations': '', 'ml_notes': '', 'technology_count': TECHS_PER_PLANT,
+            'timestamp': f"2026-01-01T00:00:{i:02d}", 'validation_status': 'PENDING', 'assessor': 'Bench'
+        }
+        coordinates[ids[i]] = [
+            {'lat': lat + k * 1e-4, 'lon': lon, 'type': 'lagoas', 'area': 100.0, 'notes': ''}
+            for k in range(TECHS_PER_PLANT)
+        ]
+    path = os.path.join(directory, 'bench_backup.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'assessments': assessments, 'coordinates': coordinates, 'validations': {}}, f)
+    return path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Session:
+    """Cliente mínimo do protocolo do Streamlit (BackMsg/ForwardMsg em protobuf)"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.widgets = {}   # rótulo → (id, fragmento)
+        self.values = {}    # id → valor de texto
+
+    async def run(self, trigger=None):
+        """Pede uma execução (com um clique opcional) e devolve sua duração em ms"""
+        message = BackMsg()
+        state = message.rerun_script
+        state.SetInParent()
+        for widget_id, value in self.values.items():
+            widget = state.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.string_value = value
+        if trigger is not None:
+            widget_id, fragment_id = self.widgets[trigger]
+            widget = state.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.trigger_value = True
+            state.fragment_id = fragment_id
+
+        start = time.perf_counter()
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.connection.read_message())
+            kind = msg.WhichOneof('type')
+            if kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+                element = msg.delta.new_element
+                widget = getattr(element, element.WhichOneof('type'))
+                if hasattr(widget, 'id') and hasattr(widget, 'label'):
+                    self.widgets[widget.label] = (widget.id, msg.delta.fragment_id)
+            elif kind == 'script_finished' and msg.script_finished in FINISHED:
+                return (time.perf_counter() - start) * 1e3
+
+    def find(self, prefix):
+        return next((label for label in self.widgets if label.startswith(prefix)), None)
+
+
+async def measure(port):
+    connection = await websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream")
+    session = Session(connection)
+    await session.run()
+    session.values[session.widgets["Nome do avaliador:"][0]] = 'Bench'
+    await session.run()
+
+    results = {}
+    results['execução completa'] = [await session.run() for _ in range(REPEATS)]
+    results['🗑️ Remover (fragmento do mapa)'] = [
+        await session.run(session.find("🗑️ Remover")) for _ in range(REPEATS)
+    ]
+    results['💾 Salvar Validação (fragmento da validação)'] = [
+        await session.run(session.find("💾 Salvar Validação")) for _ in range(REPEATS)
+    ]
+    connection.close()
+    return results
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    server = None
+    try:
+        for name in os.listdir(ROOT):
+            if name.endswith('.py') or name == PLANT_CSV:
+                shutil.copy(os.path.join(ROOT, name), directory)
+        subprocess.run([sys.executable, 'biogas_cli.py', 'import', seed_backup(directory)],
+                       cwd=directory, check=True, stdout=subprocess.DEVNULL)
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'streamlit', 'run', APP, '--server.headless', 'true',
+             '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+            cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+
+        results = asyncio.run(measure(port))
+        for name, durations in results.items():
+            print(f"{name:46s} " + "  ".join(f"{d:7.1f} ms" for d in durations))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Micro-benchmark do índice espacial em grade (PlantSpatialIndex)
+
+Uso: python benchmarks/bench_spatial.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from biogas_geo import haversine_distances  # noqa: E402
+from biogas_spatial import PlantSpatialIndex  # noqa: E402
+
+N_POINTS = 100_000
+N_QUERIES = 1_000
+
+
+def main():
+    rng = np.random.default_rng(42)
+    # Aproximadamente a extensão do estado de São Paulo
+    lats = rng.uniform(-25.3, -19.8, N_POINTS)
+    lons = rng.uniform(-53.1, -44.2, N_POINTS)
+
+    start = time.perf_counter()
+    index = PlantSpatialIndex(lats, lons)
+    print(f"construção ({N_POINTS} pontos): {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    queries = rng.integers(0, N_POINTS, N_QUERIES)
+    for radius in (500, 5000):
+        start = time.perf_counter()
+        found = 0
+        for i in queries:
+            indices, _ = index.query_radius(lats[i], lons[i], radius)
+            found += len(indices)
+        elapsed = (time.perf_counter() - start) / N_QUERIES
+        print(f"raio {radius:>5} m: {elapsed * 1e6:8.1f} µs/consulta ({found / N_QUERIES:.1f} vizinhos em média)")
+
+    # Conferência contra a varredura completa
+    for i in queries[:50]:
+        brute = np.flatnonzero(haversine_distances(lats[i], lons[i], lats, lons) <= 5000)
+        assert set(brute) == set(index.query_radius(lats[i], lons[i], 5000)[0])
+
+    start = time.perf_counter()
+    for i in queries:
+        index.nearest(lats[i], lons[i], k=5, exclude=i)
+    print(f"5 vizinhos mais próximos: {(time.perf_counter() - start) / N_QUERIES * 1e6:8.1f} µs/consulta")
+
+
+if __name__ == '__main__':
+    main()
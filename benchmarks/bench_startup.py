@@ -0,0 +1,71 @@
+"""Micro-benchmark da retomada na inicialização (snapshot + journal → SQLite)
+
+Compara o custo de abrir uma sessão com o histórico já aplicado no banco
+contra o carregamento completo antigo, e mostra que a retomada cresce com
+os eventos novos e não com o total de avaliações.
+
+Uso: python benchmarks/bench_startup.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from biogas_db import BiogasDatabase, LazyRecords  # noqa: E402
+from biogas_journal import AssessmentJournal, empty_state  # noqa: E402
+from biogas_queue import ValidationQueue  # noqa: E402
+from biogas_stats import AssessmentCounters  # noqa: E402
+
+N_ASSESSMENTS = 50_000
+NEW_EVENTS = (0, 100, 1_000)
+
+
+def assessment(i):
+    return {
+        'plant_index': i, 'municipio': f"Municipio {i % 600}", 'latitude': -22.0, 'longitude': -47.0,
+        'has_plant': True, 'tech_level': ('ALTA', 'MEDIA', 'BAIXA', 'SEM_PLANTA')[i % 4],
+        'confidence': 50 + i % 50, 'observations': 'x' * 80, 'timestamp': f"2026-01-01T00:{i:08d}",
+        'validation_status': 'PENDING', 'assessor': 'Bench'
+    }
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1e3
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        state = empty_state()
+        state['assessments'] = {f"plant_{i:05d}": assessment(i) for i in range(N_ASSESSMENTS)}
+        journal = AssessmentJournal(directory, compact_every=10 ** 9)
+        db = BiogasDatabase(os.path.join(directory, 'biogas.sqlite'))
+        db.import_state(state, journal.last_seq)
+
+        _, full = timed(lambda: (db.load_assessments(), db.load_coordinates()))
+        print(f"carregamento completo ({N_ASSESSMENTS} avaliações): {full:.1f} ms")
+
+        def open_session():
+            LazyRecords(db.assessment_ids(), db.load_assessment)
+            ValidationQueue.from_rows(db.queue_rows())
+            AssessmentCounters.from_database(db)
+
+        _, lazy = timed(open_session)
+        print(f"abertura de sessão sob demanda: {lazy:.1f} ms")
+
+        for new_events in NEW_EVENTS:
+            for i in range(new_events):
+                journal.append('validation', f"plant_{i:05d}", {'validation_status': 'VALIDATED'})
+            applied, elapsed = timed(lambda: db.catch_up(journal))
+            print(f"retomada com {new_events:>5} eventos novos: {elapsed:8.1f} ms ({applied} aplicados)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
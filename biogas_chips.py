@@ -0,0 +1,394 @@
+"""Recorte de chips de imagem (GeoTIFF) em volta das tecnologias mapeadas.
+
+Cada coordenada de tecnologia vira uma amostra rotulada: uma janela de
+`size` × `size` pixels centrada no ponto, lida sem carregar o raster
+inteiro. Com rasterio instalado a leitura é por janela (qualquer GeoTIFF);
+sem ele, GeoTIFFs sem compressão são mapeados em memória com numpy
+(EPSG:4326, UTM WGS84 e Web Mercator).
+"""
+import io
+import math
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from biogas_storage import atomic_write_bytes, atomic_write_csv
+
+try:
+    import rasterio
+    from rasterio.warp import transform as warp_transform
+    from rasterio.windows import Window
+except ImportError:  # sem rasterio: apenas GeoTIFF sem compressão, via memmap
+    rasterio = None
+
+CHIP_SIZE = 64
+CHIPS_DIR = 'biogas_chips'
+CHIPS_INDEX = 'chips.csv'
+CHIPS_PER_BATCH = 512
+# Maior lado lido por sample() no rasterio; janelas maiores são decimadas
+SAMPLE_READ_LIMIT = 2048
+
+# Colunas da exportação ML levadas para o índice de chips
+SAMPLE_COLUMNS = {
+    'technology_id': 'sample_id',
+    'plant_id': 'plant_id',
+    'tech_latitude': 'latitude',
+    'tech_longitude': 'longitude',
+    'technology_type': 'label',
+    'overall_technology_level': 'tech_level',
+    'estimated_area_m2': 'area_m2',
+    'validation_status': 'validation_status',
+}
+# Rótulo das amostras na coordenada base de plantas sem tecnologias mapeadas
+# (o nível da avaliação continua em tech_level)
+BASE_LABEL = 'base'
+
+# Tags TIFF/GeoTIFF usadas pelo leitor e pelo gravador
+TAG_WIDTH, TAG_HEIGHT, TAG_BITS, TAG_COMPRESSION = 256, 257, 258, 259
+TAG_PHOTOMETRIC, TAG_STRIP_OFFSETS, TAG_SAMPLES, TAG_ROWS_PER_STRIP = 262, 273, 277, 278
+TAG_STRIP_BYTES, TAG_PLANAR, TAG_TILE_WIDTH, TAG_SAMPLE_FORMAT = 279, 284, 322, 339
+TAG_PIXEL_SCALE, TAG_TIEPOINT, TAG_GEO_KEYS, TAG_NODATA = 33550, 33922, 34735, 42113
+GEOKEY_GEOGRAPHIC, GEOKEY_PROJECTED = 2048, 3072
+
+_TIFF_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i', 11: 'f', 12: 'd', 16: 'Q'}
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def _read_tags(f, byte_order):
+    """Tags do primeiro IFD de um TIFF clássico: {tag: tupla de valores}"""
+    f.seek(4)
+    (ifd_offset,) = struct.unpack(byte_order + 'I', f.read(4))
+    f.seek(ifd_offset)
+    (count,) = struct.unpack(byte_order + 'H', f.read(2))
+    tags = {}
+    for _ in range(count):
+        tag, kind, n, value = struct.unpack(byte_order + 'HHI4s', f.read(12))
+        fmt = _TIFF_TYPES.get(kind)
+        if fmt is None:
+            continue
+        size = n * struct.calcsize(fmt)
+        if size > 4:
+            position = f.tell()
+            f.seek(struct.unpack(byte_order + 'I', value)[0])
+            value = f.read(size)
+            f.seek(position)
+        if fmt == 's':
+            tags[tag] = (value[:n].rstrip(b'\0').decode('ascii'),)
+        else:
+            tags[tag] = struct.unpack(f"{byte_order}{n}{fmt}", value[:size])
+    return tags
+
+
+def _geokey_epsg(geo_keys):
+    """EPSG do sistema projetado (ou geográfico) declarado no GeoKeyDirectory"""
+    keys = {geo_keys[i]: geo_keys[i + 3] for i in range(4, len(geo_keys), 4) if geo_keys[i + 1] == 0}
+    return keys.get(GEOKEY_PROJECTED) or keys.get(GEOKEY_GEOGRAPHIC)
+
+
+def lonlat_to_crs(lons, lats, epsg):
+    """Projeta lon/lat (WGS84) para o CRS do raster: EPSG:4326, 3857 ou UTM 326xx/327xx"""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    if epsg == 4326:
+        return lons, lats
+    if epsg == 3857:
+        radius = 6378137.0
+        return radius * np.radians(lons), radius * np.log(np.tan(np.pi / 4 + np.radians(lats) / 2))
+    if not (32601 <= epsg <= 32660 or 32701 <= epsg <= 32760):
+        raise ValueError(f"EPSG:{epsg} requer rasterio")
+
+    # Transversa de Mercator (Snyder, Map Projections, eq. 8-9 a 8-10)
+    a, f, k0 = 6378137.0, 1 / 298.257223563, 0.9996
+    e2 = f * (2 - f)
+    ep2 = e2 / (1 - e2)
+    zone = epsg % 100
+    phi = np.radians(lats)
+    lam0 = math.radians((zone - 1) * 6 - 180 + 3)
+    n = a / np.sqrt(1 - e2 * np.sin(phi) ** 2)
+    t = np.tan(phi) ** 2
+    c = ep2 * np.cos(phi) ** 2
+    big_a = np.cos(phi) * (np.radians(lons) - lam0)
+    m = a * (
+        (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256) * phi
+        - (3 * e2 / 8 + 3 * e2 ** 2 / 32 + 45 * e2 ** 3 / 1024) * np.sin(2 * phi)
+        + (15 * e2 ** 2 / 256 + 45 * e2 ** 3 / 1024) * np.sin(4 * phi)
+        - (35 * e2 ** 3 / 3072) * np.sin(6 * phi)
+    )
+    x = k0 * n * (
+        big_a + (1 - t + c) * big_a ** 3 / 6
+        + (5 - 18 * t + t ** 2 + 72 * c - 58 * ep2) * big_a ** 5 / 120
+    ) + 500000.0
+    y = k0 * (m + n * np.tan(phi) * (
+        big_a ** 2 / 2 + (5 - t + 9 * c + 4 * c ** 2) * big_a ** 4 / 24
+        + (61 - 58 * t + t ** 2 + 600 * c - 330 * ep2) * big_a ** 6 / 720
+    ))
+    if epsg > 32700:
+        y = y + 10000000.0
+    return x, y
+
+
+class MemmapRaster:
+    """GeoTIFF sem compressão, em faixas contíguas, mapeado em memória.
+
+    Só as páginas das janelas lidas são trazidas do disco; o raster pode
+    ser bem maior que a RAM. Georreferência por tiepoint + pixel scale
+    (imagem orientada ao norte, como as exportações do GEE).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(4)
+            if header[:2] not in (b'II', b'MM') or header[2:] not in (b'*\0', b'\0*'):
+                raise ValueError(f"{path}: não é um TIFF clássico (BigTIFF requer rasterio)")
+            byte_order = '<' if header[:2] == b'II' else '>'
+            tags = _read_tags(f, byte_order)
+
+        if tags.get(TAG_COMPRESSION, (1,))[0] != 1 or TAG_TILE_WIDTH in tags:
+            raise ValueError(f"{path}: TIFF comprimido ou em blocos requer rasterio")
+        self.width = tags[TAG_WIDTH][0]
+        self.height = tags[TAG_HEIGHT][0]
+        self.count = tags.get(TAG_SAMPLES, (1,))[0]
+        bits = tags[TAG_BITS][0]
+        kind = _SAMPLE_KINDS[tags.get(TAG_SAMPLE_FORMAT, (1,))[0]]
+        self.dtype = np.dtype(f"{byte_order}{kind}{bits // 8}")
+        self.nodata = float(tags[TAG_NODATA][0]) if TAG_NODATA in tags else None
+        self.epsg = _geokey_epsg(tags[TAG_GEO_KEYS]) if TAG_GEO_KEYS in tags else 4326
+
+        scale_x, scale_y = tags[TAG_PIXEL_SCALE][:2]
+        i, j, _, x, y, _ = tags[TAG_TIEPOINT][:6]
+        self.transform = (x - i * scale_x, scale_x, y + j * scale_y, -scale_y)
+
+        offsets = tags[TAG_STRIP_OFFSETS]
+        sizes = tags[TAG_STRIP_BYTES]
+        if any(offsets[k] + sizes[k] != offsets[k + 1] for k in range(len(offsets) - 1)):
+            raise ValueError(f"{path}: faixas não contíguas requerem rasterio")
+        planar = tags.get(TAG_PLANAR, (1,))[0]
+        shape = (self.count, self.height, self.width) if planar == 2 else (self.height, self.width, self.count)
+        data = np.memmap(path, dtype=self.dtype, mode='r', offset=offsets[0], shape=shape)
+        # Sempre (bandas, linhas, colunas), sem copiar
+        self._data = data if planar == 2 else data.transpose(2, 0, 1)
+
+    def index(self, lons, lats):
+        """(linhas, colunas) dos pixels que contêm cada ponto"""
+        xs, ys = lonlat_to_crs(lons, lats, self.epsg)
+        x0, dx, y0, dy = self.transform
+        return np.floor((ys - y0) / dy).astype(np.int64), np.floor((xs - x0) / dx).astype(np.int64)
+
+    def read_window(self, row, col, size):
+        """Janela (bandas, size, size) com canto em (row, col); fora do raster vira nodata"""
+        fill = self.nodata if self.nodata is not None else 0
+        chip = np.full((self.count, size, size), fill, dtype=self.dtype.newbyteorder('='))
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + size, self.height), min(col + size, self.width)
+        if r0 < r1 and c0 < c1:
+            chip[:, r0 - row:r1 - row, c0 - col:c1 - col] = self._data[:, r0:r1, c0:c1]
+        return chip
+
+    def sample(self, rows, cols):
+        """Pixels (bandas, n) nas posições dadas, lidos direto do memmap; fora do raster vira nodata"""
+        fill = self.nodata if self.nodata is not None else 0
+        values = np.full((self.count, len(rows)), fill, dtype=self.dtype.newbyteorder('='))
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        values[:, inside] = self._data[:, rows[inside], cols[inside]]
+        return values
+
+    def close(self):
+        self._data = None
+
+
+class RasterioRaster:
+    """Mesma interface de MemmapRaster sobre rasterio (leitura por janela, qualquer CRS)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._dataset = rasterio.open(path)
+        self.width = self._dataset.width
+        self.height = self._dataset.height
+        self.count = self._dataset.count
+        self.dtype = np.dtype(self._dataset.dtypes[0])
+        self.nodata = self._dataset.nodata
+
+    def index(self, lons, lats):
+        xs, ys = warp_transform('EPSG:4326', self._dataset.crs, list(lons), list(lats))
+        cols, rows = ~self._dataset.transform * (np.asarray(xs), np.asarray(ys))
+        return np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+
+    def read_window(self, row, col, size):
+        fill = self.nodata if self.nodata is not None else 0
+        return self._dataset.read(window=Window(col, row, size, size), boundless=True, fill_value=fill)
+
+    def sample(self, rows, cols):
+        fill = self.nodata if self.nodata is not None else 0
+        values = np.full((self.count, len(rows)), fill, dtype=self.dtype)
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        if inside.any():
+            rows, cols = rows[inside], cols[inside]
+            r0, c0 = int(rows.min()), int(cols.min())
+            height, width = int(rows.max()) - r0 + 1, int(cols.max()) - c0 + 1
+            # Decimação na leitura (usa as overviews do arquivo, se houver)
+            step = max(1, math.ceil(max(height, width) / SAMPLE_READ_LIMIT))
+            block = self._dataset.read(
+                window=Window(c0, r0, width, height),
+                out_shape=(self.count, math.ceil(height / step), math.ceil(width / step))
+            )
+            values[:, inside] = block[:, (rows - r0) // step, (cols - c0) // step]
+        return values
+
+    def close(self):
+        self._dataset.close()
+
+
+def open_raster(path):
+    """Raster para leitura por janela (rasterio se disponível, senão memmap)"""
+    if rasterio is not None:
+        return RasterioRaster(path)
+    return MemmapRaster(path)
+
+
+def write_geotiff(path, array, origin, pixel_size, epsg=4326, nodata=None):
+    """Grava (bandas, linhas, colunas) como GeoTIFF sem compressão, bandas separadas.
+
+    origin: (x, y) do canto superior esquerdo no CRS; pixel_size: (dx, dy)
+    positivos. Formato lido por MemmapRaster e por qualquer leitor GDAL;
+    usado para rasters sintéticos de teste e benchmark.
+    """
+    array = np.ascontiguousarray(array)
+    if array.ndim == 2:
+        array = array[None]
+    count, height, width = array.shape
+    dtype = array.dtype.newbyteorder('<')
+    sample_format = {'u': 1, 'i': 2, 'f': 3}[dtype.kind]
+    band_bytes = height * width * dtype.itemsize
+    data_offset = 8
+
+    geo_key = GEOKEY_PROJECTED if epsg != 4326 else GEOKEY_GEOGRAPHIC
+    model_type = 1 if epsg != 4326 else 2
+    entries = [
+        (TAG_WIDTH, 4, (width,)), (TAG_HEIGHT, 4, (height,)),
+        (TAG_BITS, 3, (dtype.itemsize * 8,) * count), (TAG_COMPRESSION, 3, (1,)),
+        (TAG_PHOTOMETRIC, 3, (1,)),
+        (TAG_STRIP_OFFSETS, 4, tuple(data_offset + b * band_bytes for b in range(count))),
+        (TAG_SAMPLES, 3, (count,)), (TAG_ROWS_PER_STRIP, 4, (height,)),
+        (TAG_STRIP_BYTES, 4, (band_bytes,) * count), (TAG_PLANAR, 3, (2 if count > 1 else 1,)),
+        (TAG_SAMPLE_FORMAT, 3, (sample_format,) * count),
+        (TAG_PIXEL_SCALE, 12, (float(pixel_size[0]), float(pixel_size[1]), 0.0)),
+        (TAG_TIEPOINT, 12, (0.0, 0.0, 0.0, float(origin[0]), float(origin[1]), 0.0)),
+        (TAG_GEO_KEYS, 3, (1, 1, 0, 3, 1024, 0, 1, model_type, 1025, 0, 1, 1, geo_key, 0, 1, epsg)),
+    ]
+    if nodata is not None:
+        entries.append((TAG_NODATA, 2, (f"{nodata}\0".encode('ascii'),)))
+
+    ifd_offset = data_offset + count * band_bytes
+    extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd, extra = [struct.pack('<H', len(entries))], []
+    for tag, kind, values in sorted(entries):
+        fmt = _TIFF_TYPES[kind]
+        payload = values[0] if kind == 2 else struct.pack(f"<{len(values)}{fmt}", *values)
+        n = len(payload) if kind == 2 else len(values)
+        if len(payload) <= 4:
+            ifd.append(struct.pack('<HHI', tag, kind, n) + payload.ljust(4, b'\0'))
+        else:
+            ifd.append(struct.pack('<HHII', tag, kind, n, extra_offset))
+            extra.append(payload)
+            extra_offset += len(payload)
+    ifd.append(struct.pack('<I', 0))
+
+    content = b''.join([b'II*\0', struct.pack('<I', ifd_offset), array.astype(dtype).tobytes()]
+                       + ifd + extra)
+    atomic_write_bytes(path, content)
+
+
+def chip_samples(export_frame):
+    """Amostras (uma por tecnologia) a partir da tabela de exportação ML.
+
+    Na exportação, a linha da coordenada base traz o nível tecnológico em
+    technology_type; aqui ela recebe o rótulo BASE_LABEL, para a coluna
+    label ter só tipos de tecnologia.
+    """
+    samples = export_frame[list(SAMPLE_COLUMNS)].rename(columns=SAMPLE_COLUMNS)
+    is_base = samples['sample_id'].astype(str).str.endswith('_base')
+    samples['label'] = samples['label'].where(~is_base, BASE_LABEL)
+    return samples.reset_index(drop=True)
+
+
+def _extract_batch(job):
+    """Lê os chips de um lote num processo do pool e grava um único .npy"""
+    raster_path, rows, cols, size, out_path = job
+    raster = open_raster(raster_path)
+    try:
+        chips = np.stack([raster.read_window(row, col, size) for row, col in zip(rows, cols)])
+    finally:
+        raster.close()
+    if raster.nodata is not None:
+        valid = chips != raster.nodata
+        if np.isnan(raster.nodata):
+            valid = ~np.isnan(chips)
+        coverage = valid.all(axis=1).mean(axis=(1, 2))
+    else:
+        coverage = np.ones(len(chips))
+    buffer = io.BytesIO()
+    np.save(buffer, chips)
+    atomic_write_bytes(out_path, buffer.getvalue())
+    return coverage
+
+
+def extract_chips(raster_paths, samples, out_dir=CHIPS_DIR, size=CHIP_SIZE, workers=None,
+                  batch_size=CHIPS_PER_BATCH):
+    """Recorta um chip size × size em volta de cada amostra, em todos os rasters.
+
+    Amostras fora de um raster são ignoradas nele. Os chips saem em lotes
+    `<raster>_<n>.npy` (N, bandas, size, size), gravados por um pool de
+    processos; o índice `chips.csv` liga cada chip ao arquivo, à posição
+    no lote e ao rótulo da amostra. Retorna o índice como DataFrame.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lons = samples['longitude'].to_numpy(dtype=np.float64)
+    lats = samples['latitude'].to_numpy(dtype=np.float64)
+    jobs, placements = [], []
+    for raster_path in raster_paths:
+        raster = open_raster(raster_path)
+        try:
+            rows, cols = raster.index(lons, lats)
+            inside = np.flatnonzero(
+                (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+            )
+        finally:
+            raster.close()
+        # Canto superior esquerdo da janela centrada no pixel da amostra
+        rows, cols = rows[inside] - size // 2, cols[inside] - size // 2
+        stem = os.path.splitext(os.path.basename(raster_path))[0]
+        for batch, start in enumerate(range(0, len(inside), batch_size)):
+            chip_file = f"{stem}_{batch:04d}.npy"
+            end = start + batch_size
+            jobs.append((raster_path, rows[start:end], cols[start:end], size,
+                         os.path.join(out_dir, chip_file)))
+            placements.append((raster_path, chip_file, inside[start:end]))
+
+    if workers == 1 or len(jobs) <= 1:
+        coverages = list(map(_extract_batch, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            coverages = list(pool.map(_extract_batch, jobs))
+
+    parts = []
+    for (raster_path, chip_file, positions), coverage in zip(placements, coverages):
+        part = samples.iloc[positions].copy()
+        part.insert(0, 'chip_index', np.arange(len(positions)))
+        part.insert(0, 'chip_file', chip_file)
+        part['raster'] = os.path.basename(raster_path)
+        part['coverage'] = coverage
+        parts.append(part)
+    index = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=['chip_file', 'chip_index', *SAMPLE_COLUMNS.values(), 'raster', 'coverage']
+    )
+    atomic_write_csv(os.path.join(out_dir, CHIPS_INDEX), index, index=False)
+    return index
+
+
+def load_chip(out_dir, row):
+    """Chip de uma linha do índice (lote aberto em memmap, só a fatia é lida)"""
+    return np.load(os.path.join(out_dir, row['chip_file']), mmap_mode='r')[row['chip_index']]
@@ -1,10 +1,37 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from streamlit_folium import st_folium
 import json
 import os
+import time
+import itertools
 from datetime import datetime
+from biogas_data import LARGE_EXPORT_BYTES, STORE_RESIDENT_COLUMNS, ingest_plants, legacy_id_map, load_plants, plant_ids
+from biogas_db import BiogasDatabase, LazyRecords
+from biogas_maps import MapTemplateCache
+from biogas_picker import PlantCatalog, StorePlantCatalog
+from biogas_spatial import PlantSpatialIndex, annotate_duplicates
+from biogas_storage import atomic_write_json, recover, verify
+from biogas_tiles import TileCache, TilePrefetcher, TileProxyServer, ensure_tile_proxy, tile_url_template
+
+# Raios de vizinhança (m) usados no mapa
+NEIGHBOR_RADIUS_M = 5000
+DUPLICATE_RADIUS_M = 50
+
+# Plantas à frente cujos tiles são baixados em segundo plano
+PREFETCH_AHEAD = 3
+
+# Escopo das reservas de plantas no banco compartilhado
+LEASE_SCOPE = 'classification'
+
+# Filtros de status do seletor de plantas (None = todas)
+PICKER_STATUS_FILTERS = {
+    "Todas": None,
+    "⬜ Não classificadas": False,
+    "✅ Classificadas": True,
+}
 
 # Configuração da página
 st.set_page_config(
@@ -50,34 +77,167 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Inicializar session state
+# Banco SQLite compartilhado entre sessões do servidor
+@st.cache_resource
+def get_database():
+    """Banco SQLite com consultas indexadas"""
+    return BiogasDatabase()
+
+@st.cache_resource
+def recover_storage():
+    """Conclui ou descarta gravações interrompidas (uma vez por processo, antes de ler os dados)"""
+    return [recover(directory) for directory in ('.', 'biogas_data')]
+
+for report in recover_storage():
+    for path in report['corrupted']:
+        st.warning(f"⚠️ Checksum não confere, arquivo possivelmente corrompido: {path}")
+
+# Inicializar session state (retoma as classificações salvas no SQLite)
 if 'plant_index' not in st.session_state:
     st.session_state.plant_index = 0
-if 'classifications' not in st.session_state:
-    st.session_state.classifications = {}
+if 'map_cache' not in st.session_state:
+    st.session_state.map_cache = MapTemplateCache()
+@st.cache_resource
+def resume_storage():
+    """Importa o backup JSON quando o banco está vazio (uma vez por processo)"""
+    start = time.perf_counter()
+    db = get_database()
+    imported = 0
+    backup_path = 'classificacoes_biogas.json'
+    if not db.classification_ids() and os.path.exists(backup_path) and verify(backup_path) is not False:
+        with open(backup_path, 'r', encoding='utf-8') as f:
+            classifications = json.load(f)
+        # Uma transação (e um fsync) para o backup inteiro
+        db.upsert_classifications(classifications)
+        imported = len(classifications)
+    return {f"backup JSON → banco ({imported} registros)": time.perf_counter() - start}
 
 # Função para carregar dados
-@st.cache_data
-def load_plant_data():
-    """Carrega dados das plantas de biogás"""
+@st.cache_resource
+def get_plant_store(csv_path):
+    """PlantStore das exportações grandes, ingerido em blocos (None: o CSV é lido inteiro)"""
+    if os.path.getsize(csv_path) > LARGE_EXPORT_BYTES:
+        return ingest_plants(csv_path)
+    return None
+
+@st.cache_resource
+def load_plant_data(duplicate_radius_m=DUPLICATE_RADIUS_M):
+    """Carrega dados das plantas de biogás e agrupa pontos duplicados"""
     try:
         # Substitua pelo caminho do seu CSV baixado do GEE
-        df = pd.read_csv('Plantas_Biogas_Para_Classificacao.csv')
+        csv_path = 'Plantas_Biogas_Para_Classificacao.csv'
+        store = get_plant_store(csv_path)
+        if store is not None:
+            # Exportação grande: em memória só as colunas de largura fixa; ids,
+            # rótulos e linhas completas são lidos do PlantStore por página
+            df = store.frame(STORE_RESIDENT_COLUMNS)
+        else:
+            df = load_plants(csv_path)
+        df = annotate_duplicates(df, duplicate_radius_m)
+        if store is None:
+            # Identidade estável: system:index do GEE, com índice id → linha no catálogo
+            df['plant_id'] = plant_ids(df)
         return df
     except FileNotFoundError:
         st.error("❌ Arquivo 'Plantas_Biogas_Para_Classificacao.csv' não encontrado!")
         st.info("📥 Baixe o arquivo do Google Drive e coloque na mesma pasta do script.")
         return None
 
+@st.cache_resource
+def get_plant_catalog(_df):
+    """Rótulos, ids e busca do seletor: em memória ou, nas exportações grandes, no PlantStore"""
+    store = get_plant_store('Plantas_Biogas_Para_Classificacao.csv')
+    if store is not None:
+        return StorePlantCatalog(store, _df)
+    return PlantCatalog(_df, _df['plant_id'].tolist())
+
+@st.cache_resource
+def migrate_plant_ids():
+    """Troca os ids antigos por posição (plant_NNN) pelo system:index (uma vez por processo)"""
+    start = time.perf_counter()
+    df = load_plant_data()
+    mapping = {}
+    if df is not None:
+        db = get_database()
+        records = db.legacy_records()
+        if records:
+            plants = get_plant_catalog(df).frame()
+            mapping = {old: new for old, new in legacy_id_map(plants, records).items() if old != new}
+        if mapping:
+            db.rename_plants(mapping)
+            atomic_write_json('classificacoes_biogas.json', db.load_classifications(), with_checksum=True, indent=2)
+    return {f"migração de ids ({len(mapping)} plantas)": time.perf_counter() - start}
+
+# Só os ids são lidos agora; cada classificação é decodificada quando a planta é aberta
+if 'classifications' not in st.session_state:
+    startup_timings = dict(resume_storage())
+    startup_timings.update(migrate_plant_ids())
+    start = time.perf_counter()
+    st.session_state.classifications = LazyRecords(
+        get_database().classification_ids(), get_database().load_classification
+    )
+    startup_timings["ids das classificações"] = time.perf_counter() - start
+    st.session_state.startup_timings = startup_timings
+
 def save_classification(plant_id, classification_data):
-    """Salva classificação no session state e arquivo"""
+    """Salva classificação no session state e no banco"""
     st.session_state.classifications[plant_id] = classification_data
-    
-    # Salvar em arquivo JSON para backup
-    with open('classificacoes_biogas.json', 'w') as f:
-        json.dump(st.session_state.classifications, f, indent=2)
+    # Gravação atômica (com fsync) de um único registro no banco compartilhado;
+    # o backup JSON completo só é gerado na exportação
+    get_database().upsert_classification(plant_id, classification_data)
+
+def checkout_next_plant(current_plant, assessor):
+    """Reserva a próxima planta sem classificação e sem outro avaliador, a partir da atual"""
+    skip_duplicates = st.session_state.get('skip_duplicates', True)
+    is_duplicate = df_plantas['is_duplicate'].to_numpy()
+    order = itertools.chain(range(current_plant + 1, len(df_plantas)), range(current_plant + 1))
+    catalog = get_plant_catalog(df_plantas)
+    candidates = catalog.iter_plant_ids(i for i in order if not (skip_duplicates and is_duplicate[i]))
+    plant_id = get_database().checkout_next(LEASE_SCOPE, assessor, candidates)
+    return None if plant_id is None else catalog.position(plant_id)
+
+def sync_plant(plant_id):
+    """Traz do banco compartilhado a classificação feita por outro avaliador"""
+    st.session_state.classifications.forget(plant_id)
+    if get_database().load_classification(plant_id) is not None:
+        st.session_state.classifications.add_key(plant_id)
+
+@st.cache_resource
+def get_tile_proxy():
+    """Proxy local com cache em disco para os tiles de satélite"""
+    return ensure_tile_proxy()
 
-def create_satellite_map(lat, lon, municipio):
+@st.cache_resource
+def get_tile_prefetcher():
+    """Pré-carregamento em segundo plano no mesmo cache do proxy"""
+    proxy = get_tile_proxy()
+    if proxy is None:
+        return None
+    return TilePrefetcher(proxy.cache if isinstance(proxy, TileProxyServer) else TileCache())
+
+def prefetch_upcoming_tiles(plant_index):
+    """Agenda os tiles das próximas PREFETCH_AHEAD plantas na ordem de navegação"""
+    prefetcher = get_tile_prefetcher()
+    if prefetcher is None:
+        return
+    points = []
+    upcoming = step_plant(plant_index, 1)
+    while upcoming is not None and len(points) < PREFETCH_AHEAD:
+        points.append((df_plantas['Latitude'].iat[upcoming], df_plantas['Longitude'].iat[upcoming]))
+        upcoming = step_plant(upcoming, 1)
+    prefetcher.schedule(points, layers=('esri', 'google'))
+
+def tile_url(layer, remote_url):
+    """URL da camada via proxy local, ou a URL remota se o proxy estiver desativado.
+
+    O endereço 127.0.0.1 do proxy é resolvido pelo navegador: quem acessa de
+    outra máquina (st.context.ip_address preenchido) recebe a URL remota.
+    """
+    if get_tile_proxy() is None or st.context.ip_address is not None:
+        return remote_url
+    return tile_url_template(layer)
+
+def create_satellite_map(lat, lon, municipio, neighbors=None):
     """Cria mapa de satélite interativo"""
     m = folium.Map(
         location=[lat, lon],
@@ -87,7 +247,7 @@ def create_satellite_map(lat, lon, municipio):
     
     # Adicionar diferentes tipos de imagem
     folium.TileLayer(
-        'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        tile_url('esri', 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'),
         attr='ESRI World Imagery',
         name='Satélite ESRI',
         overlay=False,
@@ -95,7 +255,7 @@ def create_satellite_map(lat, lon, municipio):
     ).add_to(m)
     
     folium.TileLayer(
-        'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+        tile_url('google', 'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}'),
         attr='Google Satellite',
         name='Google Satélite',
         overlay=False,
@@ -120,39 +280,153 @@ def create_satellite_map(lat, lon, municipio):
         popup='500m de raio'
     ).add_to(m)
     
+    # Plantas vizinhas (índice espacial); duplicatas prováveis em vermelho
+    for neighbor in neighbors or []:
+        is_duplicate = neighbor['distance'] <= DUPLICATE_RADIUS_M
+        folium.CircleMarker(
+            [neighbor['lat'], neighbor['lon']],
+            radius=8 if is_duplicate else 6,
+            color='red' if is_duplicate else 'gray',
+            fill=True,
+            fillOpacity=0.7,
+            tooltip=f"{'⚠️ Possível duplicata - ' if is_duplicate else ''}Planta {neighbor['index'] + 1}: "
+                    f"{neighbor['municipio']} ({neighbor['distance']:.0f} m)"
+        ).add_to(m)
+
     folium.LayerControl().add_to(m)
     
     return m
 
+@st.cache_resource
+def get_spatial_index(_df):
+    """Índice espacial construído uma vez a partir de Latitude/Longitude"""
+    return PlantSpatialIndex(_df['Latitude'].to_numpy(), _df['Longitude'].to_numpy())
+
+def find_neighbors(plant_index):
+    """Plantas dentro de NEIGHBOR_RADIUS_M da planta atual"""
+    indices, distances = get_spatial_index(df_plantas).neighbors(plant_index, NEIGHBOR_RADIUS_M)
+    return [
+        {
+            'index': int(i),
+            'lat': float(df_plantas['Latitude'].iat[i]),
+            'lon': float(df_plantas['Longitude'].iat[i]),
+            'municipio': df_plantas['Municipio'].iat[i],
+            'distance': float(d)
+        }
+        for i, d in zip(indices, distances)
+    ]
+
+def cluster_members(plant_index):
+    """Outras plantas do mesmo grupo de duplicatas"""
+    cluster_id = df_plantas['cluster_id'].iat[plant_index]
+    members = np.flatnonzero(df_plantas['cluster_id'].to_numpy() == cluster_id)
+    return [int(i) for i in members if i != plant_index]
+
+def step_plant(plant_index, step):
+    """Posição vizinha na navegação, pulando duplicatas se configurado"""
+    target = plant_index + step
+    if st.session_state.get('skip_duplicates', True):
+        is_duplicate = df_plantas['is_duplicate'].to_numpy()
+        while 0 <= target < len(df_plantas) and is_duplicate[target]:
+            target += step
+    return target if 0 <= target < len(df_plantas) else None
+
+
+def render_plant_picker(current_plant):
+    """Seletor pesquisável e paginado: só a página visível vira opções"""
+    catalog = get_plant_catalog(df_plantas)
+    query = st.text_input("🔎 Buscar planta:", key='picker_query', placeholder="Município ou id")
+    status = PICKER_STATUS_FILTERS[st.selectbox("Status:", list(PICKER_STATUS_FILTERS), key='picker_status')]
+    mask = None
+    if status is not None:
+        classified = np.zeros(len(catalog), dtype=bool)
+        classified[catalog.positions_of(st.session_state.classifications)] = True
+        mask = classified if status else ~classified
+    positions = catalog.filter(query, mask)
+    if not len(positions):
+        st.caption("Nenhuma planta encontrada")
+        return current_plant
+
+    pages = catalog.page_count(positions)
+    page = st.number_input(
+        f"Página (de {pages}):", min_value=1, max_value=pages,
+        value=catalog.page_of(positions, current_plant) + 1
+    ) - 1
+    options = catalog.page(positions, page).tolist()
+    # A planta atual continua selecionável mesmo fora do filtro/página
+    if current_plant not in options:
+        options.insert(0, current_plant)
+    labels = catalog.labels_of(options)
+
+    selected = st.selectbox(
+        "Selecionar Planta:",
+        options,
+        index=options.index(current_plant),
+        format_func=labels.get
+    )
+    st.caption(f"{len(positions)} planta(s) encontrada(s)")
+    return selected
+
 # Carregar dados
 df_plantas = load_plant_data()
 
 if df_plantas is not None:
     total_plantas = len(df_plantas)
     
+    # Avaliador identificado: cada um reserva a planta em que está trabalhando
+    with st.sidebar:
+        st.header("👤 AVALIADOR")
+        assessor = st.text_input("Nome do avaliador:", key='assessor', placeholder="Seu nome").strip()
+    if not assessor:
+        st.info("👤 Informe seu nome na barra lateral para começar a classificar.")
+        st.stop()
+
     # Sidebar - Navegação
     with st.sidebar:
         st.header("🎯 NAVEGAÇÃO")
         
         # Seletor de planta
-        current_plant = st.selectbox(
-            "Selecionar Planta:",
-            range(total_plantas),
-            index=st.session_state.plant_index,
-            format_func=lambda x: f"{x+1}. {df_plantas.iloc[x]['Municipio']}"
-        )
+        current_plant = render_plant_picker(st.session_state.plant_index)
         st.session_state.plant_index = current_plant
+        current_plant_id = get_plant_catalog(df_plantas).plant_id(current_plant)
+        if st.session_state.get('synced_plant') != current_plant_id:
+            sync_plant(current_plant_id)
+            st.session_state.synced_plant = current_plant_id
+        lease_holder = get_database().acquire_lease(LEASE_SCOPE, current_plant_id, assessor)
+        if lease_holder != assessor:
+            st.warning(f"🔒 Planta em classificação por {lease_holder}")
         
         # Botões de navegação
         col1, col2 = st.columns(2)
+        previous_plant = step_plant(current_plant, -1)
+        next_plant = step_plant(current_plant, 1)
         with col1:
-            if st.button("⬅️ Anterior") and current_plant > 0:
-                st.session_state.plant_index = current_plant - 1
+            if st.button("⬅️ Anterior") and previous_plant is not None:
+                st.session_state.plant_index = previous_plant
                 st.rerun()
         with col2:
-            if st.button("Próxima ➡️") and current_plant < total_plantas - 1:
-                st.session_state.plant_index = current_plant + 1
+            if st.button("Próxima ➡️") and next_plant is not None:
+                st.session_state.plant_index = next_plant
                 st.rerun()
+        if st.button("🎯 Próxima livre", help="Reserva a próxima planta sem classificação e sem outro avaliador"):
+            free_plant = checkout_next_plant(current_plant, assessor)
+            if free_plant is None:
+                st.info("✅ Nenhuma planta livre restante")
+            else:
+                st.session_state.plant_index = free_plant
+                st.rerun()
+        active = get_database().active_leases(LEASE_SCOPE)
+        if len(active) > 1:
+            st.caption(f"👥 {len(active)} avaliadores trabalhando agora")
+
+        duplicate_count = int(df_plantas['is_duplicate'].sum())
+        if duplicate_count:
+            st.checkbox(
+                f"⏭️ Pular duplicatas ({duplicate_count})",
+                value=True,
+                key='skip_duplicates',
+                help=f"Pontos a menos de {DUPLICATE_RADIUS_M} m de uma planta anterior"
+            )
         
         # Progresso simplificado
         st.markdown("### 📊 Progresso")
@@ -163,18 +437,21 @@ if df_plantas is not None:
 
         # Estatísticas compactas
         if classified_count > 0:
-            techs = [v['tecnologia'] for v in st.session_state.classifications.values()]
+            tech_counts = get_database().classification_counts()
             stats_text = []
             for tech in ['BAIXA', 'MEDIA', 'ALTA', 'SEM_PLANTA']:
-                count = techs.count(tech)
+                count = tech_counts.get(tech, 0)
                 if count > 0:
                     stats_text.append(f"{tech}: {count}")
             if stats_text:
                 st.write(" | ".join(stats_text))
     
+    # Aquecer o cache de tiles das próximas plantas
+    prefetch_upcoming_tiles(current_plant)
+
     # Dados da planta atual
-    planta = df_plantas.iloc[current_plant]
-    plant_id = f"plant_{current_plant:03d}"
+    planta = get_plant_catalog(df_plantas).row(current_plant)
+    plant_id = planta['plant_id']
     
     # Layout principal
     col1, col2 = st.columns([2, 1])
@@ -188,12 +465,27 @@ if df_plantas is not None:
         if 'cana_ha' in planta:
             st.write(f"**Cana:** {planta['cana_ha']:.0f} ha")
 
+        # Vizinhança consultada no índice espacial
+        neighbors = find_neighbors(current_plant)
+        duplicates = [n for n in neighbors if n['distance'] <= DUPLICATE_RADIUS_M]
+        if duplicates:
+            st.warning("⚠️ Possível duplicata a menos de "
+                       f"{DUPLICATE_RADIUS_M} m: " + ", ".join(
+                           f"Planta {n['index'] + 1} ({n['distance']:.0f} m)" for n in duplicates))
+        if neighbors:
+            st.caption(f"🏘️ {len(neighbors)} planta(s) num raio de {NEIGHBOR_RADIUS_M / 1000:.0f} km")
+
         # Mapa de satélite
         st.markdown("### 🛰️ Imagem de Satélite")
-        satellite_map = create_satellite_map(
-            planta['Latitude'], 
-            planta['Longitude'], 
-            planta['Municipio']
+        satellite_map = st.session_state.map_cache.get(
+            plant_id,
+            None,
+            lambda: create_satellite_map(
+                planta['Latitude'],
+                planta['Longitude'],
+                planta['Municipio'],
+                neighbors
+            )
         )
         
         map_data = st_folium(
@@ -244,12 +536,23 @@ if df_plantas is not None:
                 height=80
             )
             
+            # Mesclar duplicatas: a classificação vale para todo o grupo
+            duplicate_members = cluster_members(current_plant)
+            apply_to_duplicates = False
+            if duplicate_members:
+                apply_to_duplicates = st.checkbox(
+                    f"🔗 Aplicar às {len(duplicate_members)} duplicata(s) do grupo",
+                    value=True
+                )
+
             submitted = st.form_submit_button(
                 "✅ SALVAR CLASSIFICAÇÃO",
                 type="primary"
             )
             
-            if submitted:
+            if submitted and lease_holder != assessor:
+                st.error(f"🔒 Não salvo: planta reservada por {lease_holder}")
+            elif submitted:
                 classification_data = {
                     'plant_index': current_plant,
                     'municipio': planta['Municipio'],
@@ -258,15 +561,30 @@ if df_plantas is not None:
                     'tecnologia': tecnologia,
                     'confianca': confianca,
                     'observacoes': observacoes,
+                    'avaliador': assessor,
                     'timestamp': datetime.now().isoformat()
                 }
                 
+                if apply_to_duplicates:
+                    for member in duplicate_members:
+                        member_data = dict(classification_data)
+                        member_data.update({
+                            'plant_index': member,
+                            'latitude': df_plantas['Latitude'].iat[member],
+                            'longitude': df_plantas['Longitude'].iat[member],
+                            'duplicate_of': plant_id
+                        })
+                        save_classification(get_plant_catalog(df_plantas).plant_id(member), member_data)
+
                 save_classification(plant_id, classification_data)
                 st.success(f"✅ Planta {current_plant + 1} classificada como {tecnologia}!")
                 
-                # Auto-avançar para próxima planta
-                if current_plant < total_plantas - 1:
-                    st.session_state.plant_index = current_plant + 1
+                # Auto-avançar para a próxima planta livre (reservada para este avaliador)
+                free_plant = checkout_next_plant(current_plant, assessor)
+                if free_plant is None:
+                    free_plant = next_plant
+                if free_plant is not None:
+                    st.session_state.plant_index = free_plant
                     st.rerun()
         
         # Mostrar classificação atual se existir
@@ -278,22 +596,24 @@ if df_plantas is not None:
     if st.session_state.classifications:
         st.subheader("💾 EXPORTAR RESULTADOS")
         
-        # Converter para DataFrame
-        results_df = pd.DataFrame(list(st.session_state.classifications.values()))
-        
-        # Botão de download
-        csv_data = results_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Baixar Classificações (CSV)",
-            data=csv_data,
-            file_name=f"classificacoes_biogas_sp_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv"
-        )
+        # CSV e backup JSON montados só quando pedidos (leem todas as classificações do banco)
+        if st.button("📥 Preparar CSV das Classificações"):
+            classifications = get_database().load_classifications()
+            # Backup JSON (inclui os demais avaliadores), gravado com fsync e checksum
+            atomic_write_json('classificacoes_biogas.json', classifications, with_checksum=True, indent=2)
+            results_df = pd.DataFrame(list(classifications.values()))
+            st.download_button(
+                label="📥 Baixar Classificações (CSV)",
+                data=results_df.to_csv(index=False),
+                file_name=f"classificacoes_biogas_sp_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv"
+            )
         
-        # Resumo estatístico
-        if len(results_df) > 0:
+        # Resumo estatístico (agregados indexados no banco)
+        total_classified, avg_confidence = get_database().classification_summary()
+        if total_classified > 0:
             st.subheader("📊 RESUMO ESTATÍSTICO")
-            tech_counts = results_df['tecnologia'].value_counts()
+            tech_counts = get_database().classification_counts()
             
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -305,7 +625,12 @@ if df_plantas is not None:
             with col4:
                 st.metric("SEM PLANTA", tech_counts.get('SEM_PLANTA', 0))
             
-            st.write(f"**Confiança média:** {results_df['confianca'].mean():.1f}%")
+            st.write(f"**Confiança média:** {avg_confidence:.1f}%")
+
+        with st.expander("⏱️ Inicialização da sessão"):
+            for name, duration in st.session_state.startup_timings.items():
+                st.caption(f"{name}: {duration * 1000:.1f} ms")
+            st.caption(f"classificações lidas sob demanda: {st.session_state.classifications.loads}")
 
 else:
     st.error("❌ Não foi possível carregar os dados das plantas!")
@@ -0,0 +1,375 @@
+"""Linha de comando para importar, recalcular e exportar sem abrir a interface.
+
+Roda na mesma pasta das interfaces e usa o mesmo armazenamento (journal +
+SQLite em biogas_data/), então pode ser agendada no cron com os servidores
+no ar. Exemplos:
+
+    python biogas_cli.py import backup_ana.json classificacoes_biogas.json
+    python biogas_cli.py recompute
+    python biogas_cli.py export treino_ml.parquet
+    python biogas_cli.py export dataset_ml --format geoparquet
+    python biogas_cli.py chips sentinel_T23KLP.tif --size 64
+    python biogas_cli.py predict
+    python biogas_cli.py export classificacoes.csv --classifications
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from biogas_chips import CHIP_SIZE, CHIPS_DIR, chip_samples, extract_chips
+from biogas_data import LARGE_EXPORT_BYTES, PLANT_CSV, ingest_plants, legacy_id_map, load_plants, plant_ids
+from biogas_db import DB_PATH, BiogasDatabase
+from biogas_export import build_export_frame, parquet_bytes, write_geoparquet
+from biogas_model import MIN_TRAINING_SAMPLES, run_preclassification
+from biogas_journal import JOURNAL_DIR, AssessmentJournal, rename_plants
+from biogas_overlay import LOCAL_IMAGERY_DIR, LocalRasterCatalog
+from biogas_spatial import annotate_duplicates
+from biogas_storage import atomic_write_bytes, atomic_write_csv, atomic_write_json
+
+CLASSIFICATIONS_BACKUP = 'classificacoes_biogas.json'
+DUPLICATE_RADIUS_M = 50
+
+
+def record_version(record):
+    """Chave de ordem entre versões de um registro: avaliação e depois validação"""
+    return (record.get('timestamp') or '', record.get('validation_date') or '')
+
+
+def is_newer(record, current):
+    return current is None or record_version(record) > record_version(current)
+
+
+def read_backup(path):
+    """(avaliações, coordenadas, classificações) de um arquivo JSON.
+
+    Aceita o snapshot do journal, o backup antigo de avaliações
+    ({'assessments', 'coordinates', 'validations'}) e o backup de
+    classificações ({plant_id: registro}). Arquivo que não é JSON ou fora
+    desses formatos gera ValueError com o nome do arquivo.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+    except ValueError as e:
+        raise ValueError(f"{path}: não é um arquivo JSON válido ({e})") from e
+    if isinstance(content, dict) and 'state' in content and 'last_seq' in content:
+        content = content['state']
+    if not is_record_map(content):
+        raise ValueError(f"{path}: formato de backup não reconhecido")
+    if 'assessments' not in content:
+        return {}, {}, content
+
+    assessments = content['assessments']
+    coordinates = content.get('coordinates', {})
+    validations = content.get('validations', {})
+    if not (is_record_map(assessments) and is_record_map(validations) and is_coordinate_map(coordinates)):
+        raise ValueError(f"{path}: backup de avaliações malformado")
+    for plant_id, validation in validations.items():
+        if plant_id in assessments:
+            assessments[plant_id].update(validation)
+    return assessments, coordinates, {}
+
+
+def is_record_map(value):
+    """{id: registro (dict)}"""
+    return isinstance(value, dict) and all(isinstance(record, dict) for record in value.values())
+
+
+def is_coordinate_map(value):
+    """{plant_id: [{'lat', 'lon', ...}, ...]}"""
+    return isinstance(value, dict) and all(
+        isinstance(coords, list)
+        and all(isinstance(coord, dict) and 'lat' in coord and 'lon' in coord for coord in coords)
+        for coords in value.values()
+    )
+
+
+def coordinate_key(coord):
+    return round(float(coord['lat']), 7), round(float(coord['lon']), 7), coord.get('type')
+
+
+def merge_coordinates(*coordinate_lists):
+    """União das tecnologias de uma planta, sem repetir a mesma posição e tipo"""
+    merged, seen = [], set()
+    for coords in coordinate_lists:
+        for coord in coords or []:
+            key = coordinate_key(coord)
+            if key not in seen:
+                seen.add(key)
+                merged.append(coord)
+    return merged
+
+
+def merge_backups(paths):
+    """Junta vários arquivos mantendo a versão mais recente de cada planta.
+
+    As coordenadas de tecnologia são unidas entre os arquivos,
+    independentemente de qual avaliação é a mais recente.
+    """
+    assessments, coordinates, classifications = {}, {}, {}
+    for path in paths:
+        file_assessments, file_coordinates, file_classifications = read_backup(path)
+        for plant_id, assessment in file_assessments.items():
+            if is_newer(assessment, assessments.get(plant_id)):
+                assessments[plant_id] = assessment
+        for plant_id, coords in file_coordinates.items():
+            coordinates[plant_id] = merge_coordinates(coordinates.get(plant_id), coords)
+        for plant_id, classification in file_classifications.items():
+            if is_newer(classification, classifications.get(plant_id)):
+                classifications[plant_id] = classification
+    return assessments, coordinates, classifications
+
+
+def migrate_legacy_ids(df, assessments, coordinates, classifications):
+    """Troca ids antigos por posição (plant_NNN) pelo system:index da exportação atual"""
+    records = {plant_id: None for plant_id in coordinates}
+    records.update(classifications)
+    records.update(assessments)
+    mapping = {old: new for old, new in legacy_id_map(df, records).items() if old != new}
+    if not mapping:
+        return assessments, coordinates, classifications
+
+    state = rename_plants({'assessments': assessments, 'coordinates': coordinates, 'validations': {}}, mapping)
+    classifications = rename_plants({'assessments': classifications, 'coordinates': {}, 'validations': {}},
+                                    mapping)['assessments']
+    return state['assessments'], state['coordinates'], classifications
+
+
+def write_classifications_backup(db):
+    """Backup JSON das classificações, o mesmo que a interface grava"""
+    atomic_write_json(CLASSIFICATIONS_BACKUP, db.load_classifications(), with_checksum=True, indent=2)
+
+
+def import_backups(paths, db, journal, df=None):
+    """Importa arquivos JSON no armazenamento compartilhado.
+
+    Só entram avaliações e classificações mais recentes que as do banco; as
+    tecnologias são unidas às já gravadas. Avaliações e tecnologias passam
+    pelo journal (um único append em lote) como as gravadas pela interface.
+    Retorna (avaliações importadas, plantas com tecnologias novas,
+    classificações importadas).
+    """
+    assessments, coordinates, classifications = merge_backups(paths)
+    if df is not None:
+        assessments, coordinates, classifications = migrate_legacy_ids(
+            df, assessments, coordinates, classifications
+        )
+
+    current = db.load_assessments()
+    events = [('assessment', plant_id, assessment) for plant_id, assessment in assessments.items()
+              if is_newer(assessment, current.get(plant_id))]
+    n_assessments = len(events)
+    stored = db.load_coordinates()
+    for plant_id, coords in coordinates.items():
+        merged = merge_coordinates(stored.get(plant_id), coords)
+        if len(merged) > len(stored.get(plant_id, [])):
+            events.append(('coordinates_set', plant_id, merged))
+    db.apply_events(journal.append_many(events))
+
+    current = db.load_classifications()
+    changed = {plant_id: classification for plant_id, classification in classifications.items()
+               if is_newer(classification, current.get(plant_id))}
+    if changed:
+        db.upsert_classifications(changed)
+        write_classifications_backup(db)
+    return n_assessments, len(events) - n_assessments, len(changed)
+
+
+def refreshed_locations(records, df):
+    """{plant_id: registro} cujos município, coordenadas ou posição diferem da exportação atual.
+
+    A comparação é feita em lote, juntando os registros às plantas pelo id.
+    """
+    if not records:
+        return {}
+    plants = pd.DataFrame({
+        'plant_index': range(len(df)),
+        'municipio': df['Municipio'].astype(object).to_numpy(),
+        'latitude': df['Latitude'].to_numpy(),
+        'longitude': df['Longitude'].to_numpy(),
+    }, index=df['plant_id'].to_numpy())
+    columns = list(plants.columns)
+    saved = pd.DataFrame.from_dict(records, orient='index').reindex(columns=columns)
+    current = plants.reindex(saved.index)
+
+    known = current['plant_index'].notna()
+    changed = pd.Series(False, index=saved.index)
+    for column in columns:
+        if column in ('latitude', 'longitude'):
+            differs = (pd.to_numeric(saved[column], errors='coerce') - current[column]).abs() > 1e-9
+            differs |= saved[column].isna()
+        else:
+            differs = saved[column].astype(object).ne(current[column].astype(object))
+        changed |= differs
+    changed &= known
+
+    updated = {}
+    for plant_id, row in current[changed].iterrows():
+        record = dict(records[plant_id])
+        record.update({
+            'plant_index': int(row['plant_index']),
+            'municipio': row['municipio'],
+            'latitude': float(row['latitude']),
+            'longitude': float(row['longitude']),
+        })
+        updated[plant_id] = record
+    return updated
+
+
+def recompute(db, journal, df):
+    """Recalcula os campos derivados da exportação de plantas nos registros salvos.
+
+    Município, coordenadas base e posição são atualizados a partir da
+    exportação atual (as distâncias das tecnologias são recalculadas em
+    lote a cada `export`). Retorna (avaliações, classificações) alteradas.
+    """
+    assessments = refreshed_locations(db.load_assessments(), df)
+    db.apply_events(journal.append_many(
+        ('assessment', plant_id, assessment) for plant_id, assessment in assessments.items()
+    ))
+    classifications = refreshed_locations(db.load_classifications(), df)
+    if classifications:
+        db.upsert_classifications(classifications)
+        write_classifications_backup(db)
+    return len(assessments), len(classifications)
+
+
+EXPORT_FORMATS = ('csv', 'parquet', 'geoparquet')
+
+
+def export_format(path):
+    """Formato pela extensão do arquivo (CSV por padrão)"""
+    return 'parquet' if path.endswith('.parquet') else 'csv'
+
+
+def export(db, path, classifications=False, fmt=None, partition_by='municipio'):
+    """Exporta a tabela de treinamento ML (ou as classificações); retorna o número de linhas.
+
+    geoparquet grava um dataset particionado por `partition_by` em `path`
+    (ou um arquivo só, com partition_by None).
+    """
+    fmt = fmt or export_format(path)
+    if classifications:
+        df = pd.DataFrame.from_dict(db.load_classifications(), orient='index')
+        df = df.rename_axis('plant_id').reset_index()
+    else:
+        df = build_export_frame(db.load_assessments(), db.load_coordinates())
+
+    if fmt == 'geoparquet':
+        if classifications:
+            raise ValueError("GeoParquet disponível apenas para a tabela de treinamento ML")
+        write_geoparquet(df, path, partition_by)
+    elif fmt == 'parquet':
+        if classifications:
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+            atomic_write_bytes(path, buffer.getvalue())
+        else:
+            atomic_write_bytes(path, parquet_bytes(df))
+    else:
+        atomic_write_csv(path, df, index=False)
+    return len(df)
+
+
+def load_plant_frame(csv_path):
+    """Plantas da exportação atual com a coluna plant_id (None se o CSV não existe)"""
+    if not os.path.exists(csv_path):
+        return None
+    if os.path.getsize(csv_path) > LARGE_EXPORT_BYTES:
+        df = ingest_plants(csv_path).frame()
+    else:
+        df = load_plants(csv_path)
+    df = annotate_duplicates(df, DUPLICATE_RADIUS_M)
+    df['plant_id'] = plant_ids(df)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Operações em lote sobre as avaliações de biogás")
+    parser.add_argument('--db', default=DB_PATH, help="Banco SQLite compartilhado")
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR, help="Pasta do journal de avaliações")
+    parser.add_argument('--csv', default=PLANT_CSV, help="Exportação de plantas do GEE")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help="Importa e mescla backups JSON")
+    import_parser.add_argument('files', nargs='+')
+    commands.add_parser('recompute', help="Atualiza campos derivados a partir da exportação de plantas")
+    export_parser = commands.add_parser('export', help="Exporta CSV ou Parquet (pela extensão)")
+    export_parser.add_argument('output')
+    export_parser.add_argument('--classifications', action='store_true',
+                               help="Exporta as classificações em vez da tabela de treinamento ML")
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, dest='fmt',
+                               help="Padrão pela extensão; geoparquet grava um dataset particionado")
+    export_parser.add_argument('--partition-by', default='municipio',
+                               help="Coluna de partição do GeoParquet ('' = arquivo único)")
+    chips_parser = commands.add_parser('chips', help="Recorta chips rotulados dos GeoTIFFs em volta das tecnologias")
+    chips_parser.add_argument('rasters', nargs='+')
+    chips_parser.add_argument('--output', default=CHIPS_DIR)
+    chips_parser.add_argument('--size', type=int, default=CHIP_SIZE, help="Lado do chip em pixels")
+    chips_parser.add_argument('--workers', type=int, help="Processos (padrão: núcleos da máquina)")
+    predict_parser = commands.add_parser('predict', help="Pré-classifica as plantas não avaliadas")
+    predict_parser.add_argument('--imagery', default=LOCAL_IMAGERY_DIR,
+                                help="Pasta de GeoTIFFs lidos na coordenada base de cada planta")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    db = BiogasDatabase(args.db)
+    journal = AssessmentJournal(args.journal_dir)
+    db.catch_up(journal)
+
+    if args.command == 'import':
+        try:
+            assessments, coordinates, classifications = import_backups(
+                args.files, db, journal, load_plant_frame(args.csv)
+            )
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"{assessments} avaliações, tecnologias de {coordinates} plantas "
+              f"e {classifications} classificações importadas")
+    elif args.command == 'recompute':
+        df = load_plant_frame(args.csv)
+        if df is None:
+            print(f"Arquivo não encontrado: {args.csv}", file=sys.stderr)
+            return 1
+        assessments, classifications = recompute(db, journal, df)
+        print(f"{assessments} avaliações e {classifications} classificações atualizadas")
+    elif args.command == 'export':
+        try:
+            rows = export(db, args.output, args.classifications, args.fmt, args.partition_by or None)
+        except (ValueError, ImportError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"{rows} linhas gravadas em {args.output}")
+    elif args.command == 'predict':
+        df = load_plant_frame(args.csv)
+        if df is None:
+            print(f"Arquivo não encontrado: {args.csv}", file=sys.stderr)
+            return 1
+        imagery = LocalRasterCatalog(args.imagery)
+        for name, error in imagery.errors.items():
+            print(f"Imagem ignorada: {name} ({error})", file=sys.stderr)
+        summary = run_preclassification(df, db, imagery.rasters.values())
+        if not summary['predicted']:
+            print(f"São necessárias ao menos {MIN_TRAINING_SAMPLES} avaliações com dois níveis diferentes",
+                  file=sys.stderr)
+            return 1
+        accuracy = summary['holdout_accuracy']
+        print(f"{summary['predicted']} plantas pré-classificadas com {summary['labelled']} rótulos"
+              + (f" (acurácia estimada {accuracy:.0%})" if accuracy is not None else "")
+              + (", com atributos de imagem" if summary['image_features'] else ""))
+    elif args.command == 'chips':
+        samples = chip_samples(build_export_frame(db.load_assessments(), db.load_coordinates()))
+        index = extract_chips(args.rasters, samples, args.output, args.size, args.workers)
+        print(f"{len(index)} chips de {len(samples)} amostras gravados em {args.output}")
+    print(f"Concluído em {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,367 @@
+"""Carregamento tipado do CSV de plantas com cache colunar (Parquet)"""
+import hashlib
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from biogas_geometry import annotate_geometry, parse_geometries
+from biogas_picker import normalize_text
+
+PLANT_CSV = 'Plantas_Biogas_Para_Classificacao.csv'
+CACHE_DIR = os.path.join('biogas_data', 'cache')
+
+# Incrementado quando as colunas derivadas do cache mudam
+CACHE_VERSION = 3
+
+# Tipos compactos: id como texto (preserva os zeros à esquerda do GEE),
+# coordenadas em float64 e município como categoria
+PLANT_DTYPES = {
+    'system:index': 'string',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+    'Municipio': 'category',
+    '.geo': 'string',
+}
+
+
+# Ids antigos, derivados da posição da linha no CSV (plant_000, plant_001, ...)
+LEGACY_ID_PATTERN = re.compile(r'^plant_(\d+)$')
+
+
+def plant_ids(df):
+    """Id estável de cada linha: o system:index do GEE (posição se a coluna faltar).
+
+    Repetições do mesmo system:index (exportações concatenadas) recebem um
+    sufixo de ocorrência para continuarem únicas.
+    """
+    if 'system:index' not in df:
+        return pd.Series([f"row_{i}" for i in range(len(df))], index=df.index, dtype=object)
+    ids = df['system:index'].astype(str)
+    occurrence = ids.groupby(ids).cumcount()
+    return ids.where(occurrence == 0, ids + '_' + occurrence.astype(str)).astype(object)
+
+
+def legacy_id_map(df, records):
+    """Mapeia ids antigos plant_NNN para o id estável da mesma planta.
+
+    records: {id antigo: registro salvo ou None}. A planta é localizada pelas
+    coordenadas gravadas no registro (robusto a reordenação do CSV); sem
+    coordenadas, ou sem correspondência, vale a posição original.
+    """
+    ids = df['plant_id'].to_numpy() if 'plant_id' in df else plant_ids(df).to_numpy()
+    rows_by_coords = {}
+    for row, key in enumerate(zip(df['Latitude'].round(6), df['Longitude'].round(6))):
+        rows_by_coords.setdefault(key, []).append(row)
+
+    mapping = {}
+    for old_id, record in records.items():
+        match = LEGACY_ID_PATTERN.match(old_id)
+        if match is None:
+            continue
+        position = int(match.group(1))
+        candidates = []
+        if record and record.get('latitude') is not None and record.get('longitude') is not None:
+            key = (round(float(record['latitude']), 6), round(float(record['longitude']), 6))
+            candidates = rows_by_coords.get(key, [])
+        if position in candidates or (not candidates and position < len(df)):
+            mapping[old_id] = ids[position]
+        elif candidates:
+            mapping[old_id] = ids[candidates[0]]
+    return mapping
+
+
+def file_digest(path, block_size=1 << 20):
+    """Hash do conteúdo do arquivo (chave do cache)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_plants_csv(path):
+    """Lê o CSV exportado do GEE já com os tipos definidos"""
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in PLANT_DTYPES.items() if column in header}
+    return pd.read_csv(path, dtype=dtypes)
+
+
+def load_plants(path=PLANT_CSV, cache_dir=CACHE_DIR):
+    """Carrega as plantas do cache Parquet, criando-o a partir do CSV quando necessário.
+
+    O cache é chaveado pelo hash do CSV: uma nova exportação gera um novo
+    arquivo e as anteriores são removidas. A coluna .geo é decodificada uma
+    única vez e o cache guarda geo_type, geo_area_m2 e geo_mismatch.
+    """
+    digest = file_digest(path)
+    cache_path = os.path.join(cache_dir, f"plants_v{CACHE_VERSION}_{digest}.parquet")
+
+    try:
+        return pd.read_parquet(cache_path)
+    except (FileNotFoundError, ImportError):
+        pass
+
+    df = annotate_geometry(read_plants_csv(path), GEO_TOLERANCE_DEG)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    except ImportError:
+        # Sem pyarrow/fastparquet: segue apenas com o CSV
+        return df
+
+    for name in os.listdir(cache_dir):
+        if name.startswith('plants_') and name.endswith('.parquet') and name != os.path.basename(cache_path):
+            os.remove(os.path.join(cache_dir, name))
+    return df
+
+
+# --- Ingestão em blocos para exportações grandes -----------------------------
+
+PLANT_STORE = os.path.join('biogas_data', 'plants.sqlite')
+
+# Acima deste tamanho o CSV é ingerido em blocos no SQLite em vez de lido inteiro
+LARGE_EXPORT_BYTES = 200 * 1024 ** 2
+
+# Diferença máxima (graus) aceita entre .geo e Latitude/Longitude (~1 m)
+GEO_TOLERANCE_DEG = 1e-5
+
+# Versão do esquema do PlantStore; mudanças forçam uma nova ingestão
+STORE_VERSION = '4'
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS plants (
+    position INTEGER PRIMARY KEY,
+    system_index TEXT NOT NULL,
+    plant_id TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    municipio TEXT,
+    municipio_key TEXT NOT NULL DEFAULT '',
+    geo_mismatch INTEGER NOT NULL DEFAULT 0,
+    geo_area_m2 REAL NOT NULL DEFAULT 0
+);
+"""
+
+STORE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_plants_system_index ON plants(system_index);
+CREATE INDEX IF NOT EXISTS idx_plants_plant_id ON plants(plant_id);
+CREATE INDEX IF NOT EXISTS idx_plants_municipio ON plants(municipio);
+"""
+
+# Repetições do mesmo system:index recebem o sufixo de ocorrência (como plant_ids)
+STORE_PLANT_IDS = """
+UPDATE plants SET plant_id = plants.system_index || '_' || repeated.occurrence
+FROM (SELECT position, ROW_NUMBER() OVER (PARTITION BY system_index ORDER BY position) - 1 AS occurrence
+      FROM plants) AS repeated
+WHERE repeated.position = plants.position AND repeated.occurrence > 0
+"""
+
+# Colunas de largura fixa que as interfaces mantêm em memória; ids e textos
+# de busca ficam no disco e são lidos por página
+STORE_RESIDENT_COLUMNS = ('latitude', 'longitude', 'municipio', 'geo_mismatch', 'geo_area_m2')
+
+# Mesmo texto de busca do PlantCatalog, montado na consulta
+STORE_SEARCH_TEXT = (
+    "printf('%02d', position + 1) || ' ' || municipio_key || ' ' || system_index || ' ' || lower(plant_id)"
+)
+
+# Limite de parâmetros por consulta IN (...)
+STORE_QUERY_BATCH = 500
+
+
+def validate_chunk(chunk):
+    """Remove linhas inválidas e confere .geo contra Latitude/Longitude.
+
+    Retorna o bloco sem a coluna .geo (redundante após a conferência), com as
+    colunas geo_mismatch e geo_area_m2, e o número de linhas descartadas.
+    """
+    valid = (
+        chunk['system:index'].notna()
+        & chunk['Latitude'].between(-90, 90)
+        & chunk['Longitude'].between(-180, 180)
+    )
+    rejected = int((~valid).sum())
+    chunk = chunk[valid]
+
+    mismatch = np.zeros(len(chunk), dtype=bool)
+    area = np.zeros(len(chunk))
+    if '.geo' in chunk:
+        geometries = parse_geometries(chunk['.geo'])
+        mismatch = geometries.mismatch(chunk['Latitude'], chunk['Longitude'], GEO_TOLERANCE_DEG)
+        area = geometries.areas_m2()
+        chunk = chunk.drop(columns='.geo')
+
+    return chunk.assign(geo_mismatch=mismatch.astype('int64'), geo_area_m2=area), rejected
+
+
+class PlantStore:
+    """Plantas ingeridas em SQLite, consultadas por posição, id ou busca.
+
+    As interfaces mantêm em memória só as colunas de largura fixa
+    (`STORE_RESIDENT_COLUMNS`, lidas com `frame`) e buscam ids, rótulos e
+    linhas completas por página, pelos índices de posição, plant_id e
+    município. `frame` com todas as colunas fica para tarefas em lote.
+    """
+
+    def __init__(self, path=PLANT_STORE):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(STORE_SCHEMA)
+
+    def meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM plants').fetchone()[0]
+
+    def _frame(self, sql, params=()):
+        df = pd.read_sql_query(sql, self._conn, params=params)
+        return df.rename(columns={
+            'system_index': 'system:index', 'latitude': 'Latitude',
+            'longitude': 'Longitude', 'municipio': 'Municipio'
+        })
+
+    @staticmethod
+    def _typed(df):
+        if 'Municipio' in df:
+            df['Municipio'] = df['Municipio'].astype('category')
+        if 'system:index' in df:
+            df['system:index'] = df['system:index'].astype('string')
+        if 'geo_mismatch' in df:
+            df['geo_mismatch'] = df['geo_mismatch'].astype(bool)
+        return df
+
+    def frame(self, columns=('position', 'system_index', 'latitude', 'longitude', 'municipio',
+                             'geo_mismatch', 'geo_area_m2'), chunksize=100_000):
+        """Colunas pedidas de todas as plantas (sem .geo), lidas em blocos.
+
+        O município vira categoria bloco a bloco, então o texto completo da
+        coluna nunca fica em memória de uma vez.
+        """
+        chunks = []
+        for start in range(0, len(self), chunksize):
+            chunks.append(self._typed(self._frame(
+                f"SELECT {', '.join(columns)} FROM plants WHERE position >= ? AND position < ? ORDER BY position",
+                (start, start + chunksize)
+            )))
+        if not chunks:
+            return self._typed(self._frame(f"SELECT {', '.join(columns)} FROM plants"))
+        if 'Municipio' in chunks[0]:
+            municipios = pd.api.types.union_categoricals([chunk['Municipio'] for chunk in chunks])
+            for chunk in chunks:
+                chunk['Municipio'] = pd.Categorical(chunk['Municipio'], categories=municipios.categories)
+        df = pd.concat(chunks, ignore_index=True)
+        return df.drop(columns='position', errors='ignore')
+
+    def rows(self, positions):
+        """Linhas completas (com plant_id) das posições pedidas, na mesma ordem"""
+        positions = [int(p) for p in positions]
+        chunks = [
+            self._frame(
+                f"""SELECT position, system_index, plant_id, latitude, longitude, municipio,
+                           geo_mismatch, geo_area_m2
+                    FROM plants WHERE position IN ({', '.join('?' * len(batch))})""",
+                batch
+            )
+            for batch in _batches(positions)
+        ]
+        columns = ['position', 'system:index', 'plant_id', 'Latitude', 'Longitude', 'Municipio',
+                   'geo_mismatch', 'geo_area_m2']
+        df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+        return self._typed(df.set_index('position').reindex(positions))
+
+    def plant_ids(self, positions):
+        """plant_id de cada posição pedida"""
+        return self.rows(positions)['plant_id'].to_numpy(dtype=object)
+
+    def positions_of(self, plant_ids):
+        """{plant_id: posição} dos ids conhecidos, pelo índice de plant_id"""
+        found = {}
+        for batch in _batches(list(plant_ids)):
+            found.update(self._conn.execute(
+                f"SELECT plant_id, position FROM plants WHERE plant_id IN ({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall())
+        return found
+
+    def search(self, query):
+        """Posições (ordenadas) cujo número, município ou id contém o texto"""
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', normalize_text(query).strip()) + '%'
+        rows = self._conn.execute(
+            f"SELECT position FROM plants WHERE {STORE_SEARCH_TEXT} LIKE ? ESCAPE '\\' ORDER BY position",
+            (pattern,)
+        ).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+
+def _batches(values, size=STORE_QUERY_BATCH):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def ingest_plants(csv_path, store_path=PLANT_STORE, chunksize=50_000):
+    """Ingere o CSV em blocos no PlantStore; memória limitada a um bloco por vez.
+
+    A ingestão é refeita apenas se o hash do CSV mudar.
+    """
+    digest = file_digest(csv_path)
+    directory = os.path.dirname(store_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    store = PlantStore(store_path)
+    if store.meta('csv_digest') == digest and store.meta('schema_version') == STORE_VERSION:
+        return store
+
+    conn = store._conn
+    conn.execute('DROP TABLE IF EXISTS plants')
+    conn.executescript(STORE_SCHEMA)
+
+    position = 0
+    rows_rejected = 0
+    geo_mismatches = 0
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {column: dtype for column, dtype in PLANT_DTYPES.items()
+              if column in header and column != 'Municipio'}
+    for chunk in pd.read_csv(csv_path, dtype=dtypes, chunksize=chunksize):
+        chunk, rejected = validate_chunk(chunk)
+        rows_rejected += rejected
+        geo_mismatches += int(chunk['geo_mismatch'].sum())
+        # Normalização para a busca feita uma vez por município distinto do bloco
+        municipios = chunk['Municipio'].astype('category')
+        keys = np.array([normalize_text(c) for c in municipios.cat.categories] + [''], dtype=object)
+        conn.executemany(
+            """INSERT INTO plants
+               (position, system_index, plant_id, latitude, longitude, municipio, municipio_key,
+                geo_mismatch, geo_area_m2)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            zip(
+                range(position, position + len(chunk)),
+                chunk['system:index'].astype(str),
+                chunk['system:index'].astype(str),
+                chunk['Latitude'].astype(float),
+                chunk['Longitude'].astype(float),
+                chunk['Municipio'].astype(object).where(chunk['Municipio'].notna(), None),
+                keys[municipios.cat.codes.to_numpy()],
+                chunk['geo_mismatch'].astype(int),
+                chunk['geo_area_m2'].astype(float),
+            )
+        )
+        position += len(chunk)
+
+    conn.executescript(STORE_INDEXES)
+    conn.execute(STORE_PLANT_IDS)
+    conn.executemany(
+        'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+        [('csv_digest', digest), ('schema_version', STORE_VERSION), ('rows_rejected', str(rows_rejected)),
+         ('geo_mismatches', str(geo_mismatches))]
+    )
+    conn.commit()
+    return store
@@ -0,0 +1,529 @@
+"""Armazenamento SQLite (modo WAL) para avaliações, coordenadas e classificações"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+
+from biogas_journal import remove_coordinate
+
+DB_PATH = os.path.join('biogas_data', 'biogas.sqlite')
+
+# Reserva de uma planta por avaliador; expira se a sessão for abandonada
+LEASE_TTL_S = 15 * 60
+
+# Tabela que marca uma planta como concluída em cada fluxo de trabalho
+DONE_TABLES = {'assessment': 'assessments', 'classification': 'classifications'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assessments (
+    plant_id TEXT PRIMARY KEY,
+    municipio TEXT,
+    tech_level TEXT,
+    validation_status TEXT,
+    confidence REAL,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_assessments_validation ON assessments(validation_status);
+CREATE INDEX IF NOT EXISTS idx_assessments_tech_level ON assessments(tech_level);
+CREATE INDEX IF NOT EXISTS idx_assessments_municipio ON assessments(municipio);
+-- Índice de cobertura: a fila de validação é montada sem ler o JSON das linhas
+CREATE INDEX IF NOT EXISTS idx_assessments_queue
+    ON assessments(validation_status, confidence, timestamp, plant_id, municipio, tech_level);
+
+CREATE TABLE IF NOT EXISTS technology_coordinates (
+    plant_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT,
+    lat REAL,
+    lon REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (plant_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_coordinates_type ON technology_coordinates(type);
+
+CREATE TABLE IF NOT EXISTS classifications (
+    plant_id TEXT PRIMARY KEY,
+    municipio TEXT,
+    tecnologia TEXT,
+    confianca REAL,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_classifications_tecnologia ON classifications(tecnologia);
+CREATE INDEX IF NOT EXISTS idx_classifications_municipio ON classifications(municipio);
+
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+
+CREATE TABLE IF NOT EXISTS leases (
+    scope TEXT NOT NULL,
+    plant_id TEXT NOT NULL,
+    assessor TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, plant_id)
+);
+CREATE INDEX IF NOT EXISTS idx_leases_assessor ON leases(scope, assessor);
+
+CREATE TABLE IF NOT EXISTS predictions (
+    plant_id TEXT PRIMARY KEY,
+    predicted_class TEXT,
+    confidence REAL,
+    uncertainty REAL,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_uncertainty ON predictions(uncertainty DESC);
+"""
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyRecords(MutableMapping):
+    """Dicionário por plant_id que só lê do banco o registro acessado.
+
+    As chaves vêm de uma consulta leve na inicialização; cada valor é
+    decodificado na primeira leitura e mantido em memória. Iterar sobre
+    values()/items() carrega tudo, então os caminhos quentes usam só chaves.
+    """
+
+    def __init__(self, keys, load_one):
+        self._keys = set(keys)
+        self._load_one = load_one
+        self._cache = {}
+        self.loads = 0
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        if key not in self._keys:
+            raise KeyError(key)
+        value = self._load_one(key)
+        if value is None:
+            self._keys.discard(key)
+            raise KeyError(key)
+        self.loads += 1
+        self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._keys.add(key)
+        self._cache[key] = value
+
+    def __delitem__(self, key):
+        self._keys.remove(key)
+        self._cache.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def cached(self, key, default=None):
+        """Valor já em memória, sem ir ao banco"""
+        return self._cache.get(key, default)
+
+    def forget(self, key):
+        """Descarta a cópia em memória (a próxima leitura vem do banco)"""
+        self._cache.pop(key, None)
+
+    def add_key(self, key):
+        self._keys.add(key)
+
+
+class BiogasDatabase:
+    """Camada de persistência SQLite com índices por planta, status, nível e município"""
+
+    def __init__(self, path=DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # timeout: espera o lock de escrita de outro processo (vários avaliadores)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _transaction(self, work, synced=False):
+        """Executa work(conn) numa transação; synced faz fsync do WAL no commit"""
+        with self._lock:
+            if synced:
+                self._conn.execute('PRAGMA synchronous=FULL')
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self._conn)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            finally:
+                if synced:
+                    self._conn.execute('PRAGMA synchronous=NORMAL')
+        return result
+
+    def get_meta(self, key):
+        row = self._execute('SELECT value FROM meta WHERE key = ?', (key,))
+        return row[0][0] if row else None
+
+    # --- Avaliações -------------------------------------------------------
+
+    def load_assessment(self, plant_id):
+        row = self._execute('SELECT data FROM assessments WHERE plant_id = ?', (plant_id,))
+        return json.loads(row[0][0]) if row else None
+
+    def assessment_ids(self):
+        return [pid for (pid,) in self._execute('SELECT plant_id FROM assessments')]
+
+    def plant_ids_by_status(self, status):
+        return [pid for (pid,) in self._execute(
+            'SELECT plant_id FROM assessments WHERE validation_status = ?', (status,)
+        )]
+
+    def queue_rows(self):
+        """Colunas indexadas usadas pela fila de validação (sem decodificar o JSON)"""
+        return self._execute(
+            """SELECT plant_id, validation_status, confidence, timestamp, municipio, tech_level
+               FROM assessments"""
+        )
+
+    def load_assessments(self):
+        return {pid: json.loads(data) for pid, data in
+                self._execute('SELECT plant_id, data FROM assessments')}
+
+    def status_counts(self):
+        return dict(self._execute(
+            'SELECT validation_status, COUNT(*) FROM assessments GROUP BY validation_status'
+        ))
+
+    def tech_level_counts(self):
+        return dict(self._execute(
+            'SELECT tech_level, COUNT(*) FROM assessments GROUP BY tech_level'
+        ))
+
+    def assessment_summary(self):
+        """Total de avaliações e confiança média"""
+        total, avg_confidence = self._execute(
+            'SELECT COUNT(*), AVG(confidence) FROM assessments'
+        )[0]
+        return total, avg_confidence or 0
+
+    # --- Coordenadas de tecnologias ---------------------------------------
+
+    def load_coordinates(self):
+        coordinates = {}
+        for plant_id, data in self._execute(
+            'SELECT plant_id, data FROM technology_coordinates ORDER BY plant_id, position'
+        ):
+            coordinates.setdefault(plant_id, []).append(json.loads(data))
+        return coordinates
+
+    def load_plant_coordinates(self, plant_id):
+        return [json.loads(data) for (data,) in self._execute(
+            'SELECT data FROM technology_coordinates WHERE plant_id = ? ORDER BY position', (plant_id,)
+        )]
+
+    def coordinate_plant_ids(self):
+        return [pid for (pid,) in self._execute('SELECT DISTINCT plant_id FROM technology_coordinates')]
+
+    def coordinate_count(self):
+        return self._execute('SELECT COUNT(*) FROM technology_coordinates')[0][0]
+
+    # --- Classificações (interface simplificada) --------------------------
+
+    def upsert_classification(self, plant_id, data):
+        self.upsert_classifications({plant_id: data})
+
+    def upsert_classifications(self, classifications):
+        """Grava várias classificações {plant_id: data} numa transação.
+
+        As classificações não passam pelo journal: o banco é a cópia durável,
+        então o commit faz fsync.
+        """
+        self._transaction(lambda conn: conn.executemany(
+            """INSERT OR REPLACE INTO classifications
+               (plant_id, municipio, tecnologia, confianca, timestamp, data)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(pid, data.get('municipio'), data.get('tecnologia'), data.get('confianca'),
+              data.get('timestamp'), _dumps(data)) for pid, data in classifications.items()]
+        ), synced=True)
+
+    def load_classification(self, plant_id):
+        row = self._execute('SELECT data FROM classifications WHERE plant_id = ?', (plant_id,))
+        return json.loads(row[0][0]) if row else None
+
+    def load_classifications(self):
+        return {pid: json.loads(data) for pid, data in
+                self._execute('SELECT plant_id, data FROM classifications')}
+
+    def classification_ids(self):
+        return [pid for (pid,) in self._execute('SELECT plant_id FROM classifications')]
+
+    def classification_summary(self):
+        """Total de classificações e confiança média"""
+        total, avg_confidence = self._execute(
+            'SELECT COUNT(*), AVG(confianca) FROM classifications'
+        )[0]
+        return total, avg_confidence or 0
+
+    def classification_counts(self):
+        return dict(self._execute(
+            'SELECT tecnologia, COUNT(*) FROM classifications GROUP BY tecnologia'
+        ))
+
+    # --- Journal → banco ---------------------------------------------------
+
+    def journal_seq(self):
+        """Último evento do journal refletido no banco (None se nunca registrado)"""
+        value = self.get_meta('journal_seq')
+        return int(value) if value is not None else None
+
+    @staticmethod
+    def _set_journal_seq(conn, seq):
+        conn.execute(
+            """INSERT INTO meta (key, value) VALUES ('journal_seq', ?)
+               ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)""",
+            (seq,)
+        )
+
+    @staticmethod
+    def _write_coordinates(conn, plant_id, coords):
+        conn.execute('DELETE FROM technology_coordinates WHERE plant_id = ?', (plant_id,))
+        conn.executemany(
+            """INSERT INTO technology_coordinates (plant_id, position, type, lat, lon, data)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(plant_id, i, c.get('type'), c['lat'], c['lon'], _dumps(c)) for i, c in enumerate(coords)]
+        )
+
+    def apply_event(self, kind, plant_id, data, seq):
+        """Aplica um evento do journal e registra seu seq na mesma transação"""
+        self.apply_events([{'kind': kind, 'plant_id': plant_id, 'data': data, 'seq': seq}])
+
+    def apply_events(self, records):
+        """Aplica registros do journal em ordem, numa única transação"""
+        def work(conn):
+            for record in records:
+                self._apply(conn, record['kind'], record['plant_id'], record['data'])
+            if records:
+                self._set_journal_seq(conn, max(record['seq'] for record in records))
+        self._transaction(work)
+
+    def _apply(self, conn, kind, plant_id, data):
+        """Um evento do journal sobre o banco, dentro da transação do chamador"""
+        if kind == 'assessment':
+            conn.execute(
+                """INSERT OR REPLACE INTO assessments
+                   (plant_id, municipio, tech_level, validation_status, confidence, timestamp, data)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (plant_id, data.get('municipio'), data.get('tech_level'),
+                 data.get('validation_status', 'PENDING'), data.get('confidence'),
+                 data.get('timestamp'), _dumps(data))
+            )
+        elif kind == 'validation':
+            row = conn.execute('SELECT data FROM assessments WHERE plant_id = ?', (plant_id,)).fetchone()
+            if row is not None:
+                merged = json.loads(row[0])
+                merged.update(data)
+                conn.execute(
+                    'UPDATE assessments SET validation_status = ?, data = ? WHERE plant_id = ?',
+                    (merged.get('validation_status', 'PENDING'), _dumps(merged), plant_id)
+                )
+        elif kind in ('coordinate_add', 'coordinate_remove'):
+            coords = [json.loads(c) for (c,) in conn.execute(
+                'SELECT data FROM technology_coordinates WHERE plant_id = ? ORDER BY position', (plant_id,)
+            )]
+            if kind == 'coordinate_add':
+                coords.append(data)
+            else:
+                coords = remove_coordinate(coords, data)
+            self._write_coordinates(conn, plant_id, coords)
+        elif kind == 'coordinates_set':
+            self._write_coordinates(conn, plant_id, data)
+
+    def import_state(self, state, seq):
+        """Substitui avaliações e coordenadas pelo estado reconstruído do journal"""
+        def work(conn):
+            conn.execute('DELETE FROM assessments')
+            conn.execute('DELETE FROM technology_coordinates')
+            conn.executemany(
+                """INSERT INTO assessments
+                   (plant_id, municipio, tech_level, validation_status, confidence, timestamp, data)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(pid, a.get('municipio'), a.get('tech_level'), a.get('validation_status', 'PENDING'),
+                  a.get('confidence'), a.get('timestamp'), _dumps(a))
+                 for pid, a in state['assessments'].items()]
+            )
+            for plant_id, coords in state['coordinates'].items():
+                self._write_coordinates(conn, plant_id, coords)
+            conn.execute("DELETE FROM meta WHERE key = 'journal_seq'")
+            self._set_journal_seq(conn, seq)
+        self._transaction(work)
+
+    def catch_up(self, journal):
+        """Leva ao banco os eventos do journal que ainda não estão nele.
+
+        Na inicialização normal o banco já está em dia e nada é lido além da
+        cauda do journal. Um banco novo (ou que perdeu eventos já compactados
+        no snapshot) é reconstruído a partir de snapshot + journal. Um banco
+        anterior ao registro de seq é considerado em dia. Retorna o número
+        de eventos aplicados.
+        """
+        db_seq = self.journal_seq()
+        if db_seq is None and self.assessment_ids():
+            self._transaction(lambda conn: self._set_journal_seq(conn, journal.last_seq))
+            return 0
+        if db_seq is None or db_seq < journal.snapshot_seq():
+            state = journal.load()
+            self.import_state(state, journal.last_seq)
+            return len(state['assessments']) + sum(len(c) for c in state['coordinates'].values())
+
+        records = journal.records_after(db_seq)
+        self.apply_events(records)
+        return len(records)
+
+    # --- Pré-classificação -----------------------------------------------
+
+    def tech_level_labels(self):
+        """{plant_id: tech_level} das avaliações (rótulos de treino), pelo índice"""
+        return dict(self._execute('SELECT plant_id, tech_level FROM assessments WHERE tech_level IS NOT NULL'))
+
+    def replace_predictions(self, predictions, model_version):
+        """Troca todas as previsões: (plant_id, classe, confiança, incerteza)"""
+        def work(conn):
+            conn.execute('DELETE FROM predictions')
+            conn.executemany(
+                """INSERT INTO predictions (plant_id, predicted_class, confidence, uncertainty, model_version)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [(*prediction, model_version) for prediction in predictions]
+            )
+        self._transaction(work)
+
+    def load_prediction(self, plant_id):
+        rows = self._execute(
+            'SELECT predicted_class, confidence, uncertainty, model_version FROM predictions WHERE plant_id = ?',
+            (plant_id,)
+        )
+        if not rows:
+            return None
+        return dict(zip(('predicted_class', 'confidence', 'uncertainty', 'model_version'), rows[0]))
+
+    def prediction_count(self):
+        return self._execute('SELECT COUNT(*) FROM predictions')[0][0]
+
+    def uncertain_plant_ids(self):
+        """plant_ids previstos, do mais incerto ao mais confiante (índice de incerteza)"""
+        return [pid for (pid,) in self._execute('SELECT plant_id FROM predictions ORDER BY uncertainty DESC')]
+
+    # --- Migração de ids -------------------------------------------------
+
+    def legacy_records(self, pattern='plant_%'):
+        """{plant_id: registro} dos ids no formato antigo (coordenadas sem registro → None)"""
+        records = {}
+        for table in ('technology_coordinates', 'assessments', 'classifications'):
+            column = 'NULL' if table == 'technology_coordinates' else 'data'
+            for plant_id, data in self._execute(
+                f'SELECT DISTINCT plant_id, {column} FROM {table} WHERE plant_id LIKE ?', (pattern,)
+            ):
+                if data is not None or plant_id not in records:
+                    records[plant_id] = json.loads(data) if data is not None else None
+        return records
+
+    def rename_plants(self, mapping):
+        """Troca ids de planta em todas as tabelas (e em duplicate_of) numa transação"""
+        def rename_data(data):
+            data = json.loads(data)
+            if data.get('duplicate_of') in mapping:
+                data['duplicate_of'] = mapping[data['duplicate_of']]
+            return _dumps(data)
+
+        def work(conn):
+            for table in ('assessments', 'classifications', 'technology_coordinates'):
+                rows = conn.execute(f'SELECT rowid, plant_id, data FROM {table}').fetchall()
+                conn.executemany(
+                    f'UPDATE OR REPLACE {table} SET plant_id = ?, data = ? WHERE rowid = ?',
+                    [(mapping.get(plant_id, plant_id), rename_data(data), rowid)
+                     for rowid, plant_id, data in rows
+                     if plant_id in mapping or '"duplicate_of"' in data]
+                )
+            conn.execute('DELETE FROM leases')
+            conn.execute('DELETE FROM predictions')
+        self._transaction(work)
+
+    # --- Reservas (vários avaliadores em paralelo) -------------------------
+
+    def _leases_transaction(self, work):
+        """Executa work(conn, now) numa transação de escrita, limpando reservas vencidas"""
+        now = time.time()
+
+        # IMMEDIATE: o lock de escrita é obtido antes da leitura, então
+        # dois processos nunca reservam a mesma planta
+        def leased(conn):
+            conn.execute('DELETE FROM leases WHERE expires_at <= ?', (now,))
+            return work(conn, now)
+        return self._transaction(leased)
+
+    def acquire_lease(self, scope, plant_id, assessor, ttl_s=LEASE_TTL_S):
+        """Reserva (ou renova) a planta para o avaliador; devolve quem a detém"""
+        def work(conn, now):
+            row = conn.execute(
+                'SELECT assessor FROM leases WHERE scope = ? AND plant_id = ?', (scope, plant_id)
+            ).fetchone()
+            if row is not None and row[0] != assessor:
+                return row[0]
+            # Cada avaliador mantém uma única reserva por fluxo
+            conn.execute('DELETE FROM leases WHERE scope = ? AND assessor = ?', (scope, assessor))
+            conn.execute(
+                'INSERT INTO leases (scope, plant_id, assessor, expires_at) VALUES (?, ?, ?, ?)',
+                (scope, plant_id, assessor, now + ttl_s)
+            )
+            return assessor
+        return self._leases_transaction(work)
+
+    def checkout_next(self, scope, assessor, candidate_ids, ttl_s=LEASE_TTL_S, batch_size=500):
+        """Reserva a primeira planta de candidate_ids sem reserva e ainda não concluída.
+
+        candidate_ids pode ser um gerador (por exemplo, a partir da planta
+        atual); ele é consumido em lotes até achar uma planta livre.
+        """
+        done_table = DONE_TABLES[scope]
+
+        def work(conn, now):
+            ids = iter(candidate_ids)
+            while True:
+                batch = [plant_id for _, plant_id in zip(range(batch_size), ids)]
+                if not batch:
+                    return None
+                placeholders = ', '.join('?' * len(batch))
+                taken = {row[0] for row in conn.execute(
+                    f"""SELECT plant_id FROM leases WHERE scope = ? AND assessor != ?
+                          AND plant_id IN ({placeholders})
+                        UNION SELECT plant_id FROM {done_table} WHERE plant_id IN ({placeholders})""",
+                    (scope, assessor, *batch, *batch)
+                )}
+                chosen = next((plant_id for plant_id in batch if plant_id not in taken), None)
+                if chosen is not None:
+                    conn.execute('DELETE FROM leases WHERE scope = ? AND assessor = ?', (scope, assessor))
+                    conn.execute(
+                        'INSERT INTO leases (scope, plant_id, assessor, expires_at) VALUES (?, ?, ?, ?)',
+                        (scope, chosen, assessor, now + ttl_s)
+                    )
+                    return chosen
+        return self._leases_transaction(work)
+
+    def active_leases(self, scope):
+        """{plant_id: avaliador} das reservas em vigor"""
+        return dict(self._execute(
+            'SELECT plant_id, assessor FROM leases WHERE scope = ? AND expires_at > ?',
+            (scope, time.time())
+        ))
@@ -0,0 +1,318 @@
+"""Exportação incremental dos dados estruturados para treinamento ML"""
+import io
+import json
+import os
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from biogas_geo import haversine_distances
+from biogas_storage import atomic_write_bytes, atomic_write_csv, atomic_write_dir
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # sem pyarrow: exportação só em CSV
+    pa = pq = None
+
+# Tipos da exportação colunar (CSV continua com o DataFrame original)
+ML_CATEGORY_COLUMNS = ('municipio', 'overall_technology_level', 'validation_status', 'technology_type')
+ML_DTYPES = {
+    'has_biogas_plant': 'bool',
+    'assessor_confidence': 'int16',
+    'validation_confidence': 'int16',
+    'base_latitude': 'float64',
+    'base_longitude': 'float64',
+    'tech_latitude': 'float64',
+    'tech_longitude': 'float64',
+    'estimated_area_m2': 'float32',
+    'distance_from_base_m': 'float32',
+}
+# Colunas da exportação ML, na ordem de build_plant_records
+ML_EXPORT_COLUMNS = (
+    'plant_id', 'municipio', 'base_latitude', 'base_longitude', 'has_biogas_plant',
+    'overall_technology_level', 'assessor_confidence', 'assessment_date', 'validation_status',
+    'validation_confidence', 'general_observations', 'technology_id', 'tech_latitude',
+    'tech_longitude', 'technology_type', 'estimated_area_m2', 'distance_from_base_m', 'tech_notes',
+)
+GEOPARQUET_AVAILABLE = pa is not None
+GEOMETRY_COLUMN = 'geometry'
+PARTITION_FILE = 'part-0.parquet'
+
+# Ponto WKB little-endian: byte de ordem, tipo (1 = Point), x, y
+_WKB_POINT = np.dtype([('order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+
+def build_plant_records(plant_id, assessment, tech_coords):
+    """Gera as linhas de exportação ML de uma única planta"""
+    base_record = {
+        'plant_id': plant_id,
+        'municipio': assessment['municipio'],
+        'base_latitude': assessment['latitude'],
+        'base_longitude': assessment['longitude'],
+        'has_biogas_plant': assessment.get('has_plant', True),
+        'overall_technology_level': assessment.get('tech_level', 'UNKNOWN'),
+        'assessor_confidence': assessment.get('confidence', 0),
+        'assessment_date': assessment.get('timestamp', ''),
+        'validation_status': assessment.get('validation_status', 'PENDING'),
+        'validation_confidence': assessment.get('validation_confidence', 0),
+        'general_observations': assessment.get('observations', '')
+    }
+
+    records = []
+    if tech_coords:
+        # Distâncias de todas as tecnologias calculadas em uma única chamada
+        distances = haversine_distances(
+            base_record['base_latitude'],
+            base_record['base_longitude'],
+            [coord['lat'] for coord in tech_coords],
+            [coord['lon'] for coord in tech_coords]
+        )
+        for i, coord in enumerate(tech_coords):
+            record = base_record.copy()
+            record.update({
+                'technology_id': f"{plant_id}_tech_{i+1}",
+                'tech_latitude': coord['lat'],
+                'tech_longitude': coord['lon'],
+                'technology_type': coord.get('type', 'unknown'),
+                'estimated_area_m2': coord.get('area', 0),
+                'distance_from_base_m': float(distances[i]),
+                'tech_notes': coord.get('notes', '')
+            })
+            records.append(record)
+    else:
+        # Se não há coordenadas específicas, usar localização base
+        record = base_record.copy()
+        record.update({
+            'technology_id': f"{plant_id}_base",
+            'tech_latitude': base_record['base_latitude'],
+            'tech_longitude': base_record['base_longitude'],
+            'technology_type': base_record['overall_technology_level'],
+            'estimated_area_m2': 0,
+            'distance_from_base_m': 0,
+            'tech_notes': 'Base location assessment'
+        })
+        records.append(record)
+
+    return records
+
+
+def build_export_frame(assessments, coordinates):
+    """Tabela de exportação ML completa, com as mesmas colunas de build_plant_records.
+
+    Versão em lote para a linha de comando: as tecnologias de todas as
+    plantas viram uma tabela só e as distâncias saem de uma chamada
+    vetorizada, em vez de um cálculo por planta.
+    """
+    base = pd.DataFrame.from_dict(assessments, orient='index')
+    if base.empty:
+        return pd.DataFrame(columns=list(ML_EXPORT_COLUMNS))
+
+    def get(column, default):
+        if column not in base:
+            return default
+        return base[column].where(base[column].notna(), default)
+
+    base = pd.DataFrame({
+        'plant_id': base.index,
+        'municipio': base['municipio'],
+        'base_latitude': base['latitude'].astype(float),
+        'base_longitude': base['longitude'].astype(float),
+        'has_biogas_plant': get('has_plant', True),
+        'overall_technology_level': get('tech_level', 'UNKNOWN'),
+        'assessor_confidence': get('confidence', 0),
+        'assessment_date': get('timestamp', ''),
+        'validation_status': get('validation_status', 'PENDING'),
+        'validation_confidence': get('validation_confidence', 0),
+        'general_observations': get('observations', '')
+    }).reset_index(drop=True)
+
+    techs = pd.DataFrame([
+        {'plant_id': plant_id, 'tech_index': i, **coord}
+        for plant_id in base['plant_id'] for i, coord in enumerate(coordinates.get(plant_id) or [])
+    ], columns=['plant_id', 'tech_index', 'lat', 'lon', 'type', 'area', 'notes'])
+    # Tipos numéricos explícitos: sem tecnologias as colunas viriam como object
+    techs = techs.astype({'tech_index': 'float64', 'lat': 'float64', 'lon': 'float64', 'area': 'float64'})
+    merged = base.merge(techs, on='plant_id', how='left', sort=False)
+    has_tech = merged['tech_index'].notna()
+
+    suffix = 'tech_' + (merged['tech_index'].fillna(0).astype(int) + 1).astype(str)
+    merged['technology_id'] = merged['plant_id'] + '_' + suffix.where(has_tech, 'base')
+    merged['tech_latitude'] = merged['lat'].where(has_tech, merged['base_latitude']).astype(float)
+    merged['tech_longitude'] = merged['lon'].where(has_tech, merged['base_longitude']).astype(float)
+    merged['technology_type'] = merged['type'].fillna('unknown').where(has_tech, merged['overall_technology_level'])
+    merged['estimated_area_m2'] = merged['area'].fillna(0).where(has_tech, 0)
+    merged['distance_from_base_m'] = haversine_distances(
+        merged['base_latitude'], merged['base_longitude'],
+        merged['tech_latitude'], merged['tech_longitude']
+    )
+    merged['tech_notes'] = merged['notes'].fillna('').where(has_tech, 'Base location assessment')
+    return merged.drop(columns=['tech_index', 'lat', 'lon', 'type', 'area', 'notes'])
+
+
+def typed_export_frame(df):
+    """Cópia da exportação ML com tipos compactos (categorias, inteiros, datas).
+
+    Uma tabela sem colunas (nenhuma avaliação) vira a tabela vazia com todas
+    as colunas da exportação, para os arquivos saírem com o esquema completo.
+    """
+    df = pd.DataFrame(columns=list(ML_EXPORT_COLUMNS)) if df.columns.empty else df.copy()
+    for column, dtype in ML_DTYPES.items():
+        if column in df:
+            df[column] = df[column].fillna(0).astype(dtype) if dtype != 'bool' else df[column].astype(bool)
+    for column in ML_CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    if 'assessment_date' in df:
+        df['assessment_date'] = pd.to_datetime(df['assessment_date'], errors='coerce', format='ISO8601')
+    return df
+
+
+def points_wkb(lons, lats):
+    """Pontos (lon, lat) codificados em WKB, montados em lote num array estruturado"""
+    points = np.empty(len(lons), dtype=_WKB_POINT)
+    points['order'] = 1
+    points['type'] = 1
+    points['x'] = lons
+    points['y'] = lats
+    raw = points.tobytes()
+    size = _WKB_POINT.itemsize
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+def geoparquet_metadata(lons, lats):
+    """Metadados "geo" (GeoParquet 1.0.0) da coluna de pontos, com o bbox do arquivo"""
+    column = {'encoding': 'WKB', 'geometry_types': ['Point']}
+    if len(lons):
+        column['bbox'] = [float(np.min(lons)), float(np.min(lats)), float(np.max(lons)), float(np.max(lats))]
+    return {'version': '1.0.0', 'primary_column': GEOMETRY_COLUMN, 'columns': {GEOMETRY_COLUMN: column}}
+
+
+def geoparquet_table(df):
+    """Tabela Arrow da exportação tipada com a geometria das tecnologias (CRS84)"""
+    if pa is None:
+        raise ImportError("Exportação GeoParquet requer pyarrow")
+    if df.columns.empty:
+        df = typed_export_frame(df)
+    lons = df['tech_longitude'].to_numpy(dtype=np.float64)
+    lats = df['tech_latitude'].to_numpy(dtype=np.float64)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(GEOMETRY_COLUMN, pa.array(points_wkb(lons, lats), type=pa.binary()))
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geoparquet_metadata(lons, lats)).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+def geoparquet_bytes(df):
+    """Arquivo GeoParquet único em memória (download pela interface)"""
+    buffer = io.BytesIO()
+    pq.write_table(geoparquet_table(typed_export_frame(df)), buffer, compression='zstd')
+    return buffer.getvalue()
+
+
+def parquet_bytes(df):
+    """Parquet tipado, sem geometria"""
+    buffer = io.BytesIO()
+    typed_export_frame(df).to_parquet(buffer, index=False, compression='zstd')
+    return buffer.getvalue()
+
+
+def write_geoparquet(df, path, partition_by='municipio'):
+    """Grava a exportação como GeoParquet.
+
+    Sem partition_by é um arquivo só. Com partição, `path` vira um dataset
+    Hive (`municipio=<nome>/part-0.parquet`, nomes com escape de URL), cada
+    arquivo com o bbox das suas plantas: leitores filtram regiões e colunas
+    sem abrir o resto. O diretório é trocado inteiro de forma atômica.
+    """
+    if partition_by is None:
+        atomic_write_bytes(path, geoparquet_bytes(df))
+        return
+
+    df = typed_export_frame(df)
+
+    def write(directory):
+        if df.empty:
+            # Sem avaliações: um arquivo vazio na raiz preserva o esquema do dataset
+            pq.write_table(geoparquet_table(df), os.path.join(directory, PARTITION_FILE), compression='zstd')
+            return
+        for value, group in df.groupby(partition_by, observed=True, sort=True):
+            partition_dir = os.path.join(directory, f"{partition_by}={quote(str(value), safe='')}")
+            os.makedirs(partition_dir)
+            table = geoparquet_table(group.drop(columns=partition_by))
+            pq.write_table(table, os.path.join(partition_dir, PARTITION_FILE), compression='zstd')
+
+    atomic_write_dir(path, write)
+
+
+class MLExportCache:
+    """Tabela de exportação ML mantida incrementalmente por plant_id.
+
+    Apenas as linhas da planta alterada são recalculadas; o DataFrame é
+    materializado sob demanda e reaproveitado enquanto nada mudar.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._frame = None
+        self._loader = None
+
+    def __len__(self):
+        self._load_pending()
+        return len(self._rows)
+
+    def defer_rebuild(self, loader):
+        """Adia a montagem inicial até a primeira exportação.
+
+        loader() devolve (assessments, coordinates) lidos do armazenamento;
+        alterações feitas antes disso já estarão nele e são ignoradas aqui.
+        """
+        self._loader = loader
+        self._rows = {}
+        self._frame = None
+
+    def _load_pending(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            self.rebuild(*loader())
+
+    def rebuild(self, assessments, coordinates):
+        """Recalcula a tabela inteira (usado apenas ao iniciar a sessão)"""
+        self._rows = {
+            plant_id: build_plant_records(plant_id, assessment, coordinates.get(plant_id, []))
+            for plant_id, assessment in assessments.items()
+        }
+        self._frame = None
+
+    def update_plant(self, plant_id, assessment, tech_coords):
+        """Substitui as linhas de uma planta"""
+        if self._loader is not None:
+            return
+        self._rows[plant_id] = build_plant_records(plant_id, assessment, tech_coords)
+        self._frame = None
+
+    def remove_plant(self, plant_id):
+        if self._loader is not None:
+            return
+        if self._rows.pop(plant_id, None) is not None:
+            self._frame = None
+
+    def to_frame(self):
+        """DataFrame com todas as linhas, reconstruído só quando houve alteração"""
+        self._load_pending()
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                [record for records in self._rows.values() for record in records],
+                columns=list(ML_EXPORT_COLUMNS)
+            )
+        return self._frame
+
+    def to_csv(self, path):
+        atomic_write_csv(path, self.to_frame(), index=False)
+
+    def to_parquet(self, path):
+        atomic_write_bytes(path, parquet_bytes(self.to_frame()))
+
+    def to_geoparquet(self, path, partition_by='municipio'):
+        write_geoparquet(self.to_frame(), path, partition_by)
@@ -0,0 +1,60 @@
+"""Funções geográficas compartilhadas pelas interfaces de biogás"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calcula distância entre dois pontos em metros"""
+    R = EARTH_RADIUS_M  # Raio da Terra em metros
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_phi/2) * math.sin(delta_phi/2) +
+         math.cos(phi1) * math.cos(phi2) *
+         math.sin(delta_lambda/2) * math.sin(delta_lambda/2))
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return R * c
+
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """Versão vetorizada de `calculate_distance` (arrays com broadcasting, em metros)"""
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+
+    a = np.sin(delta_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def pairwise_distances(lats_a, lons_a, lats_b, lons_b):
+    """Matriz (len(a), len(b)) de distâncias em metros"""
+    lats_a = np.asarray(lats_a, dtype=np.float64)[:, None]
+    lons_a = np.asarray(lons_a, dtype=np.float64)[:, None]
+    return haversine_distances(lats_a, lons_a, lats_b, lons_b)
+
+
+def nearest_neighbors(query_lats, query_lons, lats, lons, chunk_size=2048):
+    """Para cada ponto de consulta, índice e distância do ponto mais próximo.
+
+    Processa as consultas em blocos para limitar a matriz intermediária a
+    `chunk_size * len(lats)` elementos.
+    """
+    query_lats = np.asarray(query_lats, dtype=np.float64)
+    query_lons = np.asarray(query_lons, dtype=np.float64)
+    indices = np.empty(len(query_lats), dtype=np.int64)
+    distances = np.empty(len(query_lats), dtype=np.float64)
+
+    for start in range(0, len(query_lats), chunk_size):
+        stop = start + chunk_size
+        matrix = pairwise_distances(query_lats[start:stop], query_lons[start:stop], lats, lons)
+        indices[start:stop] = matrix.argmin(axis=1)
+        distances[start:stop] = matrix[np.arange(len(matrix)), indices[start:stop]]
+
+    return indices, distances
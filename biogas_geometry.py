@@ -0,0 +1,237 @@
+"""Decodificação em lote da coluna .geo (GeoJSON) das exportações do GEE"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from biogas_geo import EARTH_RADIUS_M
+
+GEOM_NONE = 0
+GEOM_POINT = 1
+GEOM_POLYGON = 2
+GEOM_MULTIPOLYGON = 3
+
+_GEOM_CODES = {'Point': GEOM_POINT, 'Polygon': GEOM_POLYGON, 'MultiPolygon': GEOM_MULTIPOLYGON}
+
+_POINT_PATTERN = (
+    r'^\s*\{\s*"type"\s*:\s*"Point"\s*,\s*"coordinates"\s*:\s*'
+    r'\[\s*(-?[\d.eE+-]+)\s*,\s*(-?[\d.eE+-]+)\s*\]\s*\}\s*$'
+)
+
+
+class GeometryBatch:
+    """Geometrias de uma coluna inteira em arrays planos.
+
+    Cada linha tem um tipo (`geom_type`), um ponto representativo
+    (`lon`, `lat`: o próprio ponto ou o centro dos vértices do anel externo)
+    e, para polígonos, anéis em `ring_coords` (lon, lat) delimitados por
+    `ring_offsets`, com `ring_row` indicando a linha e `ring_is_hole` os furos.
+    `invalid` marca as linhas com .geo preenchido que não puderam ser decodificadas.
+    """
+
+    def __init__(self, geom_type, lon, lat, ring_coords, ring_offsets, ring_row, ring_is_hole, invalid=None):
+        self.geom_type = geom_type
+        self.invalid = np.zeros(len(geom_type), dtype=bool) if invalid is None else invalid
+        self.lon = lon
+        self.lat = lat
+        self.ring_coords = ring_coords
+        self.ring_offsets = ring_offsets
+        self.ring_row = ring_row
+        self.ring_is_hole = ring_is_hole
+
+    def __len__(self):
+        return len(self.geom_type)
+
+    def areas_m2(self):
+        """Área de cada linha em m² (0 para pontos e geometrias ausentes)"""
+        return polygon_areas_m2(self)
+
+    def mismatch(self, lats, lons, tolerance_deg=1e-5):
+        """Linhas cujo ponto representativo diverge de Latitude/Longitude.
+
+        Para polígonos a conferência é se a coordenada está dentro da caixa
+        envolvente do anel externo (com a mesma tolerância). Geometrias
+        inválidas também contam como divergentes, para aparecerem na interface.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        result = np.zeros(len(self), dtype=bool)
+
+        points = self.geom_type == GEOM_POINT
+        result[points] = (
+            (np.abs(self.lat[points] - lats[points]) > tolerance_deg)
+            | (np.abs(self.lon[points] - lons[points]) > tolerance_deg)
+        )
+
+        if len(self.ring_row):
+            starts = self.ring_offsets[:-1]
+            outer = ~self.ring_is_hole
+            if len(self.ring_coords):
+                min_lon = np.minimum.reduceat(self.ring_coords[:, 0], starts)[outer]
+                max_lon = np.maximum.reduceat(self.ring_coords[:, 0], starts)[outer]
+                min_lat = np.minimum.reduceat(self.ring_coords[:, 1], starts)[outer]
+                max_lat = np.maximum.reduceat(self.ring_coords[:, 1], starts)[outer]
+                rows = self.ring_row[outer]
+                inside = (
+                    (lons[rows] >= min_lon - tolerance_deg) & (lons[rows] <= max_lon + tolerance_deg)
+                    & (lats[rows] >= min_lat - tolerance_deg) & (lats[rows] <= max_lat + tolerance_deg)
+                )
+                # MultiPolygon: basta estar dentro de uma das partes
+                inside_any = np.zeros(len(self), dtype=bool)
+                np.logical_or.at(inside_any, rows, inside)
+                polygons = np.isin(self.geom_type, (GEOM_POLYGON, GEOM_MULTIPOLYGON))
+                result[polygons] = ~inside_any[polygons]
+        return result | self.invalid
+
+
+def parse_geometries(geo):
+    """Decodifica a coluna .geo inteira de uma vez.
+
+    Pontos (o caso comum) são extraídos por expressão regular vetorizada; as
+    demais geometrias são decodificadas em uma única chamada a json.loads
+    sobre um array JSON com todas elas.
+    """
+    geo = pd.Series(geo, dtype='string').reset_index(drop=True)
+    n = len(geo)
+    geom_type = np.full(n, GEOM_NONE, dtype=np.int8)
+    lon = np.full(n, np.nan)
+    lat = np.full(n, np.nan)
+
+    present = (geo.str.strip().str.len() > 0).fillna(False).to_numpy(dtype=bool)
+
+    # O padrão aceita textos como "1-2"; a conversão por coluna transforma
+    # esses casos em NaN e a linha segue para a decodificação JSON
+    points = geo.str.extract(_POINT_PATTERN)
+    point_lon = pd.to_numeric(points[0], errors='coerce').to_numpy(dtype=np.float64)
+    point_lat = pd.to_numeric(points[1], errors='coerce').to_numpy(dtype=np.float64)
+    is_point = ~np.isnan(point_lon) & ~np.isnan(point_lat)
+    geom_type[is_point] = GEOM_POINT
+    lon[is_point] = point_lon[is_point]
+    lat[is_point] = point_lat[is_point]
+
+    others = np.flatnonzero(~is_point & present)
+    ring_arrays, ring_row, ring_is_hole = [], [], []
+    if len(others):
+        try:
+            parsed = json.loads('[' + ','.join(geo.iloc[others].tolist()) + ']')
+        except ValueError:
+            parsed = [_loads_or_none(text) for text in geo.iloc[others]]
+
+        for row, geometry in zip(others, parsed):
+            # Geometria malformada (não objeto, coordenadas inválidas, anel vazio):
+            # só esta linha fica como GEOM_NONE
+            if not isinstance(geometry, dict):
+                continue
+            code = _GEOM_CODES.get(geometry.get('type'), GEOM_NONE)
+            coordinates = geometry.get('coordinates')
+            if code == GEOM_POINT:
+                try:
+                    lon[row], lat[row] = float(coordinates[0]), float(coordinates[1])
+                except (TypeError, ValueError, IndexError, KeyError):
+                    continue
+                geom_type[row] = code
+                continue
+            if code == GEOM_NONE or not coordinates:
+                continue
+            rings = _polygon_rings(code, coordinates)
+            if rings is None:
+                continue
+            geom_type[row] = code
+            for ring, is_hole in rings:
+                ring_arrays.append(ring)
+                ring_row.append(row)
+                ring_is_hole.append(is_hole)
+
+    if ring_arrays:
+        ring_coords = np.concatenate(ring_arrays)
+        ring_offsets = np.concatenate([[0], np.cumsum([len(r) for r in ring_arrays])])
+    else:
+        ring_coords = np.empty((0, 2))
+        ring_offsets = np.zeros(1, dtype=np.int64)
+    ring_row = np.asarray(ring_row, dtype=np.int64)
+    ring_is_hole = np.asarray(ring_is_hole, dtype=bool)
+
+    # Ponto representativo dos polígonos: média dos vértices dos anéis externos
+    if len(ring_row):
+        counts = np.diff(ring_offsets)
+        starts = ring_offsets[:-1]
+        outer = ~ring_is_hole
+        sum_lon = np.add.reduceat(ring_coords[:, 0], starts)[outer]
+        sum_lat = np.add.reduceat(ring_coords[:, 1], starts)[outer]
+        rows = ring_row[outer]
+        totals = np.bincount(rows, weights=counts[outer], minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            poly_lon = np.bincount(rows, weights=sum_lon, minlength=n) / totals
+            poly_lat = np.bincount(rows, weights=sum_lat, minlength=n) / totals
+        polygons = np.isin(geom_type, (GEOM_POLYGON, GEOM_MULTIPOLYGON))
+        lon[polygons] = poly_lon[polygons]
+        lat[polygons] = poly_lat[polygons]
+
+    invalid = present & (geom_type == GEOM_NONE)
+    return GeometryBatch(geom_type, lon, lat, ring_coords, ring_offsets, ring_row, ring_is_hole, invalid)
+
+
+def _polygon_rings(code, coordinates):
+    """[(anel (k, 2) lon/lat, é furo), ...] de um Polygon/MultiPolygon; None se malformado"""
+    polygons = [coordinates] if code == GEOM_POLYGON else coordinates
+    rings = []
+    try:
+        for polygon in polygons:
+            for ring_index, ring in enumerate(polygon):
+                ring = np.asarray(ring, dtype=np.float64)
+                if ring.ndim != 2 or ring.shape[0] == 0 or ring.shape[1] < 2:
+                    return None
+                rings.append((ring[:, :2], ring_index > 0))
+    except (TypeError, ValueError):
+        return None
+    return rings
+
+
+def _loads_or_none(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def polygon_areas_m2(batch):
+    """Área (m²) por linha pela fórmula do laço numa projeção equiretangular local"""
+    areas = np.zeros(len(batch))
+    if not len(batch.ring_row):
+        return areas
+
+    coords = batch.ring_coords
+    starts = batch.ring_offsets[:-1]
+    counts = np.diff(batch.ring_offsets)
+
+    # Coordenadas relativas ao primeiro vértice de cada anel (evita perda de
+    # precisão no produto vetorial) e escala da longitude pela latitude média
+    ref_lat = np.radians(np.add.reduceat(coords[:, 1], starts) / counts)
+    origin = np.repeat(coords[starts], counts, axis=0)
+    x = np.radians(coords[:, 0] - origin[:, 0]) * np.repeat(np.cos(ref_lat), counts) * EARTH_RADIUS_M
+    y = np.radians(coords[:, 1] - origin[:, 1]) * EARTH_RADIUS_M
+
+    # Próximo vértice dentro do mesmo anel (o último volta ao primeiro)
+    following = np.arange(len(coords)) + 1
+    following[batch.ring_offsets[1:] - 1] = starts
+    cross = x * y[following] - x[following] * y
+    ring_areas = np.abs(np.add.reduceat(cross, starts)) / 2
+
+    signed = np.where(batch.ring_is_hole, -ring_areas, ring_areas)
+    areas += np.bincount(batch.ring_row, weights=signed, minlength=len(batch))
+    return np.maximum(areas, 0.0)
+
+
+def annotate_geometry(df, tolerance_deg=1e-5):
+    """Adiciona geo_type, geo_area_m2 e geo_mismatch a partir da coluna .geo"""
+    if '.geo' not in df:
+        return df
+    batch = parse_geometries(df['.geo'])
+    df = df.copy()
+    df['geo_type'] = pd.Categorical.from_codes(
+        batch.geom_type, ['none', 'Point', 'Polygon', 'MultiPolygon']
+    )
+    df['geo_area_m2'] = batch.areas_m2()
+    df['geo_mismatch'] = batch.mismatch(df['Latitude'], df['Longitude'], tolerance_deg)
+    return df
+
@@ -0,0 +1,281 @@
+"""Journal append-only para persistência das avaliações de biogás"""
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from biogas_storage import atomic_write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+JOURNAL_DIR = 'biogas_data'
+JOURNAL_FILE = 'journal.jsonl'
+SNAPSHOT_FILE = 'snapshot.json'
+
+
+def empty_state():
+    """Estado vazio no mesmo formato do antigo backup JSON"""
+    return {'assessments': {}, 'coordinates': {}, 'validations': {}}
+
+
+def coordinate_id(coord):
+    """Id estável da tecnologia: o gravado na inclusão ou, em registros antigos, um hash do conteúdo"""
+    if coord.get('id'):
+        return coord['id']
+    key = json.dumps([coord.get('lat'), coord.get('lon'), coord.get('type'), coord.get('timestamp')])
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def remove_coordinate(coords, data):
+    """Tecnologias sem a removida: pelo id ou, em eventos antigos, pela posição.
+
+    Remover pelo id não depende da ordem da lista de quem removeu, então
+    inclusões e remoções concorrentes de outros avaliadores não deslocam o
+    alvo; um id que já não existe não remove nada.
+    """
+    coords = list(coords)
+    if 'id' in data:
+        for i, coord in enumerate(coords):
+            if coordinate_id(coord) == data['id']:
+                coords.pop(i)
+                break
+    elif 0 <= data['index'] < len(coords):
+        coords.pop(data['index'])
+    return coords
+
+
+def apply_record(state, record):
+    """Aplica um evento do journal sobre o estado"""
+    kind = record['kind']
+    plant_id = record['plant_id']
+    data = record['data']
+
+    if kind == 'assessment':
+        state['assessments'][plant_id] = data
+    elif kind == 'coordinate_add':
+        state['coordinates'].setdefault(plant_id, []).append(data)
+    elif kind == 'coordinate_remove':
+        if plant_id in state['coordinates']:
+            state['coordinates'][plant_id] = remove_coordinate(state['coordinates'][plant_id], data)
+    elif kind == 'coordinates_set':
+        state['coordinates'][plant_id] = list(data)
+    elif kind == 'validation':
+        if plant_id in state['assessments']:
+            state['assessments'][plant_id].update(data)
+        state['validations'][plant_id] = data
+
+
+def rename_plants(state, mapping):
+    """Estado com os ids de planta trocados segundo mapping (inclusive duplicate_of)"""
+    renamed = empty_state()
+    for section, entries in state.items():
+        for plant_id, data in entries.items():
+            if isinstance(data, dict) and data.get('duplicate_of') in mapping:
+                data = dict(data, duplicate_of=mapping[data['duplicate_of']])
+            renamed[section][mapping.get(plant_id, plant_id)] = data
+    return renamed
+
+
+class AssessmentJournal:
+    """Journal append-only (um registro por evento) com compactação em snapshot.
+
+    Cada `append` grava uma única linha JSON e faz fsync, então salvar custa O(1)
+    e um crash perde no máximo o último registro. A cada `compact_every` registros
+    o estado é consolidado em `snapshot.json` e o journal é truncado.
+
+    Vários processos (um servidor por avaliador) podem compartilhar o
+    diretório: escrita, leitura e compactação seguram um flock no journal.
+    """
+
+    def __init__(self, directory=JOURNAL_DIR, compact_every=500):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._snapshot_id = None
+        # Bytes do journal já lidos por _sync_seq (registros de qualquer processo)
+        self._journal_offset = 0
+        self._seq = 0
+        self._pending = 0
+
+        with self._file_lock():
+            self._sync_seq()
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _sync_seq(self):
+        """Avança a sequência até o último seq gravado por qualquer processo.
+
+        Chamado com o flock seguro. Um snapshot novo (compactação feita por
+        outro processo) traz seu last_seq e recomeça a leitura do journal
+        truncado; depois só as linhas acrescentadas desde a última leitura
+        são lidas, então o custo acompanha o que os outros gravaram.
+        """
+        try:
+            stat = os.stat(self.snapshot_path)
+            snapshot_id = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            snapshot_id = None
+        if snapshot_id != self._snapshot_id:
+            self._snapshot_id = snapshot_id
+            self._journal_offset = 0
+            self._pending = 0
+            if snapshot_id is not None:
+                self._seq = max(self._seq, self._read_snapshot().get('last_seq', 0))
+
+        size = os.fstat(self._fd).st_size
+        if size < self._journal_offset:
+            self._journal_offset = 0
+            self._pending = 0
+        if size == self._journal_offset:
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._seq = max(self._seq, record['seq'])
+                self._journal_offset += len(line)
+                self._pending += 1
+        if self._journal_offset < size:
+            # Remove registro parcialmente escrito por um processo que caiu
+            os.ftruncate(self._fd, self._journal_offset)
+            os.fsync(self._fd)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {'last_seq': 0, 'state': empty_state()}
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _read_journal(self):
+        """Lê os registros válidos do journal, descartando uma cauda incompleta"""
+        if not os.path.exists(self.journal_path):
+            return []
+
+        records = []
+        valid_size = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                valid_size += len(line)
+
+        # Remove registro parcialmente escrito antes de um crash
+        if valid_size < os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valid_size)
+                f.flush()
+                os.fsync(f.fileno())
+
+        return records
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def snapshot_seq(self):
+        """Último seq consolidado no snapshot (eventos anteriores não estão mais no journal)"""
+        with self._lock, self._file_lock():
+            return self._read_snapshot().get('last_seq', 0)
+
+    def records_after(self, seq):
+        """Eventos do journal com seq maior que o dado, em ordem de gravação"""
+        with self._lock, self._file_lock():
+            records = [record for record in self._read_journal() if record['seq'] > seq]
+        for record in records:
+            self._seq = max(self._seq, record['seq'])
+        return records
+
+    def append(self, kind, plant_id, data):
+        """Grava um evento no journal (O(1)) e compacta periodicamente; retorna seu seq"""
+        return self.append_many([(kind, plant_id, data)])[0]['seq']
+
+    def append_many(self, events):
+        """Grava vários eventos (kind, plant_id, data) com uma escrita e um fsync.
+
+        Retorna os registros gravados, com seus seq, na ordem recebida.
+        """
+        with self._lock, self._file_lock():
+            self._sync_seq()
+            ts = datetime.now().isoformat()
+            records = []
+            for kind, plant_id, data in events:
+                self._seq += 1
+                records.append({'seq': self._seq, 'kind': kind, 'plant_id': plant_id, 'data': data, 'ts': ts})
+            if not records:
+                return records
+            payload = ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records)
+            data = payload.encode('utf-8')
+            os.write(self._fd, data)
+            os.fsync(self._fd)
+            self._journal_offset += len(data)
+            self._pending += len(records)
+
+            if self._pending >= self.compact_every:
+                self._compact()
+            return records
+
+    def load(self):
+        """Reconstrói o estado completo a partir do snapshot + journal"""
+        with self._lock, self._file_lock():
+            return self._load()
+
+    def _load(self):
+        snapshot = self._read_snapshot()
+        state = snapshot.get('state', empty_state())
+        last_seq = snapshot.get('last_seq', 0)
+        self._seq = max(self._seq, last_seq)
+        for record in self._read_journal():
+            # Registros já incorporados ao snapshot (crash durante a compactação)
+            if record['seq'] > last_seq:
+                apply_record(state, record)
+            self._seq = max(self._seq, record['seq'])
+        return state
+
+    def compact(self):
+        """Consolida o journal em um novo snapshot"""
+        with self._lock, self._file_lock():
+            self._compact()
+
+    def rewrite(self, transform):
+        """Consolida o estado aplicando transform(state) (ex.: migração de ids)"""
+        with self._lock, self._file_lock():
+            self._compact(transform)
+
+    def _compact(self, transform=None):
+        state = self._load()
+        if transform is not None:
+            state = transform(state)
+        atomic_write_json(self.snapshot_path, {'last_seq': self._seq, 'state': state},
+                          with_checksum=True, ensure_ascii=False)
+
+        os.ftruncate(self._fd, 0)
+        os.fsync(self._fd)
+        self._journal_offset = 0
+        self._pending = 0
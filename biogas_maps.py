@@ -0,0 +1,44 @@
+"""Cache dos mapas Folium por planta entre reruns do Streamlit"""
+import hashlib
+import json
+import pickle
+from collections import OrderedDict
+
+
+def fingerprint(*values):
+    """Hash estável de valores serializáveis em JSON (ex.: coordenadas mapeadas)"""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class MapTemplateCache:
+    """LRU de mapas já construídos, chaveado por planta + fingerprint do conteúdo.
+
+    O mapa é guardado serializado e cada `get` devolve uma cópia nova: o
+    st_folium altera o objeto ao renderizar, e a cópia mantém os mesmos ids
+    de elementos, então o script enviado ao navegador não muda entre reruns.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, plant_id, content_key, build):
+        key = (plant_id, content_key)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            # Conteúdo da planta mudou: descarta as versões anteriores
+            self.invalidate(plant_id)
+            self._entries[key] = pickle.dumps(build())
+            self.misses += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return pickle.loads(self._entries[key])
+
+    def invalidate(self, plant_id):
+        for key in [k for k in self._entries if k[0] == plant_id]:
+            del self._entries[key]
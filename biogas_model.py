@@ -0,0 +1,220 @@
+"""Pré-classificação das plantas não avaliadas para priorizar a revisão.
+
+Um classificador softmax (regressão logística multinomial em numpy) é
+treinado com os níveis tecnológicos já atribuídos e aplicado em lotes às
+plantas restantes. A incerteza de cada previsão (entropia normalizada)
+ordena a navegação: o avaliador vê primeiro as plantas em que o modelo
+mais hesita, onde cada rótulo manual acrescenta mais informação.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from biogas_spatial import PlantSpatialIndex
+
+MODEL_CLASSES = ('ALTA', 'MEDIA', 'BAIXA', 'SEM_PLANTA')
+MIN_TRAINING_SAMPLES = 10
+HOLDOUT_FRACTION = 0.2
+INFERENCE_BATCH = 4096
+DENSITY_RADIUS_M = 500
+# Suavização da taxa de cada classe por município (pseudo-contagens da média geral)
+MUNICIPIO_SMOOTHING = 5.0
+# Janela (pixels) lida em volta da coordenada base de cada planta
+IMAGE_WINDOW = 16
+# Diferença máxima na fração de plantas cobertas por imagem entre rotuladas e não rotuladas
+IMAGE_COVERAGE_TOLERANCE = 0.1
+
+
+def municipio_rates(municipios, labels, classes=MODEL_CLASSES):
+    """Taxa suavizada de cada classe no município, sem contar o rótulo da própria planta.
+
+    labels: nível por planta (None se não avaliada). Retorna (n, len(classes)).
+    """
+    codes, _ = pd.factorize(pd.Series(municipios).astype(object), use_na_sentinel=False)
+    own = np.zeros((len(codes), len(classes)))
+    for k, level in enumerate(classes):
+        own[:, k] = np.fromiter((label == level for label in labels), dtype=bool, count=len(codes))
+
+    totals = np.zeros((codes.max() + 1 if len(codes) else 0, len(classes)))
+    np.add.at(totals, codes, own)
+    prior = (own.sum(axis=0) + 1) / (own.sum() + len(classes))
+    counts = totals[codes] - own
+    return (counts + MUNICIPIO_SMOOTHING * prior) / (counts.sum(axis=1, keepdims=True) + MUNICIPIO_SMOOTHING)
+
+
+def image_features(df, rasters, size=IMAGE_WINDOW):
+    """Média e desvio por banda numa janela em volta da coordenada base de cada planta.
+
+    A leitura é a mesma para plantas avaliadas ou não: a cobertura depende
+    só da área das imagens, nunca do rótulo (os chips de `extract_chips`
+    existem apenas para tecnologias já mapeadas e por isso não entram aqui).
+    Vale a primeira imagem que cobre a planta; pixels nodata são ignorados.
+    Retorna (n, 2 × bandas + 1), com o indicador de cobertura na última
+    coluna, ou None sem imagens.
+    """
+    rasters = list(rasters)
+    if not rasters:
+        return None
+    bands = min(raster.count for raster in rasters)
+    lats = df['Latitude'].to_numpy(dtype=np.float64)
+    lons = df['Longitude'].to_numpy(dtype=np.float64)
+    features = np.zeros((len(df), 2 * bands + 1))
+    pending = np.ones(len(df), dtype=bool)
+    for raster in rasters:
+        try:
+            rows, cols = raster.index(lons, lats)
+        except ValueError:  # CRS não suportado sem rasterio
+            continue
+        inside = pending & (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+        for i in np.flatnonzero(inside):
+            window = raster.read_window(int(rows[i]) - size // 2, int(cols[i]) - size // 2, size)
+            pixels = window[:bands].reshape(bands, -1).astype(np.float64)
+            valid = np.isfinite(pixels).all(axis=0)
+            if raster.nodata is not None:
+                valid &= (pixels != raster.nodata).all(axis=0)
+            if not valid.any():
+                continue
+            features[i, :bands] = pixels[:, valid].mean(axis=1)
+            features[i, bands:2 * bands] = pixels[:, valid].std(axis=1)
+            features[i, -1] = 1.0
+            pending[i] = False
+    return features
+
+
+def plant_features(df, labels):
+    """Matriz de atributos tabulares (n, d) de todas as plantas.
+
+    Posição, área do polígono, duplicatas, densidade de plantas próximas e
+    taxa de cada nível no município.
+    """
+    lats = df['Latitude'].to_numpy(dtype=np.float64)
+    lons = df['Longitude'].to_numpy(dtype=np.float64)
+    columns = [lats, lons]
+    if 'geo_area_m2' in df:
+        columns.append(np.log1p(df['geo_area_m2'].fillna(0).to_numpy(dtype=np.float64)))
+    if 'is_duplicate' in df:
+        columns.append(df['is_duplicate'].to_numpy(dtype=np.float64))
+    if 'cluster_id' in df:
+        cluster_sizes = df['cluster_id'].map(df['cluster_id'].value_counts()).to_numpy(dtype=np.float64)
+        columns.append(np.log(cluster_sizes))
+
+    pairs_i, pairs_j = PlantSpatialIndex(lats, lons).pairs_within(DENSITY_RADIUS_M)
+    density = np.bincount(pairs_i, minlength=len(df)) + np.bincount(pairs_j, minlength=len(df))
+    columns.append(np.log1p(density))
+
+    return np.column_stack(columns + [municipio_rates(df['Municipio'].to_numpy(), labels)])
+
+
+class SoftmaxClassifier:
+    """Regressão logística multinomial com regularização L2, em numpy.
+
+    Os atributos são padronizados com a média/desvio do treino; o ajuste é
+    por gradiente em lote completo (os conjuntos rotulados são pequenos) e
+    a inferência é feita em lotes de INFERENCE_BATCH linhas.
+    """
+
+    def __init__(self, classes=MODEL_CLASSES, l2=1e-2, learning_rate=0.5, epochs=500):
+        self.classes = tuple(classes)
+        self.l2 = l2
+        self.learning_rate = learning_rate
+        self.epochs = epochs
+        self.mean = None
+        self.scale = None
+        self.weights = None
+
+    def _design(self, features):
+        standardized = (features - self.mean) / self.scale
+        return np.column_stack([standardized, np.ones(len(features))])
+
+    @staticmethod
+    def _softmax(logits):
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def fit(self, features, labels):
+        targets = np.asarray([self.classes.index(label) for label in labels])
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        design = self._design(features)
+        one_hot = np.eye(len(self.classes))[targets]
+        self.weights = np.zeros((design.shape[1], len(self.classes)))
+        for _ in range(self.epochs):
+            probabilities = self._softmax(design @ self.weights)
+            gradient = design.T @ (probabilities - one_hot) / len(design)
+            gradient[:-1] += self.l2 * self.weights[:-1]
+            self.weights -= self.learning_rate * gradient
+        return self
+
+    def predict_proba(self, features, batch_size=INFERENCE_BATCH):
+        probabilities = np.empty((len(features), len(self.classes)))
+        for start in range(0, len(features), batch_size):
+            batch = features[start:start + batch_size]
+            probabilities[start:start + batch_size] = self._softmax(self._design(batch) @ self.weights)
+        return probabilities
+
+
+def uncertainty(probabilities):
+    """Entropia normalizada (0 = certeza, 1 = classes equiprováveis)"""
+    clipped = np.clip(probabilities, 1e-12, 1.0)
+    return -(clipped * np.log(clipped)).sum(axis=1) / np.log(probabilities.shape[1])
+
+
+def preclassify(df, labels, rasters=(), seed=0):
+    """Treina com as plantas rotuladas e prevê as demais.
+
+    labels: {plant_id: tech_level}; rasters: imagens locais abertas (ver
+    `image_features`), usadas só se cobrem rotuladas e não rotuladas em
+    proporção parecida. Retorna (previsões, resumo); previsões é uma lista
+    (plant_id, classe, confiança, incerteza) das plantas sem rótulo, ou
+    None quando não há rótulos suficientes.
+    """
+    plant_ids = df['plant_id'].to_numpy()
+    row_labels = [labels.get(plant_id) for plant_id in plant_ids]
+    labelled = np.flatnonzero([label in MODEL_CLASSES for label in row_labels])
+    summary = {'labelled': len(labelled), 'predicted': 0, 'holdout_accuracy': None, 'image_features': False}
+    if len(labelled) < MIN_TRAINING_SAMPLES or len({row_labels[i] for i in labelled}) < 2:
+        return None, summary
+
+    features = plant_features(df, row_labels)
+    images = image_features(df, rasters) if len(labelled) < len(df) else None
+    if images is not None:
+        covered = images[:, -1].astype(bool)
+        is_labelled = np.zeros(len(df), dtype=bool)
+        is_labelled[labelled] = True
+        if abs(covered[is_labelled].mean() - covered[~is_labelled].mean()) <= IMAGE_COVERAGE_TOLERANCE:
+            features = np.column_stack([features, images])
+            summary['image_features'] = True
+    targets = [row_labels[i] for i in labelled]
+
+    # Acurácia estimada em uma fração separada antes do ajuste final com tudo
+    if len(labelled) >= MIN_TRAINING_SAMPLES / HOLDOUT_FRACTION:
+        shuffled = np.random.default_rng(seed).permutation(len(labelled))
+        n_holdout = int(len(labelled) * HOLDOUT_FRACTION)
+        holdout, train = shuffled[:n_holdout], shuffled[n_holdout:]
+        model = SoftmaxClassifier().fit(features[labelled[train]], [targets[i] for i in train])
+        predicted = np.asarray(model.classes)[model.predict_proba(features[labelled[holdout]]).argmax(axis=1)]
+        summary['holdout_accuracy'] = float(np.mean(predicted == np.asarray(targets)[holdout]))
+
+    model = SoftmaxClassifier().fit(features[labelled], targets)
+    unlabelled = np.setdiff1d(np.arange(len(df)), labelled)
+    probabilities = model.predict_proba(features[unlabelled])
+    best = probabilities.argmax(axis=1)
+    predictions = list(zip(
+        plant_ids[unlabelled].tolist(),
+        np.asarray(model.classes)[best].tolist(),
+        probabilities[np.arange(len(best)), best].tolist(),
+        uncertainty(probabilities).tolist()
+    ))
+    summary['predicted'] = len(predictions)
+    return predictions, summary
+
+
+def run_preclassification(df, db, rasters=()):
+    """Pré-classifica com os rótulos do banco e grava as previsões; retorna o resumo"""
+    predictions, summary = preclassify(df, db.tech_level_labels(), rasters)
+    if predictions is not None:
+        db.replace_predictions(predictions, datetime.now().isoformat())
+    return summary
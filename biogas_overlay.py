@@ -0,0 +1,120 @@
+"""Sobreposição de rasters locais (Sentinel, ortofotos) no mapa de avaliação.
+
+Só a vizinhança da planta é lida: uma grade de pixels de saída em Web
+Mercator é projetada para o CRS do raster e cada pixel é buscado no
+arquivo mapeado em memória, então cenas de vários GB são navegadas sem
+ocupar RAM. O recorte vira um PNG para o ImageOverlay do Folium.
+"""
+import base64
+import glob
+import io
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+from biogas_chips import open_raster
+
+LOCAL_IMAGERY_DIR = 'imagens_locais'
+OVERLAY_RADIUS_M = 600
+OVERLAY_PIXELS = 512
+STRETCH_PERCENTILES = (2, 98)
+_MERCATOR_RADIUS = 6378137.0
+
+
+class LocalRasterCatalog:
+    """Rasters de uma pasta, abertos uma vez (só o cabeçalho é lido).
+
+    Arquivos que o leitor disponível não abre (ex.: comprimidos sem
+    rasterio) ficam em `errors` em vez de interromper a interface.
+    """
+
+    def __init__(self, directory=LOCAL_IMAGERY_DIR):
+        self.rasters = {}
+        self.errors = {}
+        paths = sorted(glob.glob(os.path.join(directory, '*.tif')) + glob.glob(os.path.join(directory, '*.tiff')))
+        for path in paths:
+            try:
+                self.rasters[os.path.basename(path)] = open_raster(path)
+            except (ValueError, KeyError, OSError) as e:
+                self.errors[os.path.basename(path)] = str(e)
+
+    def __len__(self):
+        return len(self.rasters)
+
+    def covering(self, lat, lon):
+        """Nomes dos rasters que contêm o ponto"""
+        names = []
+        for name, raster in self.rasters.items():
+            try:
+                rows, cols = raster.index([lon], [lat])
+            except ValueError:
+                continue
+            if 0 <= rows[0] < raster.height and 0 <= cols[0] < raster.width:
+                names.append(name)
+        return names
+
+
+def overlay_grid(lat, lon, radius_m=OVERLAY_RADIUS_M, pixels=OVERLAY_PIXELS):
+    """Centros (lats, lons) de uma grade pixels × pixels uniforme em Web Mercator e seus limites.
+
+    Uniforme no mesmo sistema do mapa, o PNG se alinha ao ImageOverlay sem
+    distorção. Retorna (lats, lons, [[sul, oeste], [norte, leste]]).
+    """
+    half_lat = radius_m / 111320.0
+    half_lon = radius_m / (111320.0 * math.cos(math.radians(lat)))
+    south, north = lat - half_lat, lat + half_lat
+    west, east = lon - half_lon, lon + half_lon
+
+    def mercator_y(latitude):
+        return _MERCATOR_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2))
+
+    fractions = (np.arange(pixels) + 0.5) / pixels
+    ys = mercator_y(north) + (mercator_y(south) - mercator_y(north)) * fractions
+    lats = np.degrees(2 * np.arctan(np.exp(ys / _MERCATOR_RADIUS)) - np.pi / 2)
+    lons = west + (east - west) * fractions
+    grid_lons, grid_lats = np.meshgrid(lons, lats)
+    return grid_lats.ravel(), grid_lons.ravel(), [[south, west], [north, east]]
+
+
+def stretch_rgba(values, valid, pixels):
+    """Bandas (n_bandas, n) → RGBA uint8 com realce linear por percentis e transparência no nodata"""
+    rgba = np.zeros((pixels * pixels, 4), dtype=np.uint8)
+    bands = values if len(values) >= 3 else np.repeat(values[:1], 3, axis=0)
+    for channel, band in enumerate(bands[:3]):
+        band = band.astype(np.float64)
+        if valid.any():
+            low, high = np.percentile(band[valid], STRETCH_PERCENTILES)
+        else:
+            low, high = 0.0, 1.0
+        scale = 255.0 / (high - low) if high > low else 0.0
+        rgba[:, channel] = np.clip((band - low) * scale, 0, 255).astype(np.uint8)
+    rgba[:, 3] = np.where(valid, 255, 0)
+    return rgba.reshape(pixels, pixels, 4)
+
+
+def render_overlay(raster, lat, lon, radius_m=OVERLAY_RADIUS_M, pixels=OVERLAY_PIXELS, bands=None):
+    """(data URL PNG, bounds) do recorte em volta do ponto, ou None se o raster não cobre a área.
+
+    bands: índices (base 0) das bandas R, G, B; padrão as três primeiras
+    (ou a primeira em tons de cinza).
+    """
+    lats, lons, bounds = overlay_grid(lat, lon, radius_m, pixels)
+    rows, cols = raster.index(lons, lats)
+    inside = (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+    if not inside.any():
+        return None
+
+    if bands is None:
+        bands = (0, 1, 2) if raster.count >= 3 else (0,)
+    values = raster.sample(rows, cols)[list(bands)]
+    valid = inside.copy()
+    if raster.nodata is not None:
+        nodata = np.isnan(values) if np.isnan(raster.nodata) else values == raster.nodata
+        valid &= ~nodata.all(axis=0)
+
+    buffer = io.BytesIO()
+    Image.fromarray(stretch_rgba(values, valid, pixels), 'RGBA').save(buffer, format='PNG')
+    data_url = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return data_url, bounds
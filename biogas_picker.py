@@ -0,0 +1,155 @@
+"""Catálogo de rótulos e busca para o seletor paginado de plantas"""
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+PAGE_SIZE = 50
+
+
+def normalize_text(text):
+    """Minúsculas e sem acentos, para a busca ignorar 'São'/'sao'"""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+class PlantCatalog:
+    """Rótulos, ids e texto de busca pré-computados uma vez por carga do CSV.
+
+    O seletor trabalha só com posições (inteiros): filtrar devolve um array
+    de posições e apenas a página visível vira rótulos. Linhas e ids são
+    pedidos por posição, a mesma interface do `StorePlantCatalog`.
+    """
+
+    def __init__(self, df, plant_ids):
+        self.df = df
+        n = len(df)
+        numbers = pd.Series(np.arange(1, n + 1)).astype(str).str.zfill(2)
+        municipios = df['Municipio'].astype(str).reset_index(drop=True)
+        self.labels = (numbers + '. ' + municipios).to_numpy(dtype=object)
+        self.plant_ids = np.asarray(plant_ids, dtype=object)
+        self.positions = {plant_id: i for i, plant_id in enumerate(self.plant_ids)}
+
+        # Normalização feita uma vez por município distinto, não por linha
+        categories = df['Municipio'].astype('category').reset_index(drop=True)
+        normalized = np.array(
+            [normalize_text(c) for c in categories.cat.categories] + [''], dtype=object
+        )
+        search = numbers + ' ' + pd.Series(normalized[categories.cat.codes.to_numpy()], dtype=object)
+        if 'system:index' in df:
+            search = search + ' ' + df['system:index'].astype(str).reset_index(drop=True)
+        self.search_text = search + ' ' + pd.Series(self.plant_ids, dtype=object).astype(str).str.lower()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def positions_of(self, plant_ids):
+        """Posições das plantas com os ids dados (ids desconhecidos são ignorados)"""
+        return np.fromiter(
+            (self.positions[pid] for pid in plant_ids if pid in self.positions), dtype=np.int64
+        )
+
+    def position(self, plant_id):
+        """Posição da planta (None se o id não está no catálogo)"""
+        return self.positions.get(plant_id)
+
+    def plant_id(self, position):
+        return self.plant_ids[position]
+
+    def iter_plant_ids(self, positions):
+        """ids das posições, na ordem dada"""
+        return (self.plant_ids[i] for i in positions)
+
+    def row(self, position):
+        """Linha completa da planta, com plant_id"""
+        return self.df.iloc[position]
+
+    def labels_of(self, positions):
+        """{posição: rótulo} das posições visíveis"""
+        return {int(i): self.labels[i] for i in positions}
+
+    def frame(self):
+        """Todas as plantas com plant_id (para tarefas em lote, como a pré-classificação)"""
+        return self.df
+
+    def filter(self, query='', mask=None):
+        """Posições que contêm o texto buscado e satisfazem a máscara opcional"""
+        selected = np.ones(len(self), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        query = normalize_text(query).strip()
+        if query:
+            selected = selected & self.search_text.str.contains(query, regex=False).to_numpy()
+        return np.flatnonzero(selected)
+
+    def page(self, positions, page, page_size=PAGE_SIZE):
+        """Fatia visível de um resultado de filtro"""
+        start = page * page_size
+        return positions[start:start + page_size]
+
+    def page_count(self, positions, page_size=PAGE_SIZE):
+        return max(1, -(-len(positions) // page_size))
+
+    def page_of(self, positions, position, page_size=PAGE_SIZE):
+        """Página em que a posição aparece no resultado (0 se não aparece)"""
+        found = np.searchsorted(positions, position)
+        if found < len(positions) and positions[found] == position:
+            return int(found // page_size)
+        return 0
+
+
+class StorePlantCatalog(PlantCatalog):
+    """Catálogo de uma exportação grande ingerida no PlantStore.
+
+    Em memória ficam só as colunas de largura fixa das plantas (coordenadas,
+    município como categoria, duplicatas); ids, rótulos, busca e linhas
+    completas são consultados no SQLite, uma página por vez.
+    """
+
+    ID_BATCH = 1000
+
+    def __init__(self, store, df):
+        self.store = store
+        self.df = df
+
+    def __len__(self):
+        return len(self.df)
+
+    def positions_of(self, plant_ids):
+        found = self.store.positions_of(plant_ids)
+        return np.fromiter(found.values(), dtype=np.int64, count=len(found))
+
+    def position(self, plant_id):
+        return self.store.positions_of([plant_id]).get(plant_id)
+
+    def plant_id(self, position):
+        return self.store.plant_ids([position])[0]
+
+    def iter_plant_ids(self, positions):
+        """ids lidos em lotes de ID_BATCH, só até onde o consumidor avançar"""
+        batch = []
+        for position in positions:
+            batch.append(position)
+            if len(batch) == self.ID_BATCH:
+                yield from self.store.plant_ids(batch)
+                batch = []
+        if batch:
+            yield from self.store.plant_ids(batch)
+
+    def row(self, position):
+        row = self.store.rows([position]).iloc[0]
+        return pd.concat([self.df.iloc[position], row[['system:index', 'plant_id']]])
+
+    def labels_of(self, positions):
+        municipios = self.df['Municipio'].iloc[list(positions)].astype(str)
+        return {int(i): f"{int(i) + 1:02d}. {m}" for i, m in zip(positions, municipios)}
+
+    def filter(self, query='', mask=None):
+        query = normalize_text(query).strip()
+        positions = self.store.search(query) if query else np.arange(len(self))
+        if mask is not None:
+            positions = positions[np.asarray(mask, dtype=bool)[positions]]
+        return positions
+
+    def frame(self):
+        df = self.df.copy()
+        df['plant_id'] = self.store.frame(('plant_id',))['plant_id'].to_numpy(dtype=object)
+        return df
@@ -0,0 +1,91 @@
+"""Fila de validação indexada por status, confiança e idade"""
+from bisect import bisect_left, insort
+
+QUEUE_STATUSES = ('PENDING', 'NEEDS_REVIEW', 'REJECTED')
+QUEUE_ORDERS = ('confidence', 'age')
+
+
+class ValidationQueue:
+    """Avaliações aguardando validação, separadas por status.
+
+    Cada status mantém duas listas ordenadas (menor confiança primeiro e
+    mais antiga primeiro) com chaves (ordem, plant_id); a posição de uma
+    avaliação é localizada por busca binária, então validar só move uma
+    entrada entre listas e o painel lê uma página sem varrer as avaliações.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._buckets = {status: {order: [] for order in QUEUE_ORDERS} for status in QUEUE_STATUSES}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Monta a fila a partir das colunas indexadas do banco (sem o JSON completo).
+
+        rows: (plant_id, validation_status, confidence, timestamp, municipio, tech_level)
+        """
+        return cls._from_entries(cls._entry(*row) for row in rows)
+
+    @classmethod
+    def _from_entries(cls, entries):
+        queue = cls()
+        for plant_id, entry in filter(None, entries):
+            queue._entries[plant_id] = entry
+        # Ordenação única no fim em vez de uma inserção ordenada por entrada
+        for status, bucket in queue._buckets.items():
+            members = [entry for entry in queue._entries.values() if entry[0] == status]
+            for position, order in enumerate(QUEUE_ORDERS, 1):
+                bucket[order] = sorted(entry[position] for entry in members)
+        return queue
+
+    @staticmethod
+    def _entry(plant_id, status, confidence, timestamp, municipio, tech_level):
+        """(plant_id, (status, chave por confiança, chave por idade, município, nível))"""
+        status = status or 'PENDING'
+        if status not in QUEUE_STATUSES:
+            return None
+        confidence = confidence or 0
+        timestamp = timestamp or ''
+        return plant_id, (
+            status,
+            (confidence, timestamp, plant_id),
+            (timestamp, plant_id),
+            municipio,
+            tech_level,
+        )
+
+    def remove(self, plant_id):
+        entry = self._entries.pop(plant_id, None)
+        if entry is None:
+            return
+        for position, order in enumerate(QUEUE_ORDERS, 1):
+            keys = self._buckets[entry[0]][order]
+            del keys[bisect_left(keys, entry[position])]
+
+    def update(self, plant_id, assessment):
+        """Reposiciona a avaliação após salvar ou validar (sai da fila se VALIDATED)"""
+        self.remove(plant_id)
+        entry = self._entry(
+            plant_id, assessment.get('validation_status', 'PENDING'), assessment.get('confidence'),
+            assessment.get('timestamp'), assessment.get('municipio'), assessment.get('tech_level')
+        )
+        if entry is None:
+            return
+        _, entry = entry
+        self._entries[plant_id] = entry
+        for position, order in enumerate(QUEUE_ORDERS, 1):
+            insort(self._buckets[entry[0]][order], entry[position])
+
+    def count(self, status):
+        return len(self._buckets[status]['age'])
+
+    def page(self, status, order='confidence', offset=0, limit=50):
+        """plant_ids de uma página do status, na ordem pedida"""
+        return [key[-1] for key in self._buckets[status][order][offset:offset + limit]]
+
+    def label(self, plant_id):
+        _, (confidence, _, _), _, municipio, tech_level = self._entries[plant_id]
+        return f"{municipio} - {tech_level} ({confidence:.0f}%)"
+
+    def __contains__(self, plant_id):
+        return plant_id in self._entries
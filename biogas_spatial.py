@@ -0,0 +1,169 @@
+"""Índice espacial em grade para consultas de vizinhança entre plantas"""
+import math
+
+import numpy as np
+
+from biogas_geo import EARTH_RADIUS_M, haversine_distances
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+class PlantSpatialIndex:
+    """Grade regular em graus sobre Latitude/Longitude.
+
+    Os pontos são ordenados pela chave da célula e cada célula guarda o
+    intervalo correspondente, então uma consulta visita apenas as células
+    que cobrem o raio pedido e filtra os candidatos com haversine exato.
+    """
+
+    def __init__(self, lats, lons, cell_size_m=500):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.cell_size_m = cell_size_m
+
+        # Células com altura fixa em latitude; a largura em longitude usa a
+        # latitude mais alta do conjunto para nunca ficar menor que cell_size_m
+        max_abs_lat = float(np.max(np.abs(self.lats))) if len(self.lats) else 0.0
+        self.cell_deg_lat = cell_size_m / METERS_PER_DEGREE
+        self.cell_deg_lon = cell_size_m / (METERS_PER_DEGREE * max(math.cos(math.radians(max_abs_lat)), 1e-6))
+
+        rows = np.floor(self.lats / self.cell_deg_lat).astype(np.int64)
+        cols = np.floor(self.lons / self.cell_deg_lon).astype(np.int64)
+        keys = self._key(rows, cols)
+
+        self.rows = rows
+        self.cols = cols
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        unique_keys, starts, counts = np.unique(self.sorted_keys, return_index=True, return_counts=True)
+        self.cells = {
+            int(key): (int(start), int(start + count))
+            for key, start, count in zip(unique_keys, starts, counts)
+        }
+
+    def __len__(self):
+        return len(self.lats)
+
+    @staticmethod
+    def _key(rows, cols):
+        return rows * 4_000_003 + cols
+
+    def _candidates(self, lat, lon, radius_m):
+        """Índices dos pontos nas células que cobrem o raio"""
+        span_lat = radius_m / METERS_PER_DEGREE
+        span_lon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+
+        row_min = math.floor((lat - span_lat) / self.cell_deg_lat)
+        row_max = math.floor((lat + span_lat) / self.cell_deg_lat)
+        col_min = math.floor((lon - span_lon) / self.cell_deg_lon)
+        col_max = math.floor((lon + span_lon) / self.cell_deg_lon)
+
+        chunks = []
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                cell = self.cells.get(self._key(row, col))
+                if cell is not None:
+                    chunks.append(self.order[cell[0]:cell[1]])
+
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def query_radius(self, lat, lon, radius_m):
+        """Índices e distâncias (m) dos pontos dentro do raio, do mais próximo ao mais distante"""
+        candidates = self._candidates(lat, lon, radius_m)
+        distances = haversine_distances(lat, lon, self.lats[candidates], self.lons[candidates])
+        mask = distances <= radius_m
+        candidates, distances = candidates[mask], distances[mask]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, k=1, exclude=None):
+        """Os k pontos mais próximos, expandindo o raio de busca a partir de uma célula"""
+        radius = self.cell_size_m
+        wanted = k + (1 if exclude is not None else 0)
+        while True:
+            indices, distances = self.query_radius(lat, lon, radius)
+            if len(indices) >= min(wanted, len(self)) or radius > 2 * math.pi * EARTH_RADIUS_M:
+                break
+            radius *= 2
+
+        if exclude is not None:
+            keep = indices != exclude
+            indices, distances = indices[keep], distances[keep]
+        return indices[:k], distances[:k]
+
+    def neighbors(self, i, radius_m):
+        """Vizinhos do ponto i dentro do raio (excluindo o próprio ponto)"""
+        indices, distances = self.query_radius(self.lats[i], self.lons[i], radius_m)
+        keep = indices != i
+        return indices[keep], distances[keep]
+
+    def pairs_within(self, radius_m):
+        """Todos os pares (i, j), i < j, a no máximo radius_m, sem comparação O(N²).
+
+        Requer radius_m <= cell_size_m: basta comparar cada ponto com sua
+        célula e as vizinhas, localizadas por busca binária nas chaves ordenadas.
+        """
+        if radius_m > self.cell_size_m:
+            raise ValueError("radius_m deve ser menor ou igual a cell_size_m")
+
+        pairs_i, pairs_j = [], []
+        for d_row, d_col in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            target = self._key(self.rows + d_row, self.cols + d_col)
+            starts = np.searchsorted(self.sorted_keys, target, side='left')
+            ends = np.searchsorted(self.sorted_keys, target, side='right')
+            counts = ends - starts
+            if not counts.any():
+                continue
+
+            # Expande os intervalos [start, end) em pares explícitos
+            i = np.repeat(np.arange(len(self.lats)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            j = self.order[np.repeat(starts, counts) + offsets]
+            if (d_row, d_col) == (0, 0):
+                keep = i < j
+                i, j = i[keep], j[keep]
+            pairs_i.append(i)
+            pairs_j.append(j)
+
+        if not pairs_i:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        i = np.concatenate(pairs_i)
+        j = np.concatenate(pairs_j)
+        mask = haversine_distances(self.lats[i], self.lons[i], self.lats[j], self.lons[j]) <= radius_m
+        i, j = i[mask], j[mask]
+        return np.minimum(i, j), np.maximum(i, j)
+
+
+def cluster_labels(n, pairs_i, pairs_j):
+    """Componentes conexos dos pares; o rótulo é o menor índice do grupo"""
+    labels = np.arange(n)
+    while len(pairs_i):
+        merged = np.minimum(labels[pairs_i], labels[pairs_j])
+        updated = labels.copy()
+        np.minimum.at(updated, pairs_i, merged)
+        np.minimum.at(updated, pairs_j, merged)
+        # Compressão de caminho: aponta cada ponto para o rótulo do seu rótulo
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
+
+
+def annotate_duplicates(df, radius_m):
+    """Agrupa plantas a menos de radius_m e anota cluster_id, cluster_size e is_duplicate.
+
+    O representante de cada grupo é a primeira linha do arquivo; as demais
+    são marcadas como duplicatas.
+    """
+    index = PlantSpatialIndex(df['Latitude'].to_numpy(), df['Longitude'].to_numpy(), cell_size_m=radius_m)
+    labels = cluster_labels(len(df), *index.pairs_within(radius_m))
+
+    df = df.copy()
+    df['cluster_id'] = labels
+    df['cluster_size'] = np.bincount(labels, minlength=len(df))[labels]
+    df['is_duplicate'] = labels != np.arange(len(df))
+    return df
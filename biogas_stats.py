@@ -0,0 +1,51 @@
+"""Contadores agregados de progresso mantidos incrementalmente"""
+from collections import Counter
+
+
+class AssessmentCounters:
+    """Totais de avaliações, níveis, status, confiança e coordenadas.
+
+    Montado uma vez a partir do estado salvo; depois cada gravação aplica só
+    a diferença (remove a versão anterior da avaliação e soma a nova), então
+    a barra lateral e o resumo final leem os números em O(1).
+    """
+
+    def __init__(self):
+        self.assessed = 0
+        self.confidence_sum = 0.0
+        self.tech_levels = Counter()
+        self.statuses = Counter()
+        self.coordinates = 0
+
+    @classmethod
+    def from_database(cls, db):
+        """Totais pelas consultas agregadas do banco, sem carregar as avaliações"""
+        counters = cls()
+        counters.assessed, avg_confidence = db.assessment_summary()
+        counters.confidence_sum = avg_confidence * counters.assessed
+        counters.tech_levels.update(db.tech_level_counts())
+        counters.statuses.update(db.status_counts())
+        counters.coordinates = db.coordinate_count()
+        return counters
+
+    def _apply(self, assessment, sign):
+        self.assessed += sign
+        self.confidence_sum += sign * (assessment.get('confidence') or 0)
+        self.tech_levels[assessment.get('tech_level')] += sign
+        self.statuses[assessment.get('validation_status', 'PENDING')] += sign
+
+    def replace_assessment(self, previous, current):
+        """Troca a contribuição de `previous` (None se nova) pela de `current`"""
+        if previous is not None:
+            self._apply(previous, -1)
+        self._apply(current, 1)
+
+    def add_coordinates(self, count=1):
+        self.coordinates += count
+
+    def status_count(self, status):
+        return self.statuses.get(status, 0)
+
+    @property
+    def avg_confidence(self):
+        return self.confidence_sum / self.assessed if self.assessed else 0
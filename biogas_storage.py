@@ -0,0 +1,234 @@
+"""Gravação atômica de arquivos (temporário + fsync + rename) com checksum e recuperação"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+CHECKSUM_SUFFIX = '.sha256'
+TMP_SUFFIX = '.tmp'
+# Lock entre processos das gravações de um diretório
+LOCK_FILE = '.atomic_write.lock'
+# Temporários criados por este módulo: <arquivo>.<id de 8 hex>[.old].tmp
+TMP_PATTERN = re.compile(r'^(?P<target>.+)\.[0-9a-f]{8}(?P<old>\.old)?' + re.escape(TMP_SUFFIX) + '$')
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _path_lock(path):
+    """Um lock por arquivo: duas sessões do servidor não intercalam a troca"""
+    with _locks_guard:
+        return _locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@contextmanager
+def _write_lock(path):
+    """Exclusão na troca de path entre threads e entre processos (flock no diretório).
+
+    Dois servidores, ou a linha de comando e a interface, gravando o mesmo
+    arquivo não intercalam os dados de um com o checksum do outro.
+    """
+    with _path_lock(path):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(os.path.dirname(path) or '.', LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_checksum(path):
+    with open(path, 'rb') as f:
+        return checksum(f.read())
+
+
+def _fsync_dir(directory):
+    """Persiste o rename no diretório (sem efeito onde não é suportado)"""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_synced(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write_bytes(path, data, with_checksum=False):
+    """Grava data em path sem nunca deixar o arquivo truncado.
+
+    O conteúdo vai para um temporário no mesmo diretório (fsync) e substitui
+    o arquivo com os.replace, sob o lock do diretório. Com with_checksum
+    (arquivos de estado que `verify`/`recover` conferem), o checksum também
+    vai para um temporário e substitui `<path>.sha256` logo depois do
+    conteúdo; um crash deixa a versão anterior intacta ou um checksum
+    temporário que `recover` conclui na próxima inicialização. Sem ele
+    (exportações), nenhum .sha256 acompanha o arquivo e um antigo é removido.
+    """
+    directory = os.path.dirname(path)
+    write_id = uuid.uuid4().hex[:8]
+    tmp_path = f"{path}.{write_id}{TMP_SUFFIX}"
+    checksum_tmp = f"{path}{CHECKSUM_SUFFIX}.{write_id}{TMP_SUFFIX}"
+    with _write_lock(path):
+        _write_synced(tmp_path, data)
+        if with_checksum:
+            _write_synced(checksum_tmp, checksum(data).encode('ascii'))
+        os.replace(tmp_path, path)
+        if with_checksum:
+            os.replace(checksum_tmp, path + CHECKSUM_SUFFIX)
+        else:
+            try:
+                os.remove(path + CHECKSUM_SUFFIX)
+            except FileNotFoundError:
+                pass
+        _fsync_dir(directory)
+
+
+def atomic_write_text(path, text, encoding='utf-8', with_checksum=False):
+    atomic_write_bytes(path, text.encode(encoding), with_checksum)
+
+
+def atomic_write_json(path, obj, with_checksum=False, **kwargs):
+    kwargs.setdefault('default', str)
+    atomic_write_text(path, json.dumps(obj, **kwargs), with_checksum=with_checksum)
+
+
+def atomic_write_csv(path, df, with_checksum=False, **kwargs):
+    """DataFrame em CSV (utf-8) pela mesma troca atômica"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, **kwargs)
+    atomic_write_text(path, buffer.getvalue(), with_checksum=with_checksum)
+
+
+def atomic_write_dir(path, write):
+    """Gera um diretório inteiro (ex.: dataset particionado) e o troca pelo anterior.
+
+    write(tmp_dir) grava os arquivos num diretório temporário ao lado; o
+    antigo sai do caminho e o novo entra por rename, então leitores nunca
+    veem um dataset pela metade. Restos de uma troca interrompida terminam
+    em .tmp e são removidos por `recover`.
+    """
+    directory = os.path.dirname(path)
+    write_id = uuid.uuid4().hex[:8]
+    tmp_path = f"{path}.{write_id}{TMP_SUFFIX}"
+    old_path = f"{path}.{write_id}.old{TMP_SUFFIX}"
+    with _write_lock(path):
+        os.makedirs(tmp_path)
+        try:
+            write(tmp_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        _fsync_dir(directory)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def expected_checksum(path):
+    try:
+        with open(path + CHECKSUM_SUFFIX, 'r', encoding='ascii') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def verify(path):
+    """True/False conforme o checksum; None se o arquivo não tem checksum.
+
+    Lê o par sob o lock de gravação, sem pegar uma troca pela metade.
+    """
+    with _write_lock(path):
+        expected = expected_checksum(path)
+        if expected is None or not os.path.exists(path):
+            return None
+        return file_checksum(path) == expected
+
+
+def recover(directory='.', min_age_s=60):
+    """Conclui ou descarta gravações interrompidas e confere os checksums.
+
+    Um checksum temporário que confere com o arquivo atual é uma troca
+    interrompida entre os dois renames: é promovido. Os demais temporários
+    são restos de gravações incompletas (o arquivo anterior segue íntegro)
+    e são removidos.
+    Temporários com menos de min_age_s podem ser de outro processo ainda
+    gravando e ficam intocados.
+    Retorna {'completed': [...], 'discarded': [...], 'corrupted': [...]}.
+    """
+    report = {'completed': [], 'discarded': [], 'corrupted': []}
+    if not os.path.isdir(directory):
+        return report
+
+    names = sorted(os.listdir(directory))
+    for name in names:
+        # Só os temporários deste módulo; outros *.tmp da pasta não são tocados
+        match = TMP_PATTERN.match(name)
+        if match is None:
+            continue
+        tmp_path = os.path.join(directory, name)
+        if time.time() - os.path.getmtime(tmp_path) < min_age_s:
+            continue
+        target = os.path.join(directory, match.group('target'))
+        if os.path.isdir(tmp_path):
+            # Diretório antigo de uma troca interrompida entre os dois renames: volta ao lugar
+            if match.group('old') and not os.path.exists(target):
+                os.rename(tmp_path, target)
+                report['completed'].append(target)
+            else:
+                shutil.rmtree(tmp_path)
+                report['discarded'].append(tmp_path)
+            continue
+        if match.group('old'):
+            continue
+        # <arquivo>.<id>.tmp ou <arquivo>.sha256.<id>.tmp
+        if target.endswith(CHECKSUM_SUFFIX):
+            data_path = target[:-len(CHECKSUM_SUFFIX)]
+            with open(tmp_path, 'r', encoding='ascii') as f:
+                pending = f.read().strip()
+            if (os.path.exists(data_path) and verify(data_path) is not True
+                    and file_checksum(data_path) == pending):
+                os.replace(tmp_path, target)
+                report['completed'].append(data_path)
+            else:
+                os.remove(tmp_path)
+            continue
+        os.remove(tmp_path)
+        report['discarded'].append(tmp_path)
+    if report['completed']:
+        _fsync_dir(directory)
+
+    for name in names:
+        if name.endswith(CHECKSUM_SUFFIX):
+            target = os.path.join(directory, name[:-len(CHECKSUM_SUFFIX)])
+            if verify(target) is False:
+                report['corrupted'].append(target)
+    return report
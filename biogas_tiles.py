@@ -0,0 +1,356 @@
+"""Cache local de tiles de satélite com proxy HTTP para os mapas Folium
+
+Os mapas passam a buscar tiles em http://127.0.0.1:<porta>/<camada>/{z}/{x}/{y};
+o proxy responde do cache em disco (z/x/y) e só consulta o servidor remoto
+quando o tile ainda não foi baixado. O cache é limitado por tamanho com
+remoção LRU. Como o navegador acessa o proxy diretamente, ele só serve ao
+uso local/em campo (navegador e Streamlit na mesma máquina): por isso é
+ativado explicitamente com BIOGAS_TILE_PROXY=1, e as interfaces usam as URLs
+remotas para quem acessa de outra máquina.
+
+Uso pela linha de comando:
+    python biogas_tiles.py prefetch --zoom 17 19 --radius 300
+    python biogas_tiles.py serve --port 8765
+"""
+import argparse
+import math
+import os
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TILE_DIR = os.path.join('biogas_data', 'tiles')
+DEFAULT_PORT = int(os.environ.get('BIOGAS_TILE_PORT', 8765))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+TILE_SOURCES = {
+    'google': 'https://mt{s}.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+    'esri': 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+}
+
+
+def lonlat_to_tile(lat, lon, zoom):
+    """Tile XYZ (Web Mercator) que contém o ponto"""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_around(lat, lon, zooms, radius_m):
+    """Tiles (z, x, y) que cobrem um quadrado de lado 2*radius_m em torno do ponto"""
+    d_lat = radius_m / 111_320
+    d_lon = radius_m / (111_320 * max(math.cos(math.radians(lat)), 1e-6))
+    tiles = []
+    for z in zooms:
+        x_min, y_min = lonlat_to_tile(lat + d_lat, lon - d_lon, z)
+        x_max, y_max = lonlat_to_tile(lat - d_lat, lon + d_lon, z)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                tiles.append((z, x, y))
+    return tiles
+
+
+def guess_content_type(data):
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+
+class TileCache:
+    """Cache de tiles em disco (camada/z/x/y) com limite de tamanho e remoção LRU"""
+
+    def __init__(self, directory=TILE_DIR, max_bytes=DEFAULT_MAX_BYTES, sources=None, timeout=10):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sources = dict(sources or TILE_SOURCES)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Reconstrói a ordem LRU a partir do horário de acesso gravado no disco
+        found = []
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total_bytes += size
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _path(self, layer, z, x, y):
+        return os.path.join(self.directory, layer, str(z), str(x), str(y))
+
+    def get(self, layer, z, x, y):
+        """Tile do cache ou None"""
+        path = self._path(layer, z, x, y)
+        with self._lock:
+            if path not in self._entries:
+                # Tile gravado por outro processo que compartilha o diretório
+                if not os.path.exists(path):
+                    return None
+                self._entries[path] = os.path.getsize(path)
+                self._total_bytes += self._entries[path]
+            self._entries.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(path, 0)
+            return None
+        return data
+
+    def put(self, layer, z, x, y, data):
+        path = self._path(layer, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_path, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
+
+    def contains(self, layer, z, x, y):
+        path = self._path(layer, z, x, y)
+        with self._lock:
+            return path in self._entries or os.path.exists(path)
+
+    def upstream_url(self, layer, z, x, y):
+        return self.sources[layer].format(s=(x + y) % 4, x=x, y=y, z=z)
+
+    def fetch(self, layer, z, x, y):
+        """Tile do cache ou, na falta, baixado do servidor de origem e guardado"""
+        data = self.get(layer, z, x, y)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        request = urllib.request.Request(
+            self.upstream_url(layer, z, x, y),
+            headers={'User-Agent': 'biogas-tile-cache/1.0'}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = response.read()
+        self.put(layer, z, x, y, data)
+        return data
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    cache = None
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts == ['health']:
+            self._send(200, b'ok', 'text/plain')
+            return
+        if len(parts) != 4 or parts[0] not in self.cache.sources:
+            self._send(404, b'not found', 'text/plain')
+            return
+        try:
+            layer, z, x, y = parts[0], int(parts[1]), int(parts[2]), int(parts[3])
+        except ValueError:
+            self._send(400, b'bad tile', 'text/plain')
+            return
+
+        try:
+            data = self.cache.fetch(layer, z, x, y)
+        except OSError:
+            self._send(502, b'upstream unavailable', 'text/plain')
+            return
+        self._send(200, data, guess_content_type(data))
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if status == 200:
+            self.send_header('Cache-Control', 'public, max-age=86400')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileProxyServer:
+    """Servidor HTTP local que responde tiles a partir de um TileCache"""
+
+    def __init__(self, cache=None, host='127.0.0.1', port=DEFAULT_PORT):
+        self.cache = cache or TileCache()
+        handler = type('TileHandler', (_TileHandler,), {'cache': self.cache})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url_template(self, layer):
+        return tile_url_template(layer, self.host, self.port)
+
+
+def tile_url_template(layer, host='127.0.0.1', port=DEFAULT_PORT):
+    """URL no formato do Leaflet para uma camada servida pelo proxy"""
+    return f"http://{host}:{port}/{layer}/{{z}}/{{x}}/{{y}}"
+
+
+def proxy_is_running(host='127.0.0.1', port=DEFAULT_PORT):
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/health", timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def ensure_tile_proxy(port=DEFAULT_PORT):
+    """Inicia o proxy local ou reaproveita um já em execução na porta.
+
+    Retorna o servidor iniciado, True se outro processo já o atende, ou None
+    se o proxy não foi ativado (BIOGAS_TILE_PROXY=1) ou está indisponível.
+    """
+    if os.environ.get('BIOGAS_TILE_PROXY', '0') != '1':
+        return None
+    try:
+        return TileProxyServer(port=port).start()
+    except OSError:
+        return True if proxy_is_running(port=port) else None
+
+
+def prefetch_points(cache, points, zooms=(17, 18, 19), radius_m=300, layers=('google',)):
+    """Baixa para o cache os tiles em torno de cada (lat, lon)"""
+    fetched, failed = 0, 0
+    for lat, lon in points:
+        for z, x, y in tiles_around(lat, lon, zooms, radius_m):
+            for layer in layers:
+                if cache.contains(layer, z, x, y):
+                    continue
+                try:
+                    cache.fetch(layer, z, x, y)
+                    fetched += 1
+                except OSError:
+                    failed += 1
+    return fetched, failed
+
+
+class TilePrefetcher:
+    """Baixa tiles em segundo plano (pool de threads) para as próximas plantas"""
+
+    def __init__(self, cache, max_workers=4, zooms=(17, 18, 19), radius_m=250):
+        self.cache = cache
+        self.zooms = zooms
+        self.radius_m = radius_m
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tile-prefetch')
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    def schedule(self, points, layers=('google',)):
+        """Enfileira os tiles em torno de cada (lat, lon) que ainda não estão no cache"""
+        scheduled = 0
+        for lat, lon in points:
+            for z, x, y in tiles_around(lat, lon, self.zooms, self.radius_m):
+                for layer in layers:
+                    tile = (layer, z, x, y)
+                    with self._lock:
+                        if tile in self._in_flight:
+                            continue
+                        self._in_flight.add(tile)
+                    if self.cache.contains(*tile):
+                        self._done(tile)
+                        continue
+                    self._executor.submit(self._fetch, tile)
+                    scheduled += 1
+        return scheduled
+
+    def _fetch(self, tile):
+        try:
+            self.cache.fetch(*tile)
+        except OSError:
+            pass
+        finally:
+            self._done(tile)
+
+    def _done(self, tile):
+        with self._lock:
+            self._in_flight.discard(tile)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache local de tiles de satélite")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prefetch = subparsers.add_parser('prefetch', help="Aquecer o cache em torno de todas as plantas do CSV")
+    prefetch.add_argument('--csv', default='Plantas_Biogas_Para_Classificacao.csv')
+    prefetch.add_argument('--zoom', type=int, nargs=2, default=[17, 19], metavar=('MIN', 'MAX'))
+    prefetch.add_argument('--radius', type=float, default=300, help="Raio em metros")
+    prefetch.add_argument('--layer', action='append', choices=sorted(TILE_SOURCES))
+
+    serve = subparsers.add_parser('serve', help="Servir tiles do cache")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+
+    args = parser.parse_args()
+
+    if args.command == 'prefetch':
+        import csv
+        with open(args.csv, encoding='utf-8') as f:
+            points = [(float(row['Latitude']), float(row['Longitude'])) for row in csv.DictReader(f)]
+        cache = TileCache()
+        fetched, failed = prefetch_points(
+            cache, points, range(args.zoom[0], args.zoom[1] + 1), args.radius, args.layer or ['google']
+        )
+        print(f"{len(points)} plantas: {fetched} tiles baixados, {failed} falhas, "
+              f"cache com {cache.total_bytes / 1024 ** 2:.1f} MB")
+    else:
+        server = TileProxyServer(port=args.port)
+        print(f"Servindo tiles em http://{server.host}:{server.port}/<camada>/{{z}}/{{x}}/{{y}}")
+        server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,64 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from streamlit_folium import st_folium
-import json
 import os
-from datetime import datetime
+import time
+import functools
+import itertools
 import uuid
+from datetime import datetime
 from folium.plugins import Draw, MeasureControl
-import math
+from biogas_journal import AssessmentJournal, coordinate_id, remove_coordinate, rename_plants
+from biogas_maps import MapTemplateCache, fingerprint
+from biogas_data import LARGE_EXPORT_BYTES, STORE_RESIDENT_COLUMNS, ingest_plants, legacy_id_map, load_plants, plant_ids
+from biogas_db import BiogasDatabase, LazyRecords
+from biogas_export import GEOPARQUET_AVAILABLE, MLExportCache, geoparquet_bytes, write_geoparquet
+from biogas_geo import calculate_distance
+from biogas_model import MIN_TRAINING_SAMPLES, run_preclassification
+from biogas_overlay import LocalRasterCatalog, render_overlay
+from biogas_picker import PlantCatalog, StorePlantCatalog
+from biogas_queue import ValidationQueue
+from biogas_spatial import PlantSpatialIndex, annotate_duplicates
+from biogas_storage import atomic_write_text, recover
+from biogas_stats import AssessmentCounters
+from biogas_tiles import TileCache, TilePrefetcher, TileProxyServer, ensure_tile_proxy, tile_url_template
+
+# Raios de vizinhança (m) usados no mapa
+NEIGHBOR_RADIUS_M = 5000
+DUPLICATE_RADIUS_M = 50
+
+# Plantas à frente cujos tiles são baixados em segundo plano
+PREFETCH_AHEAD = 3
+
+# Escopo das reservas de plantas no banco compartilhado
+LEASE_SCOPE = 'assessment'
+
+# Dataset GeoParquet particionado por município (pipelines de treino)
+ML_DATASET_DIR = 'biogas_ml_dataset'
+
+# Buckets e ordenações do painel de validação
+VALIDATION_BUCKETS = {
+    'PENDING': "⏳ Pendentes",
+    'NEEDS_REVIEW': "⚠️ Revisar",
+    'REJECTED': "❌ Rejeitadas",
+}
+VALIDATION_ORDERS = {
+    'confidence': "Menor confiança primeiro",
+    'age': "Mais antigas primeiro",
+}
+VALIDATION_PAGE_SIZE = 50
+
+# Filtros de status do seletor de plantas (None = todas)
+PICKER_STATUS_FILTERS = {
+    "Todas": None,
+    "⬜ Não avaliadas": 'NOT_ASSESSED',
+    "⏳ Pendentes": 'PENDING',
+    "✅ Validadas": 'VALIDATED',
+    "⚠️ Revisar": 'NEEDS_REVIEW',
+    "❌ Rejeitadas": 'REJECTED',
+}
 
 # Configuração da página
 st.set_page_config(
@@ -139,67 +190,188 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Inicializar session state
-if 'plant_index' not in st.session_state:
-    st.session_state.plant_index = 0
-if 'assessments' not in st.session_state:
-    st.session_state.assessments = {}
-if 'technology_coordinates' not in st.session_state:
-    st.session_state.technology_coordinates = {}
-if 'validation_data' not in st.session_state:
-    st.session_state.validation_data = {}
+# Persistência compartilhada entre sessões do servidor
+@st.cache_resource
+def get_journal():
+    """Journal append-only de eventos"""
+    return AssessmentJournal()
+
+@st.cache_resource
+def get_database():
+    """Banco SQLite com consultas indexadas"""
+    return BiogasDatabase()
+
+@st.cache_resource
+def recover_storage():
+    """Conclui ou descarta gravações interrompidas (uma vez por processo, antes de ler os dados)"""
+    return [recover(directory) for directory in ('.', 'biogas_data')]
+
+for report in recover_storage():
+    for path in report['corrupted']:
+        st.warning(f"⚠️ Checksum não confere, arquivo possivelmente corrompido: {path}")
+
+@st.cache_resource
+def resume_storage():
+    """Leva ao banco os eventos do journal ainda não aplicados (uma vez por processo)"""
+    start = time.perf_counter()
+    applied = get_database().catch_up(get_journal())
+    return {f"journal → banco ({applied} eventos)": time.perf_counter() - start}
+
+# Dados das plantas (carregados antes da sessão para migrar ids antigos)
+@st.cache_resource
+def get_plant_store(csv_path):
+    """PlantStore das exportações grandes, ingerido em blocos (None: o CSV é lido inteiro)"""
+    if os.path.getsize(csv_path) > LARGE_EXPORT_BYTES:
+        return ingest_plants(csv_path)
+    return None
 
-# Funções utilitárias
-@st.cache_data
-def load_plant_data():
-    """Carrega dados das plantas de biogás"""
+@st.cache_resource
+def load_plant_data(duplicate_radius_m=DUPLICATE_RADIUS_M):
+    """Carrega dados das plantas de biogás e agrupa pontos duplicados"""
     try:
-        df = pd.read_csv('Plantas_Biogas_Para_Classificacao.csv')
+        csv_path = 'Plantas_Biogas_Para_Classificacao.csv'
+        store = get_plant_store(csv_path)
+        if store is not None:
+            # Exportação grande: em memória só as colunas de largura fixa; ids,
+            # rótulos e linhas completas são lidos do PlantStore por página
+            df = store.frame(STORE_RESIDENT_COLUMNS)
+        else:
+            df = load_plants(csv_path)
+        df = annotate_duplicates(df, duplicate_radius_m)
+        if store is None:
+            # Identidade estável: system:index do GEE, com índice id → linha no catálogo
+            df['plant_id'] = plant_ids(df)
         return df
     except FileNotFoundError:
         st.error("❌ Arquivo 'Plantas_Biogas_Para_Classificacao.csv' não encontrado!")
         st.info("📥 Coloque o arquivo CSV na mesma pasta do script.")
         return None
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calcula distância entre dois pontos em metros"""
-    R = 6371000  # Raio da Terra em metros
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-
-    a = (math.sin(delta_phi/2) * math.sin(delta_phi/2) +
-         math.cos(phi1) * math.cos(phi2) *
-         math.sin(delta_lambda/2) * math.sin(delta_lambda/2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+@st.cache_resource
+def get_plant_catalog(_df):
+    """Rótulos, ids e busca do seletor: em memória ou, nas exportações grandes, no PlantStore"""
+    store = get_plant_store('Plantas_Biogas_Para_Classificacao.csv')
+    if store is not None:
+        return StorePlantCatalog(store, _df)
+    return PlantCatalog(_df, _df['plant_id'].tolist())
+
+@st.cache_resource
+def migrate_plant_ids():
+    """Troca os ids antigos por posição (plant_NNN) pelo system:index (uma vez por processo)"""
+    start = time.perf_counter()
+    df = load_plant_data()
+    mapping = {}
+    if df is not None:
+        db = get_database()
+        records = db.legacy_records()
+        if records:
+            plants = get_plant_catalog(df).frame()
+            mapping = {old: new for old, new in legacy_id_map(plants, records).items() if old != new}
+        if mapping:
+            db.rename_plants(mapping)
+            get_journal().rewrite(lambda state: rename_plants(state, mapping))
+    return {f"migração de ids ({len(mapping)} plantas)": time.perf_counter() - start}
+
+def timed_load(timings, name, load):
+    """Executa load() registrando sua duração em timings"""
+    start = time.perf_counter()
+    result = load()
+    timings[name] = time.perf_counter() - start
+    return result
+
+# Inicializar session state (retoma os dados salvos: snapshot + journal → SQLite).
+# Só ids, colunas indexadas e agregados são lidos agora; cada avaliação é
+# decodificada quando a planta é aberta, então o custo não cresce com o histórico.
+if 'plant_index' not in st.session_state:
+    st.session_state.plant_index = 0
+if 'assessments' not in st.session_state:
+    db = get_database()
+    startup_timings = dict(resume_storage())
+    startup_timings.update(migrate_plant_ids())
+    st.session_state.assessments = timed_load(
+        startup_timings, "ids das avaliações",
+        lambda: LazyRecords(db.assessment_ids(), db.load_assessment)
+    )
+    st.session_state.technology_coordinates = timed_load(
+        startup_timings, "ids das coordenadas",
+        lambda: LazyRecords(db.coordinate_plant_ids(), db.load_plant_coordinates)
+    )
+    st.session_state.validation_queue = timed_load(
+        startup_timings, "fila de validação", lambda: ValidationQueue.from_rows(db.queue_rows())
+    )
+    st.session_state.counters = timed_load(
+        startup_timings, "contadores", lambda: AssessmentCounters.from_database(db)
+    )
+    st.session_state.startup_timings = startup_timings
+if 'validation_data' not in st.session_state:
+    st.session_state.validation_data = {}
+if 'map_cache' not in st.session_state:
+    st.session_state.map_cache = MapTemplateCache()
+if 'ml_export' not in st.session_state:
+    # Montada na primeira exportação, a partir do banco
+    st.session_state.ml_export = MLExportCache()
+    st.session_state.ml_export.defer_rebuild(
+        lambda: (get_database().load_assessments(), get_database().load_coordinates())
+    )
 
-    return R * c
+# Funções utilitárias
+def record_event(kind, plant_id, data):
+    """Grava o evento no journal e o aplica no banco com o mesmo seq"""
+    seq = get_journal().append(kind, plant_id, data)
+    get_database().apply_event(kind, plant_id, data, seq)
 
 def save_assessment(plant_id, assessment_data):
-    """Salva avaliação completa e exporta CSV automaticamente"""
+    """Salva avaliação completa (a exportação ML é gerada só quando pedida)"""
+    previous = st.session_state.assessments.get(plant_id)
     st.session_state.assessments[plant_id] = assessment_data
-
-    # Backup em arquivo JSON
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-    backup_file = f'biogas_assessments_backup_{timestamp}.json'
-
-    with open(backup_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'assessments': st.session_state.assessments,
-            'coordinates': st.session_state.technology_coordinates,
-            'validations': st.session_state.validation_data
-        }, f, indent=2, ensure_ascii=False)
-
-    # Exportar CSV automaticamente após cada avaliação
-    csv_data = export_ml_training_data()
-    if csv_data is not None:
-        csv_filename = f'biogas_assessments_{timestamp}.csv'
-        csv_data.to_csv(csv_filename, index=False, encoding='utf-8')
-        return csv_filename
-    return None
-
-def create_assessment_map(lat, lon, municipio, existing_coords=None):
+    st.session_state.counters.replace_assessment(previous, assessment_data)
+    st.session_state.validation_queue.update(plant_id, assessment_data)
+
+    # Registro append-only no journal (substitui o backup JSON completo)
+    record_event('assessment', plant_id, assessment_data)
+    refresh_ml_export(plant_id)
+
+@st.cache_resource
+def get_tile_proxy():
+    """Proxy local com cache em disco para os tiles de satélite"""
+    return ensure_tile_proxy()
+
+@st.cache_resource
+def get_tile_prefetcher():
+    """Pré-carregamento em segundo plano no mesmo cache do proxy"""
+    proxy = get_tile_proxy()
+    if proxy is None:
+        return None
+    return TilePrefetcher(proxy.cache if isinstance(proxy, TileProxyServer) else TileCache())
+
+def prefetch_upcoming_tiles(plant_index):
+    """Agenda os tiles das próximas PREFETCH_AHEAD plantas na ordem de navegação"""
+    prefetcher = get_tile_prefetcher()
+    if prefetcher is None:
+        return
+    points = []
+    upcoming = step_plant(plant_index, 1)
+    while upcoming is not None and len(points) < PREFETCH_AHEAD:
+        points.append((df_plantas['Latitude'].iat[upcoming], df_plantas['Longitude'].iat[upcoming]))
+        upcoming = step_plant(upcoming, 1)
+    prefetcher.schedule(points, layers=('google',))
+
+@st.cache_resource
+def get_local_rasters():
+    """Rasters locais para sobreposição (cabeçalhos lidos uma vez por processo)"""
+    return LocalRasterCatalog()
+
+def tile_url(layer, remote_url):
+    """URL da camada via proxy local, ou a URL remota se o proxy estiver desativado.
+
+    O endereço 127.0.0.1 do proxy é resolvido pelo navegador: quem acessa de
+    outra máquina (st.context.ip_address preenchido) recebe a URL remota.
+    """
+    if get_tile_proxy() is None or st.context.ip_address is not None:
+        return remote_url
+    return tile_url_template(layer)
+
+def create_assessment_map(lat, lon, municipio, existing_coords=None, neighbors=None, local_overlay=None):
     """Cria mapa interativo para avaliação"""
     m = folium.Map(
         location=[lat, lon],
@@ -210,7 +382,7 @@ def create_assessment_map(lat, lon, municipio, existing_coords=None):
 
     # High-quality satellite layer - Google Satellite only
     folium.TileLayer(
-        'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+        tile_url('google', 'https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}'),
         attr='Google Satellite',
         name='🌍 Google Satélite (HD)',
         overlay=False,
@@ -219,6 +391,20 @@ def create_assessment_map(lat, lon, municipio, existing_coords=None):
         subdomains=['mt0', 'mt1', 'mt2', 'mt3']
     ).add_to(m)
 
+    # Imagem local sobreposta: só a vizinhança da planta é lida do arquivo
+    if local_overlay:
+        rendered = render_overlay(get_local_rasters().rasters[local_overlay], lat, lon)
+        if rendered is not None:
+            image, bounds = rendered
+            folium.raster_layers.ImageOverlay(
+                image=image,
+                bounds=bounds,
+                name=f"🛰️ {local_overlay}",
+                opacity=0.85,
+                overlay=True,
+                control=True
+            ).add_to(m)
+
     # Marker da planta principal
     folium.Marker(
         [lat, lon],
@@ -265,6 +451,19 @@ def create_assessment_map(lat, lon, municipio, existing_coords=None):
         popup='Raio: 500m'
     ).add_to(m)
 
+    # Plantas vizinhas (índice espacial); duplicatas prováveis em vermelho
+    for neighbor in neighbors or []:
+        is_duplicate = neighbor['distance'] <= DUPLICATE_RADIUS_M
+        folium.CircleMarker(
+            [neighbor['lat'], neighbor['lon']],
+            radius=8 if is_duplicate else 6,
+            color='red' if is_duplicate else 'gray',
+            fill=True,
+            fillOpacity=0.7,
+            tooltip=f"{'⚠️ Possível duplicata - ' if is_duplicate else ''}Planta {neighbor['index'] + 1}: "
+                    f"{neighbor['municipio']} ({neighbor['distance']:.0f} m)"
+        ).add_to(m)
+
     # Adicionar coordenadas de tecnologias existentes
     if existing_coords:
         colors = {'lagoas': 'red', 'biotanques': 'orange', 'alta_tech': 'green', 'outros': 'purple'}
@@ -318,395 +517,611 @@ def create_assessment_map(lat, lon, municipio, existing_coords=None):
 
     return m
 
+@st.cache_resource
+def get_spatial_index(_df):
+    """Índice espacial construído uma vez a partir de Latitude/Longitude"""
+    return PlantSpatialIndex(_df['Latitude'].to_numpy(), _df['Longitude'].to_numpy())
+
+def find_neighbors(plant_index):
+    """Plantas dentro de NEIGHBOR_RADIUS_M da planta atual"""
+    indices, distances = get_spatial_index(df_plantas).neighbors(plant_index, NEIGHBOR_RADIUS_M)
+    return [
+        {
+            'index': int(i),
+            'lat': float(df_plantas['Latitude'].iat[i]),
+            'lon': float(df_plantas['Longitude'].iat[i]),
+            'municipio': df_plantas['Municipio'].iat[i],
+            'distance': float(d)
+        }
+        for i, d in zip(indices, distances)
+    ]
+
+def cluster_members(plant_index):
+    """Outras plantas do mesmo grupo de duplicatas"""
+    cluster_id = df_plantas['cluster_id'].iat[plant_index]
+    members = np.flatnonzero(df_plantas['cluster_id'].to_numpy() == cluster_id)
+    return [int(i) for i in members if i != plant_index]
+
+def step_plant(plant_index, step):
+    """Posição vizinha na navegação, pulando duplicatas se configurado"""
+    target = plant_index + step
+    if st.session_state.get('skip_duplicates', True):
+        is_duplicate = df_plantas['is_duplicate'].to_numpy()
+        while 0 <= target < len(df_plantas) and is_duplicate[target]:
+            target += step
+    return target if 0 <= target < len(df_plantas) else None
+
+
+def plant_status_mask(catalog, status):
+    """Máscara booleana das plantas com o status de validação pedido"""
+    if status is None:
+        return None
+    assessments = st.session_state.assessments
+    if status == 'NOT_ASSESSED':
+        mask = np.ones(len(catalog), dtype=bool)
+        mask[catalog.positions_of(assessments)] = False
+    else:
+        mask = np.zeros(len(catalog), dtype=bool)
+        mask[catalog.positions_of(get_database().plant_ids_by_status(status))] = True
+    return mask
+
+def render_plant_picker(current_plant):
+    """Seletor pesquisável e paginado: só a página visível vira opções"""
+    catalog = get_plant_catalog(df_plantas)
+    query = st.text_input("🔎 Buscar planta:", key='picker_query', placeholder="Município ou id")
+    status = st.selectbox("Status:", list(PICKER_STATUS_FILTERS), key='picker_status')
+    positions = catalog.filter(query, plant_status_mask(catalog, PICKER_STATUS_FILTERS[status]))
+    if not len(positions):
+        st.caption("Nenhuma planta encontrada")
+        return current_plant
+
+    pages = catalog.page_count(positions)
+    page = st.number_input(
+        f"Página (de {pages}):", min_value=1, max_value=pages,
+        value=catalog.page_of(positions, current_plant) + 1
+    ) - 1
+    options = catalog.page(positions, page).tolist()
+    # A planta atual continua selecionável mesmo fora do filtro/página
+    if current_plant not in options:
+        options.insert(0, current_plant)
+    labels = catalog.labels_of(options)
+
+    selected = st.selectbox(
+        "Selecionar Planta:",
+        options,
+        index=options.index(current_plant),
+        format_func=labels.get
+    )
+    st.caption(f"{len(positions)} planta(s) encontrada(s)")
+    return selected
+
+def checkout_next_plant(current_plant, assessor):
+    """Reserva a próxima planta sem avaliação e sem outro avaliador, a partir da atual.
+
+    Com "incertas primeiro", as plantas previstas vêm antes, da mais incerta
+    à mais confiante; as sem previsão seguem na ordem do CSV.
+    """
+    skip_duplicates = st.session_state.get('skip_duplicates', True)
+    is_duplicate = df_plantas['is_duplicate'].to_numpy()
+    order = itertools.chain(range(current_plant + 1, len(df_plantas)), range(current_plant + 1))
+    catalog = get_plant_catalog(df_plantas)
+    candidates = catalog.iter_plant_ids(i for i in order if not (skip_duplicates and is_duplicate[i]))
+    if st.session_state.get('uncertain_first'):
+        positions = ((plant_id, catalog.position(plant_id)) for plant_id in get_database().uncertain_plant_ids())
+        uncertain = (
+            plant_id for plant_id, position in positions
+            if position is not None and position != current_plant
+            and not (skip_duplicates and is_duplicate[position])
+        )
+        candidates = itertools.chain(uncertain, candidates)
+    plant_id = get_database().checkout_next(LEASE_SCOPE, assessor, candidates)
+    return None if plant_id is None else catalog.position(plant_id)
+
+def sync_plant(plant_id):
+    """Traz do banco compartilhado a avaliação e as tecnologias de outro avaliador"""
+    db = get_database()
+    # Os contadores partem do banco na abertura da sessão: só há diferença a
+    # aplicar se a sessão já tinha outra versão em memória ou não conhecia a planta
+    assessments = st.session_state.assessments
+    assessment = db.load_assessment(plant_id)
+    if assessment is not None:
+        previous = assessments.cached(plant_id)
+        if assessment != previous and (previous is not None or plant_id not in assessments):
+            st.session_state.counters.replace_assessment(previous, assessment)
+            st.session_state.validation_queue.update(plant_id, assessment)
+        assessments[plant_id] = assessment
+
+    coordinates = st.session_state.technology_coordinates
+    coords = db.load_plant_coordinates(plant_id)
+    previous_coords = coordinates.cached(plant_id)
+    if previous_coords is not None or plant_id not in coordinates:
+        st.session_state.counters.add_coordinates(len(coords) - len(previous_coords or []))
+    coordinates[plant_id] = coords
+    refresh_ml_export(plant_id)
+
+def holds_lease():
+    """Se o avaliador desta sessão detém a reserva da planta atual"""
+    return st.session_state.lease_holder == st.session_state.assessor.strip()
+
+def remove_technology(plant_id, coord_id):
+    """Remove uma tecnologia mapeada da planta, pelo id (não pela posição na lista)"""
+    if not holds_lease():
+        return
+    coords = st.session_state.technology_coordinates[plant_id]
+    remaining = remove_coordinate(coords, {'id': coord_id})
+    if len(remaining) == len(coords):
+        return
+    st.session_state.technology_coordinates[plant_id] = remaining
+    st.session_state.counters.add_coordinates(-1)
+    record_event('coordinate_remove', plant_id, {'id': coord_id})
+    refresh_ml_export(plant_id)
+
+def refresh_ml_export(plant_id):
+    """Recalcula apenas as linhas de exportação ML da planta alterada"""
+    if plant_id in st.session_state.assessments:
+        st.session_state.ml_export.update_plant(
+            plant_id,
+            st.session_state.assessments[plant_id],
+            st.session_state.technology_coordinates.get(plant_id, [])
+        )
+
 def export_ml_training_data():
     """Exporta dados estruturados para treinamento ML"""
     if not st.session_state.assessments:
         return None
 
-    ml_data = []
-
-    for plant_id, assessment in st.session_state.assessments.items():
-        base_record = {
-            'plant_id': plant_id,
-            'municipio': assessment['municipio'],
-            'base_latitude': assessment['latitude'],
-            'base_longitude': assessment['longitude'],
-            'has_biogas_plant': assessment.get('has_plant', True),
-            'overall_technology_level': assessment.get('tech_level', 'UNKNOWN'),
-            'assessor_confidence': assessment.get('confidence', 0),
-            'assessment_date': assessment.get('timestamp', ''),
-            'validation_status': assessment.get('validation_status', 'PENDING'),
-            'validation_confidence': assessment.get('validation_confidence', 0),
-            'general_observations': assessment.get('observations', '')
-        }
-
-        # Coordenadas de tecnologias específicas
-        tech_coords = st.session_state.technology_coordinates.get(plant_id, [])
-
-        if tech_coords:
-            for i, coord in enumerate(tech_coords):
-                record = base_record.copy()
-                record.update({
-                    'technology_id': f"{plant_id}_tech_{i+1}",
-                    'tech_latitude': coord['lat'],
-                    'tech_longitude': coord['lon'],
-                    'technology_type': coord.get('type', 'unknown'),
-                    'estimated_area_m2': coord.get('area', 0),
-                    'distance_from_base_m': calculate_distance(
-                        base_record['base_latitude'],
-                        base_record['base_longitude'],
-                        coord['lat'],
-                        coord['lon']
-                    ),
-                    'tech_notes': coord.get('notes', '')
-                })
-                ml_data.append(record)
-        else:
-            # Se não há coordenadas específicas, usar localização base
-            record = base_record.copy()
-            record.update({
-                'technology_id': f"{plant_id}_base",
-                'tech_latitude': base_record['base_latitude'],
-                'tech_longitude': base_record['base_longitude'],
-                'technology_type': base_record['overall_technology_level'],
-                'estimated_area_m2': 0,
-                'distance_from_base_m': 0,
-                'tech_notes': 'Base location assessment'
-            })
-            ml_data.append(record)
-
-    return pd.DataFrame(ml_data)
-
-# Carregar dados
-df_plantas = load_plant_data()
-
-if df_plantas is not None:
-    total_plantas = len(df_plantas)
-
-    # Sidebar - Navegação e Controles
-    with st.sidebar:
-        st.markdown("### 🎯 NAVEGAÇÃO")
-
-        # Seletor de planta
-        current_plant = st.selectbox(
-            "Selecionar Planta:",
-            range(total_plantas),
-            index=st.session_state.plant_index,
-            format_func=lambda x: f"{x+1:02d}. {df_plantas.iloc[x]['Municipio']}"
-        )
-        st.session_state.plant_index = current_plant
-
-        # Navegação rápida
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("⬅️ Anterior", use_container_width=True) and current_plant > 0:
-                st.session_state.plant_index = current_plant - 1
-                st.rerun()
-        with col2:
-            if st.button("Próxima ➡️", use_container_width=True) and current_plant < total_plantas - 1:
-                st.session_state.plant_index = current_plant + 1
-                st.rerun()
-
-        # Progresso
-        st.markdown("### 📊 PROGRESSO GERAL")
-        assessed_count = len(st.session_state.assessments)
-        validated_count = len([a for a in st.session_state.assessments.values()
-                             if a.get('validation_status') == 'VALIDATED'])
-
-        progress = assessed_count / total_plantas if total_plantas > 0 else 0
-        validation_progress = validated_count / assessed_count if assessed_count > 0 else 0
-
-        st.progress(progress, text=f"Avaliadas: {assessed_count}/{total_plantas} ({progress:.1%})")
-        st.progress(validation_progress, text=f"Validadas: {validated_count}/{assessed_count} ({validation_progress:.1%})")
-
-        # Estatísticas compactas
-        if assessed_count > 0:
-            st.markdown("### 📈 ESTATÍSTICAS")
-            tech_levels = [a.get('tech_level', 'UNKNOWN') for a in st.session_state.assessments.values()]
-
-            for level in ['ALTA', 'MEDIA', 'BAIXA', 'SEM_PLANTA']:
-                count = tech_levels.count(level)
-                if count > 0:
-                    st.metric(level.replace('_', ' '), count)
-
-        # Ferramentas de exportação
-        st.markdown("### 💾 EXPORTAÇÃO")
-        if st.session_state.assessments:
-            if st.button("📥 Exportar Dados ML", use_container_width=True):
-                ml_df = export_ml_training_data()
-                if ml_df is not None:
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-                    filename = f'biogas_ml_training_data_{timestamp}.csv'
+    return st.session_state.ml_export.to_frame()
+
+# Tempo de renderização por seção (exibido na barra lateral)
+if 'render_timings' not in st.session_state:
+    st.session_state.render_timings = {}
+_run_start = time.perf_counter()
+
+def timed_section(name):
+    """Registra a duração da última execução de uma seção da página"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                st.session_state.render_timings[name] = time.perf_counter() - start
+        return wrapper
+    return decorator
+
+# Seções independentes: uma interação reexecuta apenas o fragmento em que ocorreu
+# (st.rerun(scope="fragment")). Só trocar de planta, inclusive o avanço depois
+# de salvar, usa st.rerun() completo.
+@st.fragment
+@timed_section('progresso')
+def render_sidebar_progress(total_plantas):
+    """Progresso, estatísticas e exportação na barra lateral"""
+    # Progresso
+    st.markdown("### 📊 PROGRESSO GERAL")
+    counters = st.session_state.counters
+    assessed_count = counters.assessed
+    validated_count = counters.status_count('VALIDATED')
+
+    progress = assessed_count / total_plantas if total_plantas > 0 else 0
+    validation_progress = validated_count / assessed_count if assessed_count > 0 else 0
+
+    st.progress(progress, text=f"Avaliadas: {assessed_count}/{total_plantas} ({progress:.1%})")
+    st.progress(validation_progress, text=f"Validadas: {validated_count}/{assessed_count} ({validation_progress:.1%})")
+
+    # Estatísticas compactas
+    if assessed_count > 0:
+        st.markdown("### 📈 ESTATÍSTICAS")
+        tech_counts = counters.tech_levels
+
+        for level in ['ALTA', 'MEDIA', 'BAIXA', 'SEM_PLANTA']:
+            count = tech_counts.get(level, 0)
+            if count > 0:
+                st.metric(level.replace('_', ' '), count)
+
+    # Ferramentas de exportação
+    st.markdown("### 💾 EXPORTAÇÃO")
+    if st.session_state.assessments:
+        if st.button("📥 Exportar Dados ML", use_container_width=True):
+            ml_df = export_ml_training_data()
+            if ml_df is not None:
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+                filename = f'biogas_ml_training_data_{timestamp}.csv'
+                csv_text = ml_df.to_csv(index=False)
+                # Cópia local do CSV, gerada só nesta exportação explícita
+                csv_filename = f'biogas_assessments_{timestamp}.csv'
+                atomic_write_text(csv_filename, csv_text)
+                st.caption(f"📊 Dados exportados para: {csv_filename}")
+                st.download_button(
+                    "📊 Baixar CSV para ML",
+                    csv_text,
+                    filename,
+                    "text/csv",
+                    use_container_width=True
+                )
+                if GEOPARQUET_AVAILABLE:
                     st.download_button(
-                        "📊 Baixar CSV para ML",
-                        ml_df.to_csv(index=False, encoding='utf-8'),
-                        filename,
-                        "text/csv",
+                        "🗺️ Baixar GeoParquet para ML",
+                        geoparquet_bytes(ml_df),
+                        f'biogas_ml_training_data_{timestamp}.parquet',
+                        "application/vnd.apache.parquet",
                         use_container_width=True
                     )
-
-    # Dados da planta atual
-    planta = df_plantas.iloc[current_plant]
-    plant_id = f"plant_{current_plant:03d}"
-
-    # Layout principal
-    col1, col2 = st.columns([2.2, 1.8])
-
-    with col1:
-        st.markdown(f"### 📍 Planta {current_plant + 1:02d}/{total_plantas} - {planta['Municipio']}")
-
-        # Informações da planta
-        info_col1, info_col2 = st.columns(2)
-        with info_col1:
-            st.markdown(f"**📍 Coordenadas Base:** {planta['Latitude']:.6f}, {planta['Longitude']:.6f}")
-        with info_col2:
-            if 'cana_ha' in planta and pd.notna(planta['cana_ha']):
-                st.markdown(f"**🌱 Área de Cana:** {planta['cana_ha']:.0f} ha")
-
-        # Mapa de satélite interativo
-        st.markdown("### 🛰️ Análise por Imagem de Satélite")
-
-        existing_coords = st.session_state.technology_coordinates.get(plant_id, [])
-        satellite_map = create_assessment_map(
+                    # Dataset local particionado por município para os pipelines de treino
+                    write_geoparquet(ml_df, ML_DATASET_DIR)
+                    st.caption(f"🗂️ Dataset GeoParquet por município em {ML_DATASET_DIR}/")
+
+    with st.expander("⏱️ Tempo de renderização"):
+        for name, duration in st.session_state.render_timings.items():
+            st.caption(f"{name}: {duration * 1000:.0f} ms")
+        st.caption("**Inicialização da sessão**")
+        for name, duration in st.session_state.startup_timings.items():
+            st.caption(f"{name}: {duration * 1000:.1f} ms")
+        st.caption(f"avaliações lidas sob demanda: {st.session_state.assessments.loads}")
+
+@st.fragment
+@timed_section('mapa')
+def render_map_section(current_plant, total_plantas):
+    """Mapa de satélite, vizinhança e captura de coordenadas"""
+    planta = get_plant_catalog(df_plantas).row(current_plant)
+    plant_id = planta['plant_id']
+
+    st.markdown(f"### 📍 Planta {current_plant + 1:02d}/{total_plantas} - {planta['Municipio']}")
+
+    # Informações da planta
+    info_col1, info_col2 = st.columns(2)
+    with info_col1:
+        st.markdown(f"**📍 Coordenadas Base:** {planta['Latitude']:.6f}, {planta['Longitude']:.6f}")
+    with info_col2:
+        if 'cana_ha' in planta and pd.notna(planta['cana_ha']):
+            st.markdown(f"**🌱 Área de Cana:** {planta['cana_ha']:.0f} ha")
+        if planta.get('geo_area_m2', 0) > 0:
+            st.markdown(f"**📐 Área do Polígono:** {planta['geo_area_m2']:.0f} m²")
+    if planta.get('geo_mismatch', False):
+        st.warning("⚠️ A geometria (.geo) é inválida ou não confere com Latitude/Longitude desta planta")
+    prediction = None if plant_id in st.session_state.assessments else get_database().load_prediction(plant_id)
+    if prediction:
+        st.caption(f"🤖 Pré-classificação: {prediction['predicted_class']} "
+                   f"({prediction['confidence']:.0%} de confiança, incerteza {prediction['uncertainty']:.2f})")
+
+    # Vizinhança consultada no índice espacial
+    neighbors = find_neighbors(current_plant)
+    duplicates = [n for n in neighbors if n['distance'] <= DUPLICATE_RADIUS_M]
+    if duplicates:
+        st.warning("⚠️ Possível duplicata a menos de "
+                   f"{DUPLICATE_RADIUS_M} m: " + ", ".join(
+                       f"Planta {n['index'] + 1} ({n['distance']:.0f} m)" for n in duplicates))
+    if neighbors:
+        st.caption(f"🏘️ {len(neighbors)} planta(s) num raio de {NEIGHBOR_RADIUS_M / 1000:.0f} km")
+
+    # Mapa de satélite interativo
+    st.markdown("### 🛰️ Análise por Imagem de Satélite")
+
+    # Imagens locais (Sentinel, ortofotos) que cobrem a planta, se houver
+    local_rasters = get_local_rasters()
+    local_overlay = None
+    covering = local_rasters.covering(planta['Latitude'], planta['Longitude']) if len(local_rasters) else []
+    if covering:
+        choice = st.selectbox("🗺️ Imagem local sobreposta:", ["Nenhuma", *covering], key='local_overlay')
+        local_overlay = None if choice == "Nenhuma" else choice
+    if local_rasters.errors:
+        st.caption(f"⚠️ Imagens locais não lidas: {', '.join(local_rasters.errors)}")
+
+    existing_coords = st.session_state.technology_coordinates.get(plant_id, [])
+    # Mapa reaproveitado entre reruns até as coordenadas mapeadas ou a imagem local mudarem
+    satellite_map = st.session_state.map_cache.get(
+        plant_id,
+        fingerprint(existing_coords, local_overlay),
+        lambda: create_assessment_map(
             planta['Latitude'],
             planta['Longitude'],
             planta['Municipio'],
-            existing_coords
-        )
-
-        map_data = st_folium(
-            satellite_map,
-            height=550,
-            width=None,
-            returned_objects=["last_object_clicked", "last_clicked", "all_drawings"]
+            existing_coords,
+            neighbors,
+            local_overlay
         )
+    )
 
-        # Capturar cliques no mapa para coordenadas de tecnologias
-        if map_data['last_object_clicked']:
-            clicked_lat = map_data['last_object_clicked']['lat']
-            clicked_lon = map_data['last_object_clicked']['lng']
-
-            st.markdown("### 🎯 Coordenada Clicada")
-            st.markdown(f"""
-            <div class="coord-display">
-                <strong>Latitude:</strong> {clicked_lat:.6f}<br>
-                <strong>Longitude:</strong> {clicked_lon:.6f}<br>
-                <strong>Distância da base:</strong> {calculate_distance(planta['Latitude'], planta['Longitude'], clicked_lat, clicked_lon):.1f}m
-            </div>
-            """, unsafe_allow_html=True)
-
-            # Interface para adicionar tecnologia
-            with st.expander("➕ Adicionar Tecnologia nesta Coordenada"):
-                tech_type = st.selectbox(
-                    "Tipo de Tecnologia:",
-                    ["lagoas", "biotanques", "alta_tech", "outros"],
-                    format_func=lambda x: {
-                        "lagoas": "🔴 Lagoas/Tanques Grandes",
-                        "biotanques": "🟡 Biotanques/Reatores",
-                        "alta_tech": "🟢 Alta Tecnologia",
-                        "outros": "⚪ Outros"
-                    }[x]
-                )
+    map_data = st_folium(
+        satellite_map,
+        height=550,
+        width=None,
+        returned_objects=["last_object_clicked", "last_clicked", "all_drawings"]
+    )
 
-                estimated_area = st.number_input("Área Estimada (m²):", min_value=0.0, value=100.0, step=10.0)
-                tech_notes = st.text_area("Observações da Tecnologia:", placeholder="Descreva o que observa nesta localização...")
+    # Capturar cliques no mapa para coordenadas de tecnologias
+    if map_data['last_object_clicked']:
+        clicked_lat = map_data['last_object_clicked']['lat']
+        clicked_lon = map_data['last_object_clicked']['lng']
+
+        st.markdown("### 🎯 Coordenada Clicada")
+        st.markdown(f"""
+        <div class="coord-display">
+            <strong>Latitude:</strong> {clicked_lat:.6f}<br>
+            <strong>Longitude:</strong> {clicked_lon:.6f}<br>
+            <strong>Distância da base:</strong> {calculate_distance(planta['Latitude'], planta['Longitude'], clicked_lat, clicked_lon):.1f}m
+        </div>
+        """, unsafe_allow_html=True)
 
-                if st.button("✅ Adicionar Tecnologia"):
-                    if plant_id not in st.session_state.technology_coordinates:
-                        st.session_state.technology_coordinates[plant_id] = []
+        # Interface para adicionar tecnologia
+        with st.expander("➕ Adicionar Tecnologia nesta Coordenada"):
+            tech_type = st.selectbox(
+                "Tipo de Tecnologia:",
+                ["lagoas", "biotanques", "alta_tech", "outros"],
+                format_func=lambda x: {
+                    "lagoas": "🔴 Lagoas/Tanques Grandes",
+                    "biotanques": "🟡 Biotanques/Reatores",
+                    "alta_tech": "🟢 Alta Tecnologia",
+                    "outros": "⚪ Outros"
+                }[x]
+            )
 
-                    st.session_state.technology_coordinates[plant_id].append({
-                        'lat': clicked_lat,
-                        'lon': clicked_lon,
-                        'type': tech_type,
-                        'area': estimated_area,
-                        'notes': tech_notes,
-                        'timestamp': datetime.now().isoformat()
-                    })
-                    st.success("🎯 Tecnologia adicionada com sucesso!")
-                    st.rerun()
+            # Polígonos do GEE (pegada do biodigestor) fornecem a área inicial
+            polygon_area = float(planta.get('geo_area_m2', 0) or 0)
+            estimated_area = st.number_input(
+                "Área Estimada (m²):", min_value=0.0,
+                value=round(polygon_area, 1) if polygon_area > 0 else 100.0, step=10.0
+            )
+            tech_notes = st.text_area("Observações da Tecnologia:", placeholder="Descreva o que observa nesta localização...")
+
+            added = st.button("✅ Adicionar Tecnologia")
+            if added and not holds_lease():
+                st.error(f"🔒 Não adicionada: planta reservada por {st.session_state.lease_holder}")
+            elif added:
+                if plant_id not in st.session_state.technology_coordinates:
+                    st.session_state.technology_coordinates[plant_id] = []
+
+                # Id estável: a remoção não depende da posição na lista
+                new_coord = {
+                    'id': uuid.uuid4().hex,
+                    'lat': clicked_lat,
+                    'lon': clicked_lon,
+                    'type': tech_type,
+                    'area': estimated_area,
+                    'notes': tech_notes,
+                    'timestamp': datetime.now().isoformat()
+                }
+                st.session_state.technology_coordinates[plant_id].append(new_coord)
+                st.session_state.counters.add_coordinates(1)
+                record_event('coordinate_add', plant_id, new_coord)
+                refresh_ml_export(plant_id)
+                st.success("🎯 Tecnologia adicionada com sucesso!")
+                st.rerun(scope="fragment")
+
+    # Tecnologias identificadas (no mesmo fragmento do mapa: incluir e remover
+    # só reexecutam esta seção)
+    if plant_id in st.session_state.technology_coordinates:
+        st.markdown("### 🎯 Tecnologias Mapeadas")
+        coords = st.session_state.technology_coordinates[plant_id]
+        locked = not holds_lease()
+
+        for i, coord in enumerate(coords):
+            with st.expander(f"📍 Tecnologia {i+1} - {coord['type'].replace('_', ' ').title()}"):
+                st.write(f"**Coordenadas:** {coord['lat']:.6f}, {coord['lon']:.6f}")
+                st.write(f"**Área:** {coord['area']:.0f} m²")
+                st.write(f"**Observações:** {coord['notes']}")
+
+                # Removida no callback, antes da execução do fragmento: o mapa é
+                # desenhado uma única vez, já sem a tecnologia
+                coord_id = coordinate_id(coord)
+                st.button(f"🗑️ Remover", key=f"remove_{i}_{coord_id}", disabled=locked,
+                          on_click=remove_technology, args=(plant_id, coord_id))
+
+    # Links diretos
+    gmaps_url = f"https://www.google.com/maps/@{planta['Latitude']},{planta['Longitude']},18z"
+    earth_url = f"https://earth.google.com/web/@{planta['Latitude']},{planta['Longitude']},0a,300d,35y,0h,0t,0r"
+
+    link_col1, link_col2 = st.columns(2)
+    with link_col1:
+        st.markdown(f"🔗 [Google Maps]({gmaps_url})")
+    with link_col2:
+        st.markdown(f"🌍 [Google Earth]({earth_url})")
+
+@st.fragment
+@timed_section('avaliação')
+def render_assessment_section(current_plant, next_plant):
+    """Tecnologias mapeadas, formulário e avaliação atual"""
+    planta = get_plant_catalog(df_plantas).row(current_plant)
+    plant_id = planta['plant_id']
+
+    st.markdown("### 🔬 AVALIAÇÃO TÉCNICA")
+
+    # Guia de classificação
+    with st.expander("📋 Guia de Classificação", expanded=False):
+        st.markdown("""
+        <div class="tech-indicator tech-pools">
+            <strong>🔴 BAIXA TECNOLOGIA:</strong><br>
+            • Lagoas de estabilização grandes (&gt;2000m²)<br>
+            • Formato irregular, sem cobertura<br>
+            • Tratamento anaeróbio simples
+        </div>
+        <div class="tech-indicator tech-tanks">
+            <strong>🟡 MÉDIA TECNOLOGIA:</strong><br>
+            • Reatores UASB, CRTs (200-2000m²)<br>
+            • Estruturas cilíndricas/retangulares<br>
+            • Possível cobertura para biogás
+        </div>
+        <div class="tech-indicator tech-biogas">
+            <strong>🟢 ALTA TECNOLOGIA:</strong><br>
+            • Digestores com cúpulas (&lt;200m²)<br>
+            • Sistemas integrados de biogás<br>
+            • Infraestrutura de purificação
+        </div>
+        <div class="tech-indicator tech-none">
+            <strong>⚠️ SEM PLANTA:</strong><br>
+            • Localização sem tecnologias visíveis<br>
+            • Apenas coordenada de referência
+        </div>
+        """, unsafe_allow_html=True)
 
-        # Links diretos
-        gmaps_url = f"https://www.google.com/maps/@{planta['Latitude']},{planta['Longitude']},18z"
-        earth_url = f"https://earth.google.com/web/@{planta['Latitude']},{planta['Longitude']},0a,300d,35y,0h,0t,0r"
+    # Formulário de avaliação
+    st.markdown("### 📝 FORMULÁRIO DE AVALIAÇÃO")
 
-        link_col1, link_col2 = st.columns(2)
-        with link_col1:
-            st.markdown(f"🔗 [Google Maps]({gmaps_url})")
-        with link_col2:
-            st.markdown(f"🌍 [Google Earth]({earth_url})")
+    with st.form(f"assessment_form_{plant_id}"):
+        # Presença de planta
+        has_plant = st.radio(
+            "**Existe planta de biogás visível?**",
+            [True, False],
+            format_func=lambda x: "✅ Sim, há tecnologias visíveis" if x else "❌ Não há planta visível"
+        )
 
-    with col2:
-        st.markdown("### 🔬 AVALIAÇÃO TÉCNICA")
-
-        # Guia de classificação
-        with st.expander("📋 Guia de Classificação", expanded=False):
-            st.markdown("""
-            <div class="tech-indicator tech-pools">
-                <strong>🔴 BAIXA TECNOLOGIA:</strong><br>
-                • Lagoas de estabilização grandes (&gt;2000m²)<br>
-                • Formato irregular, sem cobertura<br>
-                • Tratamento anaeróbio simples
-            </div>
-            <div class="tech-indicator tech-tanks">
-                <strong>🟡 MÉDIA TECNOLOGIA:</strong><br>
-                • Reatores UASB, CRTs (200-2000m²)<br>
-                • Estruturas cilíndricas/retangulares<br>
-                • Possível cobertura para biogás
-            </div>
-            <div class="tech-indicator tech-biogas">
-                <strong>🟢 ALTA TECNOLOGIA:</strong><br>
-                • Digestores com cúpulas (&lt;200m²)<br>
-                • Sistemas integrados de biogás<br>
-                • Infraestrutura de purificação
-            </div>
-            <div class="tech-indicator tech-none">
-                <strong>⚠️ SEM PLANTA:</strong><br>
-                • Localização sem tecnologias visíveis<br>
-                • Apenas coordenada de referência
-            </div>
-            """, unsafe_allow_html=True)
-
-        # Tecnologias identificadas
-        if plant_id in st.session_state.technology_coordinates:
-            st.markdown("### 🎯 Tecnologias Mapeadas")
-            coords = st.session_state.technology_coordinates[plant_id]
-
-            for i, coord in enumerate(coords):
-                with st.expander(f"📍 Tecnologia {i+1} - {coord['type'].replace('_', ' ').title()}"):
-                    st.write(f"**Coordenadas:** {coord['lat']:.6f}, {coord['lon']:.6f}")
-                    st.write(f"**Área:** {coord['area']:.0f} m²")
-                    st.write(f"**Observações:** {coord['notes']}")
-
-                    if st.button(f"🗑️ Remover", key=f"remove_{i}"):
-                        st.session_state.technology_coordinates[plant_id].pop(i)
-                        st.rerun()
-
-        # Formulário de avaliação
-        st.markdown("### 📝 FORMULÁRIO DE AVALIAÇÃO")
-
-        with st.form(f"assessment_form_{plant_id}"):
-            # Presença de planta
-            has_plant = st.radio(
-                "**Existe planta de biogás visível?**",
-                [True, False],
-                format_func=lambda x: "✅ Sim, há tecnologias visíveis" if x else "❌ Não há planta visível"
+        # Nível tecnológico
+        if has_plant:
+            tech_level = st.radio(
+                "**Nível Tecnológico Predominante:**",
+                ["ALTA", "MEDIA", "BAIXA"],
+                help="Baseado nas tecnologias mapeadas no mapa"
             )
+        else:
+            tech_level = "SEM_PLANTA"
+
+        # Confiança
+        confidence = st.slider(
+            "**Confiança na Avaliação (%):**",
+            min_value=50,
+            max_value=100,
+            value=80,
+            help="Sua certeza sobre a classificação feita"
+        )
 
-            # Nível tecnológico
-            if has_plant:
-                tech_level = st.radio(
-                    "**Nível Tecnológico Predominante:**",
-                    ["ALTA", "MEDIA", "BAIXA"],
-                    help="Baseado nas tecnologias mapeadas no mapa"
-                )
-            else:
-                tech_level = "SEM_PLANTA"
-
-            # Confiança
-            confidence = st.slider(
-                "**Confiança na Avaliação (%):**",
-                min_value=50,
-                max_value=100,
-                value=80,
-                help="Sua certeza sobre a classificação feita"
-            )
+        # Observações gerais
+        observations = st.text_area(
+            "**Observações Gerais:**",
+            placeholder="Descreva características gerais da localização, infraestrutura observada, etc.",
+            height=100
+        )
 
-            # Observações gerais
-            observations = st.text_area(
-                "**Observações Gerais:**",
-                placeholder="Descreva características gerais da localização, infraestrutura observada, etc.",
-                height=100
-            )
+        # Dados para ML
+        ml_notes = st.text_area(
+            "**Notas para Treinamento ML:**",
+            placeholder="Características específicas que podem ajudar na detecção automática...",
+            height=80
+        )
 
-            # Dados para ML
-            ml_notes = st.text_area(
-                "**Notas para Treinamento ML:**",
-                placeholder="Características específicas que podem ajudar na detecção automática...",
-                height=80
+        # Mesclar duplicatas: a avaliação vale para todo o grupo
+        duplicate_members = cluster_members(current_plant)
+        apply_to_duplicates = False
+        if duplicate_members:
+            apply_to_duplicates = st.checkbox(
+                f"🔗 Aplicar às {len(duplicate_members)} duplicata(s) do grupo",
+                value=True
             )
 
-            submitted = st.form_submit_button(
-                "✅ SALVAR AVALIAÇÃO",
-                type="primary",
-                use_container_width=True
-            )
+        submitted = st.form_submit_button(
+            "✅ SALVAR AVALIAÇÃO",
+            type="primary",
+            use_container_width=True
+        )
 
-            if submitted:
-                assessment_data = {
-                    'plant_index': current_plant,
-                    'municipio': planta['Municipio'],
-                    'latitude': planta['Latitude'],
-                    'longitude': planta['Longitude'],
-                    'has_plant': has_plant,
-                    'tech_level': tech_level,
-                    'confidence': confidence,
-                    'observations': observations,
-                    'ml_notes': ml_notes,
-                    'technology_count': len(st.session_state.technology_coordinates.get(plant_id, [])),
-                    'timestamp': datetime.now().isoformat(),
-                    'validation_status': 'PENDING',
-                    'assessor': 'Prof. Bruna Moraes'
-                }
+        if submitted and not holds_lease():
+            st.error(f"🔒 Não salvo: planta reservada por {st.session_state.lease_holder}")
+        elif submitted:
+            assessment_data = {
+                'plant_index': current_plant,
+                'municipio': planta['Municipio'],
+                'latitude': planta['Latitude'],
+                'longitude': planta['Longitude'],
+                'has_plant': has_plant,
+                'tech_level': tech_level,
+                'confidence': confidence,
+                'observations': observations,
+                'ml_notes': ml_notes,
+                'technology_count': len(st.session_state.technology_coordinates.get(plant_id, [])),
+                'timestamp': datetime.now().isoformat(),
+                'validation_status': 'PENDING',
+                'assessor': st.session_state.assessor.strip()
+            }
+
+            if apply_to_duplicates:
+                for member in duplicate_members:
+                    member_data = dict(assessment_data)
+                    member_data.update({
+                        'plant_index': member,
+                        'latitude': df_plantas['Latitude'].iat[member],
+                        'longitude': df_plantas['Longitude'].iat[member],
+                        'duplicate_of': plant_id,
+                        'technology_count': 0
+                    })
+                    save_assessment(get_plant_catalog(df_plantas).plant_id(member), member_data)
 
-                csv_filename = save_assessment(plant_id, assessment_data)
-
-                # Feedback baseado na confiança e exportação CSV
-                if confidence >= 90:
-                    st.success(f"🎯 Avaliação salva com alta confiança ({confidence}%)!")
-                elif confidence >= 70:
-                    st.success(f"✅ Avaliação salva com boa confiança ({confidence}%)!")
-                else:
-                    st.warning(f"⚠️ Avaliação salva com baixa confiança ({confidence}%). Considere revisar.")
-
-                # Confirmar exportação CSV
-                if csv_filename:
-                    st.info(f"📊 Dados exportados automaticamente para: {csv_filename}")
-
-                # Auto-avançar
-                if current_plant < total_plantas - 1:
-                    st.session_state.plant_index = current_plant + 1
-                    st.rerun()
-                else:
-                    st.balloons()
-                    st.success("🎉 Todas as plantas foram avaliadas!")
-
-        # Mostrar avaliação atual
-        if plant_id in st.session_state.assessments:
-            current_assessment = st.session_state.assessments[plant_id]
-            status = current_assessment.get('validation_status', 'PENDING')
-
-            st.markdown("### 📋 AVALIAÇÃO ATUAL")
-            st.markdown(f"""
-            <div class="assessment-card certainty-{'high' if current_assessment['confidence'] >= 80 else 'medium' if current_assessment['confidence'] >= 60 else 'low'}">
-                <strong>Status:</strong> {status}<br>
-                <strong>Tecnologia:</strong> {current_assessment['tech_level']}<br>
-                <strong>Confiança:</strong> {current_assessment['confidence']}%<br>
-                <strong>Tecnologias Mapeadas:</strong> {current_assessment.get('technology_count', 0)}
-            </div>
-            """, unsafe_allow_html=True)
+            save_assessment(plant_id, assessment_data)
 
-# Seção de validação (para Professor Bruna)
-if st.session_state.assessments:
+            # Feedback baseado na confiança
+            if confidence >= 90:
+                st.success(f"🎯 Avaliação salva com alta confiança ({confidence}%)!")
+            elif confidence >= 70:
+                st.success(f"✅ Avaliação salva com boa confiança ({confidence}%)!")
+            else:
+                st.warning(f"⚠️ Avaliação salva com baixa confiança ({confidence}%). Considere revisar.")
+
+            # Auto-avançar para a próxima planta livre (reservada para este avaliador)
+            free_plant = checkout_next_plant(current_plant, st.session_state.assessor.strip())
+            if free_plant is None:
+                free_plant = next_plant
+            if free_plant is not None:
+                st.session_state.plant_index = free_plant
+                st.rerun()
+            else:
+                st.balloons()
+                st.success("🎉 Todas as plantas foram avaliadas!")
+
+    # Mostrar avaliação atual
+    if plant_id in st.session_state.assessments:
+        current_assessment = st.session_state.assessments[plant_id]
+        status = current_assessment.get('validation_status', 'PENDING')
+
+        st.markdown("### 📋 AVALIAÇÃO ATUAL")
+        st.markdown(f"""
+        <div class="assessment-card certainty-{'high' if current_assessment['confidence'] >= 80 else 'medium' if current_assessment['confidence'] >= 60 else 'low'}">
+            <strong>Status:</strong> {status}<br>
+            <strong>Tecnologia:</strong> {current_assessment['tech_level']}<br>
+            <strong>Confiança:</strong> {current_assessment['confidence']}%<br>
+            <strong>Tecnologias Mapeadas:</strong> {current_assessment.get('technology_count', 0)}
+        </div>
+        """, unsafe_allow_html=True)
+
+@st.fragment
+@timed_section('validação')
+def render_validation_panel():
+    """Painel de validação das avaliações pendentes"""
     st.markdown("---")
     st.markdown("## 🔍 PAINEL DE VALIDAÇÃO")
 
     col1, col2 = st.columns([3, 1])
 
+    queue = st.session_state.validation_queue
+    validation_key = None
     with col1:
-        pending_assessments = [
-            (k, v) for k, v in st.session_state.assessments.items()
-            if v.get('validation_status') == 'PENDING'
-        ]
+        bucket_col, order_col = st.columns(2)
+        with bucket_col:
+            bucket = st.selectbox(
+                "Fila:",
+                list(VALIDATION_BUCKETS),
+                key='validation_bucket',
+                format_func=lambda x: f"{VALIDATION_BUCKETS[x]} ({queue.count(x)})"
+            )
+        with order_col:
+            order = st.selectbox(
+                "Ordem:",
+                list(VALIDATION_ORDERS),
+                key='validation_order',
+                format_func=lambda x: VALIDATION_ORDERS[x]
+            )
+        queued_count = queue.count(bucket)
+
+        if queued_count:
+            st.info(f"📋 {queued_count} avaliações em {VALIDATION_BUCKETS[bucket]}")
 
-        if pending_assessments:
-            st.info(f"📋 {len(pending_assessments)} avaliações aguardando validação")
+            offset = 0
+            if queued_count > VALIDATION_PAGE_SIZE:
+                pages = -(-queued_count // VALIDATION_PAGE_SIZE)
+                offset = (st.number_input(f"Página da fila (de {pages}):", 1, pages, 1) - 1) * VALIDATION_PAGE_SIZE
 
-            # Seletor de avaliação para validar
+            # Seletor de avaliação para validar (apenas a página visível)
             validation_key = st.selectbox(
                 "Selecionar para Validação:",
-                [k for k, v in pending_assessments],
-                format_func=lambda x: f"{st.session_state.assessments[x]['municipio']} - {st.session_state.assessments[x]['tech_level']}"
+                queue.page(bucket, order, offset, VALIDATION_PAGE_SIZE),
+                format_func=queue.label
             )
 
             if validation_key:
@@ -727,11 +1142,13 @@ if st.session_state.assessments:
 
                 if assessment.get('observations'):
                     st.write(f"**Observações:** {assessment['observations']}")
-        else:
+        elif bucket == 'PENDING':
             st.success("✅ Todas as avaliações foram validadas!")
+        else:
+            st.caption(f"Nenhuma avaliação em {VALIDATION_BUCKETS[bucket]}")
 
     with col2:
-        if pending_assessments and 'validation_key' in locals():
+        if validation_key:
             st.markdown("### ✅ VALIDAÇÃO")
 
             validation_status = st.selectbox(
@@ -756,50 +1173,168 @@ if st.session_state.assessments:
             )
 
             if st.button("💾 Salvar Validação", type="primary"):
-                st.session_state.assessments[validation_key].update({
+                validation = {
                     'validation_status': validation_status,
                     'validation_confidence': validation_confidence,
                     'validation_notes': validation_notes,
                     'validation_date': datetime.now().isoformat(),
-                    'validator': 'Prof. Bruna Moraes'
-                })
+                    'validator': st.session_state.assessor.strip()
+                }
+                previous = dict(st.session_state.assessments[validation_key])
+                st.session_state.assessments[validation_key].update(validation)
+                st.session_state.counters.replace_assessment(
+                    previous, st.session_state.assessments[validation_key]
+                )
+                st.session_state.validation_queue.update(
+                    validation_key, st.session_state.assessments[validation_key]
+                )
+                st.session_state.validation_data[validation_key] = validation
+                record_event('validation', validation_key, validation)
+                refresh_ml_export(validation_key)
 
                 st.success("✅ Validação salva!")
-                st.rerun()
-
-else:
-    st.warning("⚠️ Nenhuma avaliação foi realizada ainda.")
-    st.info("📋 Use o formulário acima para começar a avaliar as plantas de biogás.")
-
-# Resumo final e estatísticas
-if st.session_state.assessments:
+                # Só a fila muda de forma visível; os totais das outras seções
+                # acompanham na próxima execução completa
+                st.rerun(scope="fragment")
+
+@st.fragment
+@timed_section('resumo')
+def render_final_summary(total_plantas):
+    """Resumo estatístico final"""
     st.markdown("---")
     st.markdown("## 📊 RESUMO ESTATÍSTICO FINAL")
 
     stats_col1, stats_col2, stats_col3, stats_col4 = st.columns(4)
 
-    assessments_list = list(st.session_state.assessments.values())
-    tech_levels = [a.get('tech_level', 'UNKNOWN') for a in assessments_list]
-    confidences = [a.get('confidence', 0) for a in assessments_list]
+    counters = st.session_state.counters
+    tech_counts = counters.tech_levels
+    total_assessed, avg_confidence = counters.assessed, counters.avg_confidence
 
     with stats_col1:
-        st.metric("🔴 BAIXA", tech_levels.count('BAIXA'))
-        st.metric("🟡 MÉDIA", tech_levels.count('MEDIA'))
+        st.metric("🔴 BAIXA", tech_counts.get('BAIXA', 0))
+        st.metric("🟡 MÉDIA", tech_counts.get('MEDIA', 0))
 
     with stats_col2:
-        st.metric("🟢 ALTA", tech_levels.count('ALTA'))
-        st.metric("⚪ SEM PLANTA", tech_levels.count('SEM_PLANTA'))
+        st.metric("🟢 ALTA", tech_counts.get('ALTA', 0))
+        st.metric("⚪ SEM PLANTA", tech_counts.get('SEM_PLANTA', 0))
 
     with stats_col3:
-        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
         st.metric("📊 Confiança Média", f"{avg_confidence:.1f}%")
 
-        total_coords = sum(len(coords) for coords in st.session_state.technology_coordinates.values())
+        total_coords = counters.coordinates
         st.metric("🎯 Coordenadas Mapeadas", total_coords)
 
     with stats_col4:
-        validated = len([a for a in assessments_list if a.get('validation_status') == 'VALIDATED'])
+        validated = counters.status_count('VALIDATED')
         st.metric("✅ Validadas", validated)
 
-        completion = len(assessments_list) / total_plantas * 100 if total_plantas > 0 else 0
-        st.metric("📈 Progresso", f"{completion:.1f}%")
\ No newline at end of file
+        completion = total_assessed / total_plantas * 100 if total_plantas > 0 else 0
+        st.metric("📈 Progresso", f"{completion:.1f}%")
+
+
+# Carregar dados
+df_plantas = load_plant_data()
+
+if df_plantas is not None:
+    total_plantas = len(df_plantas)
+
+    # Avaliador identificado: cada um reserva a planta em que está trabalhando
+    with st.sidebar:
+        st.markdown("### 👤 AVALIADOR")
+        assessor = st.text_input("Nome do avaliador:", key='assessor', placeholder="Seu nome").strip()
+    if not assessor:
+        st.info("👤 Informe seu nome na barra lateral para começar a avaliar.")
+        st.stop()
+
+    # Sidebar - Navegação e Controles
+    with st.sidebar:
+        st.markdown("### 🎯 NAVEGAÇÃO")
+
+        # Seletor de planta
+        current_plant = render_plant_picker(st.session_state.plant_index)
+        st.session_state.plant_index = current_plant
+        current_plant_id = get_plant_catalog(df_plantas).plant_id(current_plant)
+        if st.session_state.get('synced_plant') != current_plant_id:
+            sync_plant(current_plant_id)
+            st.session_state.synced_plant = current_plant_id
+        st.session_state.lease_holder = get_database().acquire_lease(LEASE_SCOPE, current_plant_id, assessor)
+        if st.session_state.lease_holder != assessor:
+            st.warning(f"🔒 Planta em avaliação por {st.session_state.lease_holder}")
+
+        # Navegação rápida
+        col1, col2 = st.columns(2)
+        previous_plant = step_plant(current_plant, -1)
+        next_plant = step_plant(current_plant, 1)
+        with col1:
+            if st.button("⬅️ Anterior", use_container_width=True) and previous_plant is not None:
+                st.session_state.plant_index = previous_plant
+                st.rerun()
+        with col2:
+            if st.button("Próxima ➡️", use_container_width=True) and next_plant is not None:
+                st.session_state.plant_index = next_plant
+                st.rerun()
+        if st.button("🎯 Próxima livre", use_container_width=True,
+                     help="Reserva a próxima planta sem avaliação e sem outro avaliador"):
+            free_plant = checkout_next_plant(current_plant, assessor)
+            if free_plant is None:
+                st.info("✅ Nenhuma planta livre restante")
+            else:
+                st.session_state.plant_index = free_plant
+                st.rerun()
+        active = get_database().active_leases(LEASE_SCOPE)
+        if len(active) > 1:
+            st.caption(f"👥 {len(active)} avaliadores trabalhando agora")
+
+        duplicate_count = int(df_plantas['is_duplicate'].sum())
+        if duplicate_count:
+            st.checkbox(
+                f"⏭️ Pular duplicatas ({duplicate_count})",
+                value=True,
+                key='skip_duplicates',
+                help=f"Pontos a menos de {DUPLICATE_RADIUS_M} m de uma planta anterior"
+            )
+
+        # Pré-classificação: revisar primeiro onde o modelo mais hesita
+        if st.button("🤖 Atualizar pré-classificação", use_container_width=True,
+                     help="Treina com as avaliações salvas e prevê o nível das plantas restantes"):
+            with st.spinner("Treinando e prevendo..."):
+                summary = run_preclassification(get_plant_catalog(df_plantas).frame(), get_database(), get_local_rasters().rasters.values())
+            if summary['predicted']:
+                accuracy = summary['holdout_accuracy']
+                st.success(f"🤖 {summary['predicted']} plantas pré-classificadas com {summary['labelled']} rótulos"
+                           + (f" (acurácia estimada {accuracy:.0%})" if accuracy is not None else ""))
+            else:
+                st.info(f"🤖 São necessárias ao menos {MIN_TRAINING_SAMPLES} avaliações com dois níveis diferentes")
+        if get_database().prediction_count():
+            st.checkbox(
+                "🎯 Incertas primeiro",
+                key='uncertain_first',
+                help="'Próxima livre' segue a incerteza da pré-classificação"
+            )
+
+        render_sidebar_progress(total_plantas)
+
+    # Aquecer o cache de tiles das próximas plantas
+    prefetch_upcoming_tiles(current_plant)
+
+    # Layout principal
+    col1, col2 = st.columns([2.2, 1.8])
+
+    with col1:
+        render_map_section(current_plant, total_plantas)
+
+    with col2:
+        render_assessment_section(current_plant, next_plant)
+
+# Seção de validação (para Professor Bruna)
+if st.session_state.assessments:
+    render_validation_panel()
+else:
+    st.warning("⚠️ Nenhuma avaliação foi realizada ainda.")
+    st.info("📋 Use o formulário acima para começar a avaliar as plantas de biogás.")
+
+# Resumo final e estatísticas
+if st.session_state.assessments and df_plantas is not None:
+    render_final_summary(total_plantas)
+
+st.session_state.render_timings['execução completa'] = time.perf_counter() - _run_start